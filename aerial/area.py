@@ -2,7 +2,10 @@ import os
 import cv2
 import numpy as np 
 
-from aerial.tile import Tile, deg2num, num2deg
+from aerial.tile import Tile
+from aerial.slippy import extent_to_tiles, tiles_to_extent
+from aerial.quantize import quantize_grid, quantized_filename
+from aerial.fourier import fit_fourier, fourier_filename
 from utils.util import haversine
 
 
@@ -94,15 +97,11 @@ class Area():
         return routes
 
     def get_working_bbox_in_tile_coordinates(self):
-        extent =self.workingbbox
-        xmin, ymin = deg2num(extent[2],extent[1],self.zoom)
-        xmax, ymax = deg2num(extent[0],extent[3],self.zoom)
+        xmin, ymin, xmax, ymax = extent_to_tiles(self.workingbbox, self.zoom)
         return [ymin, xmin, ymax, xmax]
 
     def get_total_bbox_in_tile_coordinates(self):
-        extent =self.totalbbox
-        xmin, ymin = deg2num(extent[2],extent[1],self.zoom)
-        xmax, ymax = deg2num(extent[0],extent[3],self.zoom)
+        xmin, ymin, xmax, ymax = extent_to_tiles(self.totalbbox, self.zoom)
         return [ymin, xmin, ymax, xmax]
 
     def get_area_size_in_tiles(self):
@@ -132,8 +131,7 @@ class Area():
 
     def get_map_grid_for_mpl(self):
         ymin, xmin, ymax, xmax = self.get_working_bbox_in_tile_coordinates()
-        max_lat, min_lon = num2deg(xmin, ymin, self.zoom)
-        min_lat, max_lon = num2deg(xmax+1,ymax+1, self.zoom)
+        min_lat, min_lon, max_lat, max_lon = tiles_to_extent([xmin, ymin, xmax, ymax], self.zoom)
         grid = [min_lon,max_lon,min_lat,max_lat]
         return grid
 
@@ -173,10 +171,28 @@ class Area():
         arclengthlon = disp_in_meters[1] * self.arcllon / (1000*self.world_size_x)
         return (arclengthlat, arclengthlon)
 
-    def get_map_descriptors(self, model, epoch='latest'):
+    def get_map_descriptors(self, model, epoch='latest', dtype='float64', harmonics=0):
+        """ Returns the descriptors and coordinates of the working area, descriptors are in dtype.
+
+            float16 and int8 grids are read from the file written by aerial.quantize if it exists,
+            otherwise the float64 grid is quantized when it is loaded. If harmonics is not 0 the orientation
+            axis is replaced by the coefficients of its Fourier series, read from the file written by
+            aerial.fourier or fitted when the grid is loaded.
+        """
         dataFilename = os.path.join( self.results_dir, model, epoch + '_' + self.name + '_z_' + str(self.zoom) + '.npz')
-        descriptors = np.load(dataFilename)['X']
-        area_coords = np.load(dataFilename)['coords'] 
+        fourierFilename = fourier_filename(dataFilename, harmonics)
+        quantizedFilename = quantized_filename(dataFilename, dtype)
+        if harmonics > 0 and os.path.isfile(fourierFilename):
+            dataFilename = fourierFilename
+        elif harmonics == 0 and dtype in ['float16', 'int8'] and os.path.isfile(quantizedFilename):
+            dataFilename = quantizedFilename
+        data = np.load(dataFilename)
+        descriptors = data['X']
+        area_coords = data['coords']
+        if harmonics > 0 and dataFilename != fourierFilename:
+            descriptors = fit_fourier(descriptors, harmonics)
+        if descriptors.dtype != np.dtype(dtype):
+            descriptors, _ = quantize_grid(descriptors, dtype)
 
         # Take descriptors of the subarea only
         ymin, xmin, ymax, xmax = self.get_working_bbox_in_tile_coordinates()
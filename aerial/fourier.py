@@ -0,0 +1,81 @@
+"""This module encodes the orientation axis of descriptor grids as a truncated Fourier series.
+
+    A (H,W,T,D) grid samples the descriptors of each cell at T headings 2*pi*j/T. Each descriptor dimension is a
+    periodic function of the heading, so it can be stored as the coefficients [a0, a1, b1, ..., aK, bK] of
+    a0 + sum_k ak*cos(k*yaw) + bk*sin(k*yaw), a (H,W,2K+1,D) grid that can be evaluated at any heading.
+
+    Usage (from the repository root):
+        python -m aerial.fourier --results_dir <results_dir> --name <model> --epoch latest --areas SP50NW --harmonics 3
+"""
+import os
+import argparse
+import numpy as np
+
+
+def fit_fourier(descriptors, harmonics):
+    """ Returns the (H,W,2K+1,D) coefficients of the least squares Fourier series with K harmonics of a (H,W,T,D) grid.
+
+        Headings are evenly spaced, so the least squares fit is the truncated discrete Fourier transform.
+        K must be lower than T/2, higher harmonics can not be recovered from T samples.
+    """
+    H, W, T, D = descriptors.shape
+    if not 0 < harmonics < T / 2:
+        raise ValueError("The number of harmonics must be between 1 and {} for {} headings".format((T-1)//2, T))
+    spectrum = np.fft.rfft(descriptors, axis=2)
+    coefficients = np.empty((H, W, 2*harmonics+1, D))
+    coefficients[:,:,0] = spectrum[:,:,0].real / T
+    coefficients[:,:,1::2] = 2 * spectrum[:,:,1:harmonics+1].real / T
+    coefficients[:,:,2::2] = -2 * spectrum[:,:,1:harmonics+1].imag / T
+    return coefficients
+
+def fourier_basis(yaw, harmonics, out=None):
+    """ Returns the (N,2K+1) values [1, cos(yaw), sin(yaw), ..., cos(K*yaw), sin(K*yaw)] of (N,) headings """
+    if out is None:
+        out = np.empty((yaw.shape[0], 2*harmonics+1))
+    out[:,0] = 1.0
+    for k in range(1, harmonics+1):
+        np.cos(k*yaw, out=out[:,2*k-1])
+        np.sin(k*yaw, out=out[:,2*k])
+    return out
+
+def evaluate_fourier(coefficients, yaw):
+    """ Descriptors of a (H,W,2K+1,D) coefficient grid at the headings of a (T,) array, as a (H,W,T,D) grid """
+    basis = fourier_basis(np.asarray(yaw, dtype=np.float64), (coefficients.shape[2] - 1) // 2)
+    return np.einsum('hwcd,tc->hwtd', coefficients, basis)
+
+def sample_fourier(coefficients):
+    """ Descriptors of a (H,W,2K+1,D) coefficient grid at the 2K+1 evenly spaced headings, which determine a series with K harmonics exactly """
+    C = coefficients.shape[2]
+    return evaluate_fourier(coefficients, 2*np.pi*np.arange(C)/C)
+
+def fourier_filename(filename, harmonics):
+    """ Name of the coefficients of a <epoch>_<area>_z_<zoom>.npz descriptor file """
+    root, ext = os.path.splitext(filename)
+    return '{}_fourier{}{}'.format(root, harmonics, ext)
+
+def convert(filename, harmonics):
+    """ Save the Fourier coefficients and coordinates of a predicted grid, returns the new file and the maximum absolute error at the sampled headings """
+    data = np.load(filename)
+    descriptors = data['X']
+    T = descriptors.shape[2]
+    coefficients = fit_fourier(descriptors, harmonics)
+    error = np.abs(evaluate_fourier(coefficients, 2*np.pi*np.arange(T)/T) - descriptors).max()
+    save_path = fourier_filename(filename, harmonics)
+    np.savez(save_path, X=coefficients, coords=data['coords'])
+    return save_path, error
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results_dir', type=str, default='results', help='Directory of the predicted descriptors')
+    parser.add_argument('--name', type=str, required=True, help='Name of the model')
+    parser.add_argument('--epoch', type=str, default='latest', help='Epoch of the predicted descriptors')
+    parser.add_argument('--areas', type=str, nargs='+', required=True, help='Areas to convert')
+    parser.add_argument('--zoom', type=int, default=18, help='Zoom level of the descriptor grid')
+    parser.add_argument('--harmonics', type=int, default=3, help='Number of harmonics of the Fourier series')
+    opt = parser.parse_args()
+
+    for area in opt.areas:
+        filename = os.path.join(opt.results_dir, opt.name, '{}_{}_z_{}.npz'.format(opt.epoch, area, opt.zoom))
+        save_path, error = convert(filename, opt.harmonics)
+        print('{} -> {} ({:.1f} MiB -> {:.1f} MiB, max abs error {:.2e})'.format(filename, save_path, os.path.getsize(filename) / 2**20, os.path.getsize(save_path) / 2**20, error))
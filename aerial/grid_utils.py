@@ -1,11 +1,9 @@
 import numpy as np 
-from aerial.tile import deg2num, num2deg
+from aerial.slippy import extent_to_tiles, tiles_to_extent
 from math import sqrt
 
 def deg2num_rect(extent, zoom=18):
-    x_min, y_min = deg2num(extent[2],extent[1], zoom)
-    x_max, y_max = deg2num(extent[0],extent[3], zoom)
-    return [x_min, y_min,x_max, y_max]
+    return extent_to_tiles(extent, zoom)
 
 def get_XY_size(extent, zoom=18):
     XYextent = deg2num_rect(extent, zoom)
@@ -32,9 +30,7 @@ def get_extent(coords):
         min_x, min_y = coords[:,:2].min(0)
         max_x, max_y = coords[:,:2].max(0)
         z = coords[0,2].item()
-        max_lat, min_lon = num2deg(min_x, min_y, z)
-        min_lat, max_lon = num2deg(max_x+1, max_y+1, z)
-        extent = [min_lat, min_lon, max_lat, max_lon]
+        extent = tiles_to_extent([min_x, min_y, max_x, max_y], z)
     else:        
         min_lat, min_lon = coords[:,:2].min(0)
         max_lat, max_lon = coords[:,:2].max(0)
@@ -57,3 +53,13 @@ def get_grid(descriptors, original_extent, working_extent, scale_factor, zoom=18
 def get_scale_factor(original_num_elements, current_num_elements):
     return int(sqrt(current_num_elements / original_num_elements))
 
+def downsample_grid(descriptors, factor=2):
+    """ Average a (H,W,T,D) descriptor grid over blocks of factor x factor cells.
+
+        The last rows and columns are replicated when H or W are not multiples of factor.
+        Coarse cell i covers fine cells [i*factor, (i+1)*factor), so its centre is at fine coordinate i*factor + (factor-1)/2.
+    """
+    H, W, T, D = descriptors.shape
+    Hc, Wc = -(-H // factor), -(-W // factor)
+    padded = np.pad(descriptors, ((0,Hc*factor-H),(0,Wc*factor-W),(0,0),(0,0)), mode='edge')
+    return padded.reshape(Hc, factor, Wc, factor, T, D).mean(axis=(1,3))
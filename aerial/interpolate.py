@@ -1,19 +1,21 @@
 import torch
 import numpy as np
 
+from aerial.fourier import fourier_basis
+
 dtype = torch.cuda.FloatTensor
 dtype_long = torch.cuda.LongTensor
 
 def trilinear_interpolation_numpy(descriptor_grid, y, x, t):
-    H,W,_,_ = descriptor_grid.shape
+    H,W,T,_ = descriptor_grid.shape
 
     x0 = np.floor(x).astype(int)
     y0 = np.floor(y).astype(int)
-    t0 = np.floor(t).astype(int) % 8
+    t0 = np.floor(t).astype(int) % T
 
     x1 = x0 + 1
     y1 = y0 + 1
-    t1 = (t0 + 1) % 8
+    t1 = (t0 + 1) % T
 
     # Clip values
     y0 = np.clip(y0,0,H-1)
@@ -48,15 +50,15 @@ def trilinear_interpolation_numpy(descriptor_grid, y, x, t):
     return descriptors
 
 def trilinear_interpolation_torch(descriptor_grid, y, x, t):
-    H,W,_,_ = descriptor_grid.shape
+    H,W,T,_ = descriptor_grid.shape
     
     x0 = torch.floor(x).long()
     y0 = torch.floor(y).long()
-    t0 = torch.floor(t).long() % 8
+    t0 = torch.floor(t).long() % T
 
     x1 = x0 + 1
     y1 = y0 + 1
-    t1 = (t0 + 1) % 8
+    t1 = (t0 + 1) % T
 
     # Clip values
     y0 = torch.clamp(y0,0,H-1)
@@ -64,9 +66,9 @@ def trilinear_interpolation_torch(descriptor_grid, y, x, t):
     y1 = torch.clamp(y1,0,H-1)
     x1 = torch.clamp(x1,0,W-1)
 
-    yd = (y - y0.float()).view(-1,1)   
-    xd = (x - x0.float()).view(-1,1)   
-    td = (t - t0.float()).view(-1,1)
+    yd = (y - y0).view(-1,1)   
+    xd = (x - x0).view(-1,1)   
+    td = (t - t0).view(-1,1)
 
     xdc = 1 - xd    
     ydc = 1 - yd    
@@ -89,3 +91,35 @@ def trilinear_interpolation_torch(descriptor_grid, y, x, t):
     norm = torch.norm(c,dim=1, keepdim=True)
     descriptors = c / norm
     return descriptors
+
+def fourier_interpolation_numpy(coefficient_grid, y, x, t):
+    """ Interpolate a (H,W,2K+1,D) Fourier coefficient grid bilinearly in (y, x) and evaluate it at heading 2*pi*t/(2K+1) """
+    H,W,C,D = coefficient_grid.shape
+
+    x0 = np.floor(x).astype(int)
+    y0 = np.floor(y).astype(int)
+    x1 = x0 + 1
+    y1 = y0 + 1
+
+    # Clip values, like trilinear_interpolation_numpy
+    y0 = np.clip(y0,0,H-1)
+    x0 = np.clip(x0,0,W-1)
+    y1 = np.clip(y1,0,H-1)
+    x1 = np.clip(x1,0,W-1)
+
+    yd = np.expand_dims((y - y0),(1,2))
+    xd = np.expand_dims((x - x0),(1,2))
+
+    # Interpolate coefficients in y and x directions
+    c0 = coefficient_grid[y0,x0]*(1 - yd) + coefficient_grid[y1,x0]*yd
+    c1 = coefficient_grid[y0,x1]*(1 - yd) + coefficient_grid[y1,x1]*yd
+    c = c0*(1 - xd) + c1*xd
+
+    # Evaluate the series
+    basis = fourier_basis(2*np.pi*np.asarray(t, dtype=np.float64)/C, (C - 1) // 2)
+    c = np.einsum('ncd,nc->nd', c, basis)
+
+    # Normalize descriptors 
+    norm = np.linalg.norm(c,axis=1,keepdims=True)
+    descriptors = c / norm
+    return descriptors
@@ -0,0 +1,343 @@
+from contextlib import nullcontext
+import numpy as np
+
+from aerial.grid_utils import downsample_grid
+from aerial.fourier import fourier_basis
+
+
+def phase(profiler, name):
+    """ Context manager timing a phase with a StepProfiler (see utils/profiler.py), it does nothing if profiler is None """
+    return profiler.phase(name) if profiler is not None else nullcontext()
+
+
+class TrilinearGrid():
+    """ Computes the eight trilinear corners of continuous (y, x, t) grid coordinates in reusable buffers.
+
+        Corners are clipped like in trilinear_interpolation_numpy and the orientation axis wraps around.
+        Buffers grow on demand and are reused between calls.
+    """
+
+    def __init__(self, shape, capacity=0):
+        """
+            Parameters:
+                shape    -> (H,W,T) size of the grid
+                capacity -> Number of particles the buffers are initially allocated for
+        """
+        self.H, self.W, self.T = shape
+        self.capacity = 0
+        self.reserve(capacity)
+
+    def reserve(self, n):
+        """ Make sure buffers can hold n particles """
+        if n <= self.capacity:
+            return
+        self._int = np.empty((7, n), dtype=np.int64)            # y0, y1, x0, x1, t0, t1, index
+        self._float = np.empty((9, n))                           # yd, ydc, xd, xdc, td, tdc, wyx, w, out
+        self._base = np.empty(n, dtype=np.int64)
+        self.capacity = n
+
+    def bilinear(self, y, x):
+        """ Yields (base, weight) for each of the four (y, x) corners, base is the flat index (y*W + x)*T of orientation 0.
+
+            Both arrays are internal buffers overwritten at the next iteration.
+        """
+        n = y.shape[0]
+        self.reserve(n)
+        H, W, T = self.H, self.W, self.T
+
+        y0, y1, x0, x1 = (b[:n] for b in self._int[:4])
+        yd, ydc, xd, xdc = (b[:n] for b in self._float[:4])
+        wyx = self._float[6,:n]
+        base = self._base[:n]
+
+        np.floor(y, out=yd); y0[...] = yd
+        np.floor(x, out=xd); x0[...] = xd
+        np.add(y0, 1, out=y1)
+        np.add(x0, 1, out=x1)
+        for c, limit in ((y0, H), (y1, H), (x0, W), (x1, W)):
+            np.clip(c, 0, limit-1, out=c)
+
+        # Fractional parts
+        np.subtract(y, y0, out=yd); np.subtract(1, yd, out=ydc)
+        np.subtract(x, x0, out=xd); np.subtract(1, xd, out=xdc)
+
+        np.multiply(y0, W*T, out=y0)
+        np.multiply(y1, W*T, out=y1)
+        np.multiply(x0, T, out=x0)
+        np.multiply(x1, T, out=x1)
+
+        for ry, wy in ((y0, ydc), (y1, yd)):
+            for cx, wx in ((x0, xdc), (x1, xd)):
+                np.multiply(wy, wx, out=wyx)
+                np.add(ry, cx, out=base)
+                yield base, wyx
+
+    def corners(self, y, x, t):
+        """ Yields (index, weight) for each of the eight corners, index is the flat index (y*W + x)*T + t.
+
+            Both arrays are internal buffers overwritten at the next iteration.
+        """
+        n = y.shape[0]
+        self.reserve(n)
+        T = self.T
+
+        t0, t1, index = (b[:n] for b in self._int[4:])
+        td, tdc, _, w = (b[:n] for b in self._float[4:8])
+
+        np.floor(t, out=td); t0[...] = td
+        np.remainder(t0, T, out=t0)
+        np.add(t0, 1, out=t1)
+        np.remainder(t1, T, out=t1)
+        np.subtract(t, t0, out=td); np.subtract(1, td, out=tdc)
+
+        for base, wyx in self.bilinear(y, x):
+            for ct, wt in ((t0, tdc), (t1, td)):
+                np.add(base, ct, out=index)
+                np.multiply(wyx, wt, out=w)
+                yield index, w
+
+    def output(self, n):
+        """ A (n,) buffer not used by corners() """
+        self.reserve(n)
+        return self._float[8,:n]
+
+
+class FusedLikelihood(TrilinearGrid):
+    """ Interpolates the descriptor grid at particle poses and scores them against an observation in one pass.
+
+        It gives the same result as trilinear_interpolation_numpy followed by pairwise_distances, but it
+        accumulates the eight trilinear corners in a preallocated (N,D) buffer and uses the dot product
+        formulation of the distance, ||s*c/|c| - a||^2 = s^2 + |a|^2 - 2*s*(c.a)/|c|, so no (N,D) temporaries
+        are created. The grid can also be float32, float16 or int8 (see aerial/quantize.py): corners are gathered in
+        the grid dtype, so four or eight times fewer bytes are read than with float64, and accumulated in float32.
+        The interpolated descriptor is normalized, therefore the int8 scale does not need to be applied.
+    """
+
+    def __init__(self, descriptor_grid, scale, capacity=0):
+        """
+            Parameters:
+                descriptor_grid -> A (H,W,T,D) array of map descriptors, float64, float32, float16 or int8
+                scale           -> Radius of the hypersphere, descriptors are multiplied by it before comparison
+                capacity        -> Number of particles the buffers are initially allocated for
+        """
+        self.D = descriptor_grid.shape[3]
+        self.flat = descriptor_grid.reshape(-1, self.D)       # A view if the grid is contiguous
+        self.dtype = np.float64 if self.flat.dtype == np.float64 else np.float32
+        self.scale = scale
+        TrilinearGrid.__init__(self, descriptor_grid.shape[:3], capacity)
+
+    def reserve(self, n):
+        if n <= self.capacity:
+            return
+        width = self.flat.shape[1]
+        self._acc = np.empty((n, width), dtype=self.dtype)
+        self._gather = np.empty((n, width), dtype=self.flat.dtype)
+        self._weighted = self._gather if self.flat.dtype == self.dtype else np.empty((n, width), dtype=self.dtype)
+        self._reduced = np.empty((3, n), dtype=self.dtype)    # corner weight, |c| and c.a
+        TrilinearGrid.reserve(self, n)
+
+    def accumulate(self, corners, n):
+        """ Returns the sum of the rows of the grid at each (index, weight) of corners, in an internal (n,D) buffer """
+        acc = self._acc[:n]
+        gather = self._gather[:n]
+        weighted = self._weighted[:n]
+        weight = self._reduced[0,:n]
+
+        for k, (index, w) in enumerate(corners):
+            np.take(self.flat, index, axis=0, out=gather, mode='clip')
+            if w.dtype != self.dtype:
+                np.copyto(weight, w, casting='same_kind')
+                w = weight
+            if gather is not weighted:
+                np.copyto(weighted, gather)                      # Dequantize
+            if k == 0:
+                np.multiply(weighted, w[:,None], out=acc)
+            else:
+                weighted *= w[:,None]
+                acc += weighted
+        return acc
+
+    def likelihood(self, c, observation):
+        """ Returns the likelihood of (n,D) interpolated descriptors c, which do not need to be normalized """
+        n = c.shape[0]
+        norm, dot = self._reduced[1:,:n]
+        score = self.output(n)
+
+        # Distances to the observation
+        a = np.asarray(observation, dtype=c.dtype).reshape(-1)
+        s = self.scale
+        np.einsum('ij,ij->i', c, c, out=norm)                  # |c|^2
+        np.sqrt(norm, out=norm)
+        np.dot(c, a, out=dot)                                    # c.a
+        np.divide(dot, norm, out=dot)
+        np.multiply(dot, -2*s, out=score)
+        score += s*s + np.dot(a, a)
+        np.maximum(score, 0.0, out=score)
+        np.sqrt(score, out=score)                                # distance
+
+        # Likelihood
+        np.subtract(2*s, score, out=score)
+        score /= 2*s
+        return score
+
+    def __call__(self, y, x, t, observation, profiler=None):
+        """ Returns the likelihood of each particle given grid coordinates (y, x, t) and a (D,) or (1,D) observation.
+
+            The returned array is an internal buffer, it is overwritten in the next call. If a profiler is given,
+            gathering the corners is timed as the interpolate phase and the distances as the weight phase.
+        """
+        n = y.shape[0]
+        self.reserve(n)
+        with phase(profiler, 'interpolate'):
+            c = self.accumulate(self.corners(y, x, t), n)
+        with phase(profiler, 'weight'):
+            return self.likelihood(c, observation)
+
+
+class FourierLikelihood(FusedLikelihood):
+    """ FusedLikelihood over a grid whose orientation axis is a Fourier series (see aerial/fourier.py).
+
+        The (H,W,2K+1,D) coefficients of the four (y, x) corners are interpolated bilinearly and the series is
+        evaluated at the particle's heading in closed form, so any heading is scored without blending sampled
+        orientations. t is expressed in units of 2*pi/(2K+1), as get_grid_coordinates computes it from the grid shape.
+    """
+
+    def __init__(self, coefficients, scale, capacity=0):
+        """
+            Parameters:
+                coefficients -> A (H,W,2K+1,D) array of Fourier coefficients of the map descriptors
+                scale        -> Radius of the hypersphere, descriptors are multiplied by it before comparison
+                capacity     -> Number of particles the buffers are initially allocated for
+        """
+        H, W, C, D = coefficients.shape
+        self.C, self.D = C, D
+        self.harmonics = (C - 1) // 2
+        self.flat = coefficients.reshape(H*W, C*D)           # A row holds the coefficients of a cell
+        self.dtype = np.float64 if self.flat.dtype == np.float64 else np.float32
+        self.scale = scale
+        TrilinearGrid.__init__(self, (H, W, 1), capacity)
+
+    def reserve(self, n):
+        if n <= self.capacity:
+            return
+        self._basis = np.empty((n, self.C), dtype=self.dtype)
+        self._descriptors = np.empty((n, self.D), dtype=self.dtype)
+        FusedLikelihood.reserve(self, n)
+
+    def __call__(self, y, x, t, observation, profiler=None):
+        """ Returns the likelihood of each particle, the returned array is overwritten in the next call """
+        n = y.shape[0]
+        self.reserve(n)
+        with phase(profiler, 'interpolate'):
+            acc = self.accumulate(self.bilinear(y, x), n)
+            basis = fourier_basis(t * (2*np.pi / self.C), self.harmonics, out=self._basis[:n])
+            c = self._descriptors[:n]
+            np.einsum('ncd,nc->nd', acc.reshape(n, self.C, self.D), basis, out=c)
+        with phase(profiler, 'weight'):
+            return self.likelihood(c, observation)
+
+
+class LookupLikelihood(TrilinearGrid):
+    """ Scores every grid descriptor against the observation and interpolates the resulting likelihoods.
+
+        The (H,W,T) likelihood volume costs H*W*T*D operations per step, independently of the number of
+        particles, and each particle then only gathers eight scalars. It is cheaper than FusedLikelihood
+        when there are more particles than grid cells. Note that it interpolates distances of the grid
+        descriptors instead of computing the distance of the interpolated descriptor. Float16 and int8 grids are
+        normalized to float32.
+    """
+
+    def __init__(self, descriptor_grid, scale, capacity=0):
+        H, W, T, D = descriptor_grid.shape
+        flat = descriptor_grid.reshape(-1, D).astype(np.result_type(descriptor_grid.dtype, np.float32), copy=False)
+        self.unit = flat / np.linalg.norm(flat, axis=1, keepdims=True)
+        self.volume = np.empty(H*W*T, dtype=self.unit.dtype)
+        self.scale = scale
+        TrilinearGrid.__init__(self, (H, W, T), capacity)
+
+    def reserve(self, n):
+        if n <= self.capacity:
+            return
+        self._gather = np.empty(n, dtype=self.volume.dtype)
+        TrilinearGrid.reserve(self, n)
+
+    def __call__(self, y, x, t, observation, profiler=None):
+        """ Returns the likelihood of each particle, the returned array is overwritten in the next call.
+
+            If a profiler is given, scoring the grid is timed as the weight phase and gathering the corners as the interpolate phase.
+        """
+        n = y.shape[0]
+        a = np.asarray(observation, dtype=self.unit.dtype).reshape(-1)
+        s = self.scale
+
+        # Likelihood of each grid cell
+        volume = self.volume
+        with phase(profiler, 'weight'):
+            np.dot(self.unit, a, out=volume)
+            volume *= -2*s
+            volume += s*s + np.dot(a, a)
+            np.maximum(volume, 0.0, out=volume)
+            np.sqrt(volume, out=volume)
+            np.subtract(2*s, volume, out=volume)
+            volume /= 2*s
+
+        # Interpolate likelihoods at particles
+        with phase(profiler, 'interpolate'):
+            self.reserve(n)
+            gather = self._gather[:n]
+            score = self.output(n)
+            for k, (index, w) in enumerate(self.corners(y, x, t)):
+                np.take(volume, index, out=gather, mode='clip')
+                if k == 0:
+                    np.multiply(gather, w, out=score)
+                else:
+                    gather *= w
+                    score += gather
+        return score
+
+
+class HierarchicalLikelihood():
+    """ Coarse-to-fine likelihood.
+
+        All particles are scored with a lookup table on a grid downsampled by factor, then the fraction of
+        particles with the highest coarse posterior is rescored against the full resolution grid. Coarse
+        likelihoods are smoother and lower than the fine ones, so the remaining particles are mapped to the fine
+        scale by matching the mean and standard deviation of both likelihoods of the rescored particles.
+        This calibration is approximate, the localization error is up to twice the one of FusedLikelihood.
+    """
+
+    def __init__(self, descriptor_grid, scale, factor=2, fraction=0.2, capacity=0):
+        self.factor = factor
+        self.fraction = fraction
+        self.coarse = LookupLikelihood(downsample_grid(descriptor_grid, factor), scale, capacity)
+        self.fine = FusedLikelihood(descriptor_grid, scale, int(np.ceil(fraction * capacity)))
+
+    def __call__(self, y, x, t, observation, prior=None, profiler=None):
+        """ Returns the likelihood of each particle, prior are the current weights used to select particles to refine.
+
+            If a profiler is given, the coarse and fine likelihoods split their time between the interpolate and
+            weight phases, selecting and calibrating particles is timed as the weight phase.
+        """
+        n = y.shape[0]
+        offset = (self.factor - 1) / 2
+        with phase(profiler, 'interpolate'):
+            yc, xc = (y - offset) / self.factor, (x - offset) / self.factor
+        score = self.coarse(yc, xc, t, observation, profiler)
+
+        k = int(np.ceil(self.fraction * n))
+        if k > 0:
+            with phase(profiler, 'weight'):
+                posterior = score * prior if prior is not None else score
+                refine = np.argpartition(posterior, n-k)[n-k:]
+            with phase(profiler, 'interpolate'):
+                yr, xr, tr = y[refine], x[refine], t[refine]
+            fine = self.fine(yr, xr, tr, observation, profiler)
+            with phase(profiler, 'weight'):
+                coarse = score[refine]
+                gain = fine.std() / coarse.std() if coarse.std() > 0 else 1.0
+                score -= coarse.mean()
+                score *= gain
+                score += fine.mean()
+                np.clip(score, 0, 1, out=score)
+                score[refine] = fine
+        return score
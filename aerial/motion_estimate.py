@@ -1,84 +1,169 @@
 import cv2
-import numpy as np 
+import numpy as np
 import math
 
 class Homography():
-    def __init__(self, first_frame, verbose=False):
+    def __init__(self, first_frame, verbose=False, nfeatures=500, level=0, debug=False):
         """
-            Implements a class that estimates the Homography using point correspondances. 
+            Implements a class that estimates the Homography using point correspondances.
+
+            Parameters:
+                first_frame -> First BGR image of the sequence
+                nfeatures   -> Maximum number of ORB features detected per frame
+                level       -> Pyramid level where features are detected, frames are downsampled by 2**level
+                debug       -> If True, estimate returns an image with the matches, otherwise it returns the frame
         """
-        self.old = first_frame
-        self.old_gray = cv2.cvtColor(first_frame, cv2.COLOR_BGR2GRAY)
-        self.orb = cv2.ORB_create()
-        self.old_kp, self.old_des = self.orb.detectAndCompute(self.old_gray, None)
+        self.orb = cv2.ORB_create(nfeatures=nfeatures)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        self.level = level
+        self.debug = debug
+        self.old_kp, self.old_pts, self.old_des = self.detect(first_frame)
         self.old_frame = first_frame
         self.old_yaw = 0.0
         self.old_t = np.array([0.0,0.0])
         self.verbose = verbose
 
+    def detect(self, frame):
+        """ Returns the ORB keypoints of a frame, their (N,2) coordinates in the full resolution frame and their descriptors """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        for _ in range(self.level):
+            gray = cv2.pyrDown(gray)
+        kp, des = self.orb.detectAndCompute(gray, None)
+        pts = cv2.KeyPoint_convert(kp).reshape(-1,2) * (2 ** self.level)
+        return kp, pts, des
+
     def estimate(self, frame):
         """ This method estimates translation and yaw from the homography
         """
-        new_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        new_kp, new_des = self.orb.detectAndCompute(new_gray, None)
-        
+        new_kp, new_pts, new_des = self.detect(frame)
+        img = frame
+
         if new_des is not None and self.old_des is not None:
-            matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
-            matches = matcher.match(self.old_des, new_des)
-            matches = sorted(matches, key= lambda x:x.distance)
-            
+            matches = self.matcher.match(self.old_des, new_des)
             npoints = len(matches)
-            
+
             if npoints > 100:
-                points1 = np.zeros((len(matches),2), dtype=np.float32)
-                points2 = np.zeros((len(matches),2), dtype=np.float32)
+                index = np.array([(m.queryIdx, m.trainIdx, m.distance) for m in matches])
+                index = index[np.argsort(index[:,2], kind='stable')]                # Best matches first
+                points1 = self.old_pts[index[:,0].astype(int)].astype(np.float32)
+                points2 = new_pts[index[:,1].astype(int)].astype(np.float32)
 
-                for i,match in enumerate(matches):
-                    points1[i, :] = self.old_kp[match.queryIdx].pt
-                    points2[i, :] = new_kp[match.trainIdx].pt
-            
                 h, mask = cv2.findHomography(points1, points2, cv2.RANSAC)
-                nransac = (mask==1).sum()
-                
+                nransac = (mask==1).sum() if mask is not None else 0
+
                 if nransac > 50:
-                    matchesMask = mask.ravel().tolist()
-                    img = cv2.drawMatches(self.old_frame, self.old_kp, frame, new_kp, matches, None, matchesMask=matchesMask)
+                    if self.debug:
+                        matches = sorted(matches, key=lambda x:x.distance)
+                        img = cv2.drawMatches(self.old_frame, self.old_kp, frame, new_kp, matches, None, matchesMask=mask.ravel().tolist())
                     hn = h / h[2,2]
                     t = hn[:2,2]
 
-                    sy = math.sqrt(hn[0,0]*hn[0,0] + hn[1,0]*hn[1,0]) 
+                    sy = math.sqrt(hn[0,0]*hn[0,0] + hn[1,0]*hn[1,0])
                     singular = sy < 1e-6
 
                     if not singular:
                         yaw = math.atan2(hn[1,0],hn[0,0])
                     else:
                         yaw = 0
-    
+
                     self.old_yaw = yaw
                     self.old_t = t
-                    
+
                 else:
                     if self.verbose:
                         print("Warning! not enough points in ransac")
                     yaw = self.old_yaw
                     t = self.old_t
-                    img = frame
-            else: 
+            else:
                 if self.verbose:
                     print("Warning! not enough matched points")
-                yaw = self.old_yaw 
-                t = self.old_t 
-                img = frame
+                yaw = self.old_yaw
+                t = self.old_t
 
-        else:                  
+        else:
             yaw = self.old_yaw
-            t = self.old_t 
-            img = frame
+            t = self.old_t
 
         self.old_frame = frame
         self.old_kp = new_kp
+        self.old_pts = new_pts
         self.old_des = new_des
-        
+
         return yaw, t, img
 
 
+class PhaseCorrelation():
+    def __init__(self, first_frame, verbose=False, min_response=0.05, debug=False):
+        """
+            Implements a class that estimates a similarity transform between consecutive frames with Fourier phase correlation.
+
+            Rotation and scale are the shift between the log-polar magnitude spectra of both frames, then translation is
+            the shift between the new frame and the previous one rotated and scaled. The result is expressed as the
+            homography estimator does, yaw and the translation column of the transform from the previous to the new frame.
+
+            Parameters:
+                first_frame  -> First BGR image of the sequence
+                min_response -> Estimates whose phase correlation peak is below this value are rejected
+                debug        -> If True, estimate returns the previous frame aligned with the new one next to it, otherwise it returns the frame
+        """
+        height, width = first_frame.shape[:2]
+        self.size = (width, height)
+        self.centre = np.array([width / 2, height / 2])
+        self.radius = min(width, height) / 2
+        self.window = cv2.createHanningWindow(self.size, cv2.CV_32F)
+        fy = np.cos(np.pi * (np.arange(height) / height - 0.5))
+        fx = np.cos(np.pi * (np.arange(width) / width - 0.5))
+        ridge = np.outer(fy, fx)
+        self.highpass = ((1.0 - ridge) * (2.0 - ridge)).astype(np.float32)  # Attenuates the low frequencies shared by every frame
+        self.min_response = min_response
+        self.debug = debug
+        self.old_frame = first_frame
+        self.old_gray, self.old_polar = self.transform(first_frame)
+        self.old_yaw = 0.0
+        self.old_t = np.array([0.0,0.0])
+        self.verbose = verbose
+
+    def transform(self, frame):
+        """ Returns the grey frame and the log-polar magnitude of its spectrum """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        spectrum = cv2.dft(gray * self.window, flags=cv2.DFT_COMPLEX_OUTPUT)
+        magnitude = np.fft.fftshift(cv2.magnitude(spectrum[...,0], spectrum[...,1]))
+        magnitude = np.log1p(magnitude * self.highpass)
+        polar = cv2.warpPolar(magnitude, self.size, tuple(self.centre), self.radius, cv2.WARP_POLAR_LOG + cv2.INTER_LINEAR)
+        return gray, polar
+
+    def estimate(self, frame):
+        """ This method estimates translation and yaw from the phase correlation
+        """
+        new_gray, new_polar = self.transform(frame)
+        img = frame
+
+        (shift_rho, shift_angle), response = cv2.phaseCorrelate(self.old_polar, new_polar)
+        yaw = (2 * np.pi * shift_angle / self.size[1] + np.pi / 2) % np.pi - np.pi / 2    # The magnitude spectrum is symmetric, rotation is known up to pi
+        scale = math.exp(-shift_rho * math.log(self.radius) / self.size[0])                # Scaling the image shrinks its spectrum
+
+        c, s = scale * math.cos(yaw), scale * math.sin(yaw)
+        rotation = np.array([[c, -s], [s, c]])
+        affine = np.hstack([rotation, (self.centre - rotation @ self.centre)[:,None]])
+        aligned = cv2.warpAffine(self.old_gray, affine, self.size)
+        (tx, ty), response = cv2.phaseCorrelate(aligned * self.window, new_gray * self.window)
+
+        if response > self.min_response:
+            t = affine[:,2] + np.array([tx, ty])
+            self.old_yaw = yaw
+            self.old_t = t
+            if self.debug:
+                affine[:,2] = t
+                aligned = cv2.warpAffine(self.old_frame, affine, self.size)
+                img = np.concatenate([aligned, frame], axis=1)
+        else:
+            if self.verbose:
+                print("Warning! phase correlation response too low")
+            yaw = self.old_yaw
+            t = self.old_t
+
+        self.old_frame = frame
+        self.old_gray = new_gray
+        self.old_polar = new_polar
+
+        return yaw, t, img
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+
+
+class ObservationCache():
+    """ Stores the aerial descriptors and the odometry observed along each testing route.
+
+        Entries are keyed by (model name, epoch, area, route seed, trial, step, scale, pano_size). The model
+        name is the root directory, epoch, area, route seed and pano_size select a subdirectory, and each
+        trial is a npz file holding the (steps,D) float32 descriptors, the (steps,3) odometry (dx, dy, turn)
+        and the scale of every step. A trial is only replayed if it covers the requested steps with the same scales
+        and its odometry was estimated with the same motion estimator.
+    """
+
+    def __init__(self, root, epoch, area, seed, pano_size, odometry='homography'):
+        """
+            Parameters:
+                root      -> Directory of the model, e.g. results_dir/name
+                epoch     -> Epoch of the model weights
+                area      -> Name of the area
+                seed      -> Seed of the testing routes
+                pano_size -> Size of the aerial images given to the network
+                odometry  -> Name and settings of the motion estimator
+        """
+        self.odometry = odometry
+        self.path = os.path.join(root, 'observations', '{}_{}_{}_{}'.format(epoch, area, seed, pano_size))
+
+    def filename(self, trial):
+        return os.path.join(self.path, 'trial_{:04d}.npz'.format(trial))
+
+    def exists(self, trial):
+        """ Returns True if a trial has a cache file, load checks that it matches the requested steps """
+        return os.path.isfile(self.filename(trial))
+
+    def load(self, trial, scales):
+        """ Returns the descriptors and odometry of the first len(scales) steps of a trial, or None if they are not cached """
+        if not self.exists(trial):
+            return None
+        steps = scales.shape[0]
+        with np.load(self.filename(trial)) as data:
+            if 'odometry_source' not in data or str(data['odometry_source']) != self.odometry:
+                return None
+            if data['scales'].shape[0] < steps or not np.allclose(data['scales'][:steps], scales):
+                return None
+            return data['descriptors'][:steps], data['odometry'][:steps]
+
+    def save(self, trial, scales, descriptors, odometry):
+        """ Store the observations of a trial, scales, descriptors and odometry have one row per step """
+        os.makedirs(self.path, exist_ok=True)
+        filename = self.filename(trial)
+        np.savez(filename + '.tmp.npz', scales=scales, descriptors=descriptors.astype(np.float32), odometry=odometry, odometry_source=self.odometry)
+        os.replace(filename + '.tmp.npz', filename)
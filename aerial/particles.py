@@ -0,0 +1,118 @@
+import numpy as np
+
+
+class ParticleSet():
+    """ Particles stored as a structure of arrays, lat, lon, yaw and weight are each a contiguous array.
+
+        Two (4, capacity) buffers are allocated once. Resampling gathers the selected particles from the front buffer
+        into the back one and swaps them, so filtering does not allocate particle arrays. lat, lon, yaw and weight
+        are views of the first n particles of the front buffer, they are invalidated by resample(). In float32 the
+        latitude is stored with a resolution of about 0.4 m, well below the noise added to particles at each step.
+    """
+
+    def __init__(self, capacity, n=0, dtype=np.float32):
+        """
+            Parameters:
+                capacity -> Maximum number of particles
+                n        -> Number of particles
+                dtype    -> Data type of the states and weights
+        """
+        self.buffers = np.zeros((2, 4, capacity), dtype=dtype)
+        self.front = 0
+        self.n = n
+
+    @classmethod
+    def from_arrays(cls, lat, lon, yaw, weight=None, capacity=None, dtype=np.float32):
+        """ Create a set from (N,) arrays, weights are uniform if not given """
+        n = lat.shape[0]
+        particles = cls(max(n, capacity or 0), n, dtype)
+        particles.lat[:] = lat
+        particles.lon[:] = lon
+        particles.yaw[:] = yaw
+        particles.weight[:] = 1.0 / n if weight is None else weight
+        return particles
+
+    @classmethod
+    def from_states(cls, states, capacity=None, dtype=np.float32):
+        """ Create a set from a (N,4) array of lat, lon, yaw and weight """
+        states = np.asarray(states)
+        return cls.from_arrays(states[:,0], states[:,1], states[:,2], states[:,3], capacity, dtype)
+
+    @classmethod
+    def concatenate(cls, sets):
+        """ Returns a new set with the particles of a list of sets """
+        states = np.concatenate([particles.states for particles in sets], axis=1)
+        particles = cls(states.shape[1], states.shape[1], states.dtype)
+        particles.buffers[0] = states
+        return particles
+
+    @property
+    def capacity(self):
+        return self.buffers.shape[2]
+
+    @property
+    def shape(self):
+        return (self.n, 4)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def states(self):
+        """ (4,n) view of lat, lon, yaw and weight """
+        return self.buffers[self.front,:,:self.n]
+
+    @property
+    def lat(self):
+        return self.buffers[self.front,0,:self.n]
+
+    @property
+    def lon(self):
+        return self.buffers[self.front,1,:self.n]
+
+    @property
+    def yaw(self):
+        return self.buffers[self.front,2,:self.n]
+
+    @property
+    def weight(self):
+        return self.buffers[self.front,3,:self.n]
+
+    def __array__(self, dtype=None, copy=None):
+        """ (n,4) array of lat, lon, yaw and weight, as the particles were stored before """
+        return np.array(self.states.T, dtype=dtype)
+
+    def copy(self):
+        particles = ParticleSet(self.capacity, self.n, self.buffers.dtype)
+        particles.buffers[0,:,:self.n] = self.states
+        return particles
+
+    def normalize(self):
+        """ Normalize weights in place """
+        weight = self.weight
+        weight /= weight.sum()
+
+    def mask(self, bbox):
+        """ Set to zero the weight of particles outside bbox, a (min lat, min lon, max lat, max lon) box """
+        lat, lon = self.lat, self.lon
+        inside = lat >= bbox[0]
+        inside &= lat <= bbox[2]
+        inside &= lon >= bbox[1]
+        inside &= lon <= bbox[3]
+        weight = self.weight
+        weight *= inside
+
+    def resample(self, indexes):
+        """ Keep the particles at indexes, which can repeat, with uniform weights.
+
+            Particles are gathered into the back buffer, which then becomes the front one.
+        """
+        m = indexes.shape[0]
+        assert m <= self.capacity, "{} particles do not fit in a set of capacity {}".format(m, self.capacity)
+        front = self.buffers[self.front,:,:self.n]
+        back = self.buffers[1-self.front]
+        for row in range(3):
+            np.take(front[row], indexes, out=back[row,:m], mode='clip')
+        back[3,:m] = 1.0 / m
+        self.front = 1 - self.front
+        self.n = m
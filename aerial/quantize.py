@@ -0,0 +1,61 @@
+"""This module quantizes map descriptor grids to float16 or int8 and converts predicted grids.
+
+    Usage (from the repository root):
+        python -m aerial.quantize --results_dir <results_dir> --name <model> --epoch latest --areas SP50NW --dtype int8
+"""
+import os
+import argparse
+import numpy as np
+
+
+DTYPES = ['float64', 'float32', 'float16', 'int8']
+
+
+def quantize_grid(descriptors, dtype='int8'):
+    """ Returns a copy of a descriptor grid in dtype and the scale that dequantizes it.
+
+        int8 values are descriptors / scale rounded, with a single scale for the whole grid so trilinear weights
+        keep their meaning. Floating point dtypes are a plain cast and their scale is 1.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.int8:
+        scale = float(np.abs(descriptors).max()) / 127 or 1.0
+        return np.rint(descriptors / scale).astype(np.int8), scale
+    if dtype.kind != 'f':
+        raise NotImplementedError("Descriptor dtype {} not implemented".format(dtype))
+    return descriptors.astype(dtype), 1.0
+
+def dequantize_grid(descriptors, scale=1.0):
+    """ float64 descriptors of a quantized grid """
+    return descriptors.astype(np.float64) * scale
+
+def quantized_filename(filename, dtype):
+    """ Name of the dtype copy of a <epoch>_<area>_z_<zoom>.npz descriptor file """
+    root, ext = os.path.splitext(filename)
+    return '{}_{}{}'.format(root, dtype, ext)
+
+def convert(filename, dtype):
+    """ Save the descriptors and coordinates of a predicted grid in dtype, returns the new file and the maximum absolute error """
+    data = np.load(filename)
+    descriptors = data['X']
+    quantized, scale = quantize_grid(descriptors, dtype)
+    error = np.abs(dequantize_grid(quantized, scale) - descriptors).max()
+    save_path = quantized_filename(filename, dtype)
+    np.savez(save_path, X=quantized, coords=data['coords'], scale=scale)
+    return save_path, error
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results_dir', type=str, default='results', help='Directory of the predicted descriptors')
+    parser.add_argument('--name', type=str, required=True, help='Name of the model')
+    parser.add_argument('--epoch', type=str, default='latest', help='Epoch of the predicted descriptors')
+    parser.add_argument('--areas', type=str, nargs='+', required=True, help='Areas to convert')
+    parser.add_argument('--zoom', type=int, default=18, help='Zoom level of the descriptor grid')
+    parser.add_argument('--dtype', type=str, default='int8', choices=['float16', 'int8'], help='Data type of the converted grid')
+    opt = parser.parse_args()
+
+    for area in opt.areas:
+        filename = os.path.join(opt.results_dir, opt.name, '{}_{}_z_{}.npz'.format(opt.epoch, area, opt.zoom))
+        save_path, error = convert(filename, opt.dtype)
+        print('{} -> {} ({:.1f} MiB -> {:.1f} MiB, max abs error {:.2e})'.format(filename, save_path, os.path.getsize(filename) / 2**20, os.path.getsize(save_path) / 2**20, error))
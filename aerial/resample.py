@@ -0,0 +1,103 @@
+import torch
+import numpy as np
+
+
+def _search(weights, positions):
+    """ Map sample positions in [0,1) to particle indexes through the cumulative sum of weights """
+    cumulative_sum = np.cumsum(weights, dtype=np.float64)
+    cumulative_sum[-1] = 1.0                                                # Avoid round-off errors
+    indexes = np.searchsorted(cumulative_sum, positions, side='right')
+    return np.minimum(indexes, weights.shape[0] - 1)
+
+def systematic_resample(weights, rng=np.random, n=None):
+    """ Systematic resampling, a single random offset shared by N evenly spaced positions """
+    N = weights.shape[0] if n is None else n
+    positions = (rng.rand(1) + np.arange(N)) / N
+    return _search(weights, positions)
+
+def stratified_resample(weights, rng=np.random, n=None):
+    """ Stratified resampling, one random position inside each of the N strata """
+    N = weights.shape[0] if n is None else n
+    positions = (rng.rand(N) + np.arange(N)) / N
+    return _search(weights, positions)
+
+def multinomial_resample(weights, rng=np.random, n=None):
+    """ Multinomial resampling, N independent draws from the weights distribution """
+    N = weights.shape[0] if n is None else n
+    positions = rng.rand(N)
+    return _search(weights, positions)
+
+def residual_resample(weights, rng=np.random, n=None):
+    """ Residual resampling, floor(N*w) deterministic copies and multinomial draws for the rest """
+    M = weights.shape[0]
+    N = M if n is None else n
+    num_copies = np.floor(N * weights).astype(np.int64)
+    indexes = np.repeat(np.arange(M), num_copies)
+
+    k = N - indexes.shape[0]
+    if k > 0:
+        residual = N * weights - num_copies
+        residual /= residual.sum()
+        cumulative_sum = np.cumsum(residual, dtype=np.float64)
+        cumulative_sum[-1] = 1.0
+        extra = np.searchsorted(cumulative_sum, rng.rand(k), side='right')
+        indexes = np.concatenate([indexes, np.minimum(extra, M - 1)])
+    return indexes
+
+def _search_torch(weights, positions):
+    cumulative_sum = torch.cumsum(weights, 0)
+    cumulative_sum[-1] = 1.0
+    indexes = torch.searchsorted(cumulative_sum, positions, right=True)
+    return torch.clamp(indexes, max=weights.shape[0] - 1)
+
+def systematic_resample_torch(weights, generator=None):
+    N = weights.shape[0]
+    positions = (torch.rand(1, generator=generator, dtype=weights.dtype, device=weights.device) + torch.arange(N, dtype=weights.dtype, device=weights.device)) / N
+    return _search_torch(weights, positions)
+
+def stratified_resample_torch(weights, generator=None):
+    N = weights.shape[0]
+    positions = (torch.rand(N, generator=generator, dtype=weights.dtype, device=weights.device) + torch.arange(N, dtype=weights.dtype, device=weights.device)) / N
+    return _search_torch(weights, positions)
+
+def multinomial_resample_torch(weights, generator=None):
+    N = weights.shape[0]
+    positions = torch.rand(N, generator=generator, dtype=weights.dtype, device=weights.device)
+    return _search_torch(weights, positions)
+
+def residual_resample_torch(weights, generator=None):
+    N = weights.shape[0]
+    num_copies = torch.floor(N * weights).long()
+    indexes = torch.repeat_interleave(torch.arange(N, device=weights.device), num_copies)
+
+    k = N - indexes.shape[0]
+    if k > 0:
+        residual = N * weights - num_copies
+        residual /= residual.sum()
+        extra = _search_torch(residual, torch.rand(k, generator=generator, dtype=weights.dtype, device=weights.device))
+        indexes = torch.cat([indexes, extra])
+    return indexes
+
+def get_resampler(name, backend='numpy'):
+    """ Return the resampling function given its name.
+
+        Every resampler takes a (N,) array of normalized weights, an optional random state (np.random by default)
+        and an optional number of samples n, and returns n (N by default) particle indexes. Torch resamplers take a tensor and an optional torch.Generator instead.
+    """
+    resamplers = {
+        'numpy' : {
+            'systematic' : systematic_resample,
+            'stratified' : stratified_resample,
+            'multinomial' : multinomial_resample,
+            'residual' : residual_resample
+        },
+        'torch' : {
+            'systematic' : systematic_resample_torch,
+            'stratified' : stratified_resample_torch,
+            'multinomial' : multinomial_resample_torch,
+            'residual' : residual_resample_torch
+        }
+    }
+    if name not in resamplers[backend]:
+        raise NotImplementedError("Resampling method {} not implemented".format(name))
+    return resamplers[backend][name]
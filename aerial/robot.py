@@ -5,7 +5,7 @@ from aerial.tile import MetaTile
 class Robot():
     """ This class defines the robot """
 
-    def __init__(self, name, area):
+    def __init__(self, name, area, tile_cache=None):
         self.lat = 0.0                  # robot's latitude
         self.lon = 0.0                  # robot's longitude
         self.yaw = 0.0                  # robot's orientation in radians
@@ -19,6 +19,7 @@ class Robot():
         self.max_vel = 20.0             # robot's maximum velocity
 
         self.area = area                # Area where the robot moves
+        self.tile_cache = tile_cache    # Optional TileCache used to render sensed images
 
         self.reflection_flag = False    # A flag useful to reflect robot at boundaries
         self.turn_flag = False          # A flag used to smooth turns
@@ -107,12 +108,26 @@ class Robot():
         self.lon = lon 
         self.yaw = yaw
 
-    def sense(self, scale=1.0, zoom=18, tile_size=256):
+    def sense(self, scale=1.0, zoom=18, tile_size=256, domains=['aerial','map']):
+        """ Returns a tuple with the image of each domain seen by the robot, the scale only applies to the aerial image """
         coords = (self.lat, self.lon, zoom)
         loc = MetaTile(coords, self.area.dataroot, aerial_dir=self.area.dir)
-        aerial = loc.get_metatile(domains=['aerial'],rotation=self.yaw, scale=scale)[0]       
-        gt_map = loc.get_metatile(domains=['map'],rotation=self.yaw, scale=1.0)[0]       
-        return (aerial, gt_map)
+        images = []
+        for domain in domains:
+            domain_scale = scale if domain == 'aerial' else 1.0
+            images.append(loc.get_metatile(domains=[domain],rotation=self.yaw, scale=domain_scale, cache=self.tile_cache)[0])
+        return tuple(images)
+
+    def prefetch(self, positions, zoom=18, domains=['aerial']):
+        """ Load in the background the tiles needed to sense at a list of (lat, lon, ...) positions, requires a tile cache """
+        if self.tile_cache is None:
+            return
+        tiles = {}
+        for position in positions:
+            for tile in MetaTile((position[0], position[1], zoom), self.area.dataroot, aerial_dir=self.area.dir).get_neighbourhood():
+                tiles[(tile.x, tile.y)] = tile
+        for domain in domains:
+            self.tile_cache.prefetch(tiles.values(), domain)
 
     def __str__(self):
         return("lat {} lon {} yaw {} vel {}".format(self.lat, self.lon, self.yaw, self.vel))
@@ -0,0 +1,60 @@
+"""This module splits the prediction of a descriptor grid into blocks of cells saved as they finish.
+
+    Blocks of <epoch>_<area>_z_<zoom>.npz are saved in the <epoch>_<area>_z_<zoom>_blocks directory as <row>_<col>.npz
+    with the X, Y and coords arrays of their cells. A block is written to a temporary file and renamed, so a block file
+    is always complete and an interrupted prediction restarts from the missing blocks. Processes predicting different
+    shards of the blocks share the directory, the grid is merged once every block exists.
+"""
+import os
+import numpy as np
+
+
+def get_blocks(H, W, size):
+    """ (row, col, y0, y1, x0, x1) of the blocks of size x size cells covering a (H,W) grid, in row-major order """
+    return [(row, col, y0, min(y0+size, H), x0, min(x0+size, W))
+            for row, y0 in enumerate(range(0, H, size)) for col, x0 in enumerate(range(0, W, size))]
+
+def get_shard(blocks, shard, num_shards):
+    """ Blocks predicted by a shard, every num_shards-th block starting at shard """
+    if not 0 <= shard < num_shards:
+        raise ValueError("Shard {} must be between 0 and {}".format(shard, num_shards-1))
+    return blocks[shard::num_shards]
+
+def blocks_dir(filename):
+    """ Directory of the blocks of a <epoch>_<area>_z_<zoom>.npz descriptor file """
+    return os.path.splitext(filename)[0] + '_blocks'
+
+def block_filename(filename, row, col):
+    """ Name of a block of a <epoch>_<area>_z_<zoom>.npz descriptor file """
+    return os.path.join(blocks_dir(filename), '{}_{}.npz'.format(row, col))
+
+def save_npz(path, **arrays):
+    """ np.savez to a temporary file renamed to path, readers never see a partial file """
+    tmp = '{}.{}.part.npz'.format(os.path.splitext(path)[0], os.getpid())
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+def save_block(filename, row, col, X, Y, coords):
+    """ Save the descriptors and coordinates of a block of a descriptor file """
+    os.makedirs(blocks_dir(filename), exist_ok=True)
+    save_npz(block_filename(filename, row, col), X=X, Y=Y, coords=coords)
+
+def merge_blocks(filename, coords, size):
+    """ Merge the blocks of a (H,W,T,5) coords grid into filename, returns the missing blocks, nothing is written if any """
+    H, W = coords.shape[:2]
+    blocks = get_blocks(H, W, size)
+    missing = [b for b in blocks if not os.path.isfile(block_filename(filename, *b[:2]))]
+    if missing:
+        return missing
+
+    X = Y = None
+    for row, col, y0, y1, x0, x1 in blocks:
+        block = np.load(block_filename(filename, row, col))
+        assert np.array_equal(block['coords'], coords[y0:y1,x0:x1]), "Block {}_{} was predicted for other coordinates".format(row, col)
+        if X is None:
+            X = np.zeros(coords.shape[:3] + block['X'].shape[3:], dtype=block['X'].dtype)
+            Y = np.zeros(coords.shape[:3] + block['Y'].shape[3:], dtype=block['Y'].dtype)
+        X[y0:y1,x0:x1] = block['X']
+        Y[y0:y1,x0:x1] = block['Y']
+    save_npz(filename, X=X, Y=Y, coords=coords)
+    return missing
@@ -0,0 +1,49 @@
+"""This module holds the slippy map tile math of aerial.tile for numpy arrays.
+
+    Functions take scalars or arrays of any shape, which are broadcast, and return arrays, so the tiles and
+    coordinates of a whole grid are computed without Python loops. Tile indexes and pixels match the scalar deg2num,
+    num2deg and MetaTile of aerial.tile, degrees may differ in the last bit. The scalar functions remain faster for a
+    single location.
+"""
+import numpy as np
+
+
+# Math functions taken from https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames #spellok
+def deg2num_array(lat_deg, lon_deg, zoom):
+    """ (x, y) integer arrays of the tiles containing locations """
+    lat_rad = np.radians(lat_deg)
+    n = 2.0 ** zoom
+    xtile = ((np.asarray(lon_deg) + 180.0) / 360.0 * n).astype(np.int64)
+    ytile = ((1.0 - np.log(np.tan(lat_rad) + (1 / np.cos(lat_rad))) / np.pi) / 2.0 * n).astype(np.int64)
+    return xtile, ytile
+
+def num2deg_array(xtile, ytile, zoom):
+    """ (lat, lon) arrays of tile coordinates, integer coordinates are top left vertices """
+    n = 2.0 ** zoom
+    lon_deg = np.asarray(xtile) / n * 360.0 - 180.0
+    lat_rad = np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(ytile) / n)))
+    return np.degrees(lat_rad), lon_deg
+
+def extent_to_tiles(extent, zoom):
+    """ [min_x, min_y, max_x, max_y] indexes of the tiles covering a [min_lat, min_lon, max_lat, max_lon] extent """
+    x, y = deg2num_array([extent[2], extent[0]], [extent[1], extent[3]], zoom)
+    return [int(x[0]), int(y[0]), int(x[1]), int(y[1])]
+
+def tiles_to_extent(limits, zoom):
+    """ [min_lat, min_lon, max_lat, max_lon] extent of the tiles of [min_x, min_y, max_x, max_y] limits """
+    lat, lon = num2deg_array([limits[0], limits[2]+1], [limits[1], limits[3]+1], zoom)
+    return [float(lat[1]), float(lon[0]), float(lat[0]), float(lon[1])]
+
+def tile_centres(limits, zoom):
+    """ (H,W) lat and lon arrays of the centres of the tiles of [min_x, min_y, max_x, max_y] limits, rows go south """
+    x, y = np.meshgrid(np.arange(limits[0], limits[2]+1), np.arange(limits[1], limits[3]+1))
+    return num2deg_array(x + 0.5, y + 0.5, zoom)
+
+def pixel_offset(lat, lon, zoom, size=256):
+    """ (x, y) indexes of the tiles containing locations and (col, row) pixels of the locations in them, rounded like MetaTile does """
+    x, y = deg2num_array(lat, lon, zoom)
+    vertex_lat, vertex_lon = num2deg_array(x, y, zoom)
+    next_lat, next_lon = num2deg_array(x+1, y+1, zoom)
+    col = np.rint((lon - vertex_lon) / (next_lon - vertex_lon) * size).astype(np.int64)
+    row = np.rint(-1 * (lat - vertex_lat) / (vertex_lat - next_lat) * size).astype(np.int64)
+    return x, y, col, row
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+
+
+class StatesWriter():
+    """ Streams the results and particle states of each trial to a directory as the localization runs.
+
+        Particles of every step are appended as float32 to trial_<trial>.states, a raw (n,4) chunk per step,
+        so memory does not grow with the number of steps. When a trial finishes its results and the number
+        of particles recorded at each step are saved to trial_<trial>.npz. Each trial uses its own files,
+        therefore trials can be written in any order, in lockstep or from several processes.
+    """
+
+    def __init__(self, path, states=True, mode='all', size=1000):
+        """
+            Parameters:
+                path   -> Output directory, it is created if needed
+                states -> If False only the results of each trial are written
+                mode   -> all, subsample (size evenly spaced particles) or topk (the size particles with highest weight)
+                size   -> Number of particles recorded per step when mode is subsample or topk
+        """
+        if mode not in ['all', 'subsample', 'topk']:
+            raise NotImplementedError("States mode {} not implemented".format(mode))
+        self.path = path
+        self.states = states
+        self.mode = mode
+        self.size = size
+        self.files = {}
+        self.counts = {}
+        os.makedirs(path, exist_ok=True)
+
+    def select(self, particles):
+        """ Returns the particles to record given the mode """
+        n = particles.shape[0]
+        if self.mode == 'all' or n <= self.size:
+            return particles
+        if self.mode == 'subsample':
+            return particles[np.linspace(0, n-1, self.size).astype(np.int64)]
+        return particles[np.argpartition(particles[:,-1], n-self.size)[n-self.size:]]
+
+    def append(self, trial, particles):
+        """ Append the (N,4) particles of the next step of a trial """
+        if not self.states:
+            return
+        if trial not in self.files:
+            self.files[trial] = open(os.path.join(self.path, 'trial_{:04d}.states'.format(trial)), 'wb', buffering=1 << 20)
+            self.counts[trial] = []
+        chunk = np.ascontiguousarray(self.select(np.asarray(particles)), dtype=np.float32)
+        self.files[trial].write(memoryview(chunk))
+        self.counts[trial].append(chunk.shape[0])
+
+    def finish(self, trial, results):
+        """ Close the states of a trial and save its results, results is a dict of arrays indexed by trial """
+        if trial in self.files:
+            self.files.pop(trial).close()
+        trial_results = {key: value[trial] for key, value in results.items()}
+        counts = np.array(self.counts.pop(trial, []), dtype=np.int64)
+        filename = os.path.join(self.path, 'trial_{:04d}.npz'.format(trial))
+        np.savez(filename + '.tmp.npz', states_counts=counts, **trial_results)
+        os.replace(filename + '.tmp.npz', filename)                # A trial file is either complete or missing
+
+
+def load_states(path, trial):
+    """ Returns a list with the (n,4) float32 particles of each step of a trial written by StatesWriter """
+    counts = np.load(os.path.join(path, 'trial_{:04d}.npz'.format(trial)))['states_counts']
+    if counts.shape[0] == 0:
+        return []
+    states = np.memmap(os.path.join(path, 'trial_{:04d}.states'.format(trial)), dtype=np.float32, mode='r').reshape(-1, 4)
+    return np.split(states, np.cumsum(counts)[:-1])
+
+def stack_states(path, trials):
+    """ Returns the particles of trials as the (trials,steps,n,4) array once saved under the states key of the
+        localisation-*.npz file, steps with fewer than n particles are padded with zeros
+    """
+    states = [load_states(path, trial) for trial in trials]
+    steps = max(len(s) for s in states)
+    n = max(step.shape[0] for s in states for step in s) if steps > 0 else 0
+    stacked = np.zeros((len(trials), steps, n, 4), dtype=np.float32)
+    for i, trial_states in enumerate(states):
+        for step, particles in enumerate(trial_states):
+            stacked[i,step,:particles.shape[0]] = particles
+    return stacked
@@ -2,9 +2,14 @@ import os
 import cv2 
 import math
 import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd 
 
+from aerial.slippy import pixel_offset
+
 # TMS functions taken from https://alastaira.wordpress.com/2011/07/06/converting-tms-tile-coordinates-to-googlebingosm-tile-coordinates/ #spellok
 def tms(ytile, zoom):
     n = 2.0 ** zoom
@@ -103,6 +108,71 @@ class Tile():
         cv2.waitKey(0)
 
 
+class TileCache():
+    """ A thread safe least recently used cache of tile images, keyed by their path.
+
+        Tiles can be loaded in a background thread with prefetch(). Missing tiles are cached as None.
+    """
+
+    def __init__(self, size=256):
+        """
+            Parameters:
+                size -> Maximum number of tiles kept in memory
+        """
+        self.size = size
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._pid = None
+
+    def _start(self):
+        # The lock and the prefetching thread are created in the process using the cache, so forked processes get their own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.lock = threading.Lock()
+            self.pending = set()
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _store(self, path, tile):
+        with self.lock:
+            self.tiles[path] = tile
+            self.tiles.move_to_end(path)
+            while len(self.tiles) > self.size:
+                self.tiles.popitem(last=False)
+
+    def get(self, tile, domain='aerial'):
+        """ Returns the image of a Tile, reading it from disk if it is not cached """
+        self._start()
+        path = tile.get_path(domain)
+        with self.lock:
+            if path in self.tiles:
+                self.hits += 1
+                self.tiles.move_to_end(path)
+                return self.tiles[path]
+            self.misses += 1
+        image = cv2.imread(path)
+        self._store(path, image)
+        return image
+
+    def _load(self, path):
+        try:
+            self._store(path, cv2.imread(path))
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def prefetch(self, tiles, domain='aerial'):
+        """ Read the images of a list of Tiles in a background thread """
+        self._start()
+        for tile in tiles:
+            path = tile.get_path(domain)
+            with self.lock:
+                if path in self.tiles or path in self.pending:
+                    continue
+                self.pending.add(path)
+            self.executor.submit(self._load, path)
+
+
 class MetaTile():
     """ This class abstracts a tile centered at any given coordinate. It is produced by concatenating, croping and rotating the required tiles from the grid"""
     
@@ -119,31 +189,35 @@ class MetaTile():
         self.dataroot = dataroot
         
     
-    def get_metatile(self, domains=['aerial','map'], rotation=0.0, scale=1.0, flip=None, blur=False, text=None, outSize=256):
+    def get_neighbourhood(self):
+        """ Returns the 3x3 Tiles around the centre tile, column by column """
+        centre_tile = self.centre_tile
+        return [Tile((centre_tile.x+i, centre_tile.y+j, centre_tile.z), self.dataroot, self.aerial_dir) for i in [-1,0,1] for j in [-1,0,1]]
+
+    def get_metatile(self, domains=['aerial','map'], rotation=0.0, scale=1.0, flip=None, blur=False, text=None, outSize=256, cache=None):
+        """ Returns a list with the image of each domain, tiles are read through cache (a TileCache) if given """
         point = self.coords[0:2]     
         centre_tile = Tile(self.coords, self.dataroot, self.aerial_dir)              
         
         for domain in domains: 
             path = centre_tile.get_path(domain)
-            assert os.path.isfile(path), "Tile {} does not exist".format(path) 
+            if cache is not None:
+                assert cache.get(centre_tile, domain) is not None, "Tile {} does not exist".format(path)
+            else:
+                assert os.path.isfile(path), "Tile {} does not exist".format(path) 
         
-        delta =  (centre_tile.extent[2] - centre_tile.extent[0], centre_tile.extent[3] - centre_tile.extent[1]) # in wgs84
-        shift_lat = -1 * (point[0] - centre_tile.vertex[0])
-        shift_lon = point[1] - centre_tile.vertex[1]
-        point_coords = (int(round(shift_lon / delta[1] * 256)), int(round(shift_lat / delta[0] * 256))) #x,y
-        new_centre = (point_coords[0]+256,point_coords[1]+256)
+        _, _, col, row = pixel_offset(point[0], point[1], self.z)     # Pixel of the point in the centre tile
+        new_centre = (int(col)+256, int(row)+256)
 
         images = []
 
         for domain in domains:
             tile_list = []
-            for i in [-1,0,1]:
-                for j in [-1,0,1]:
-                    coords = (centre_tile.x+i, centre_tile.y+j, centre_tile.z)
-                    tile = Tile(coords, self.dataroot, self.aerial_dir).get_tile(domain)
-                    if tile is None:
-                        tile = np.zeros((256,256,3), dtype=np.uint8)
-                    tile_list.append(tile)
+            for neighbour in self.get_neighbourhood():
+                tile = cache.get(neighbour, domain) if cache is not None else neighbour.get_tile(domain)
+                if tile is None:
+                    tile = np.zeros((256,256,3), dtype=np.uint8)
+                tile_list.append(tile)
             column = np.concatenate(tile_list, axis=0)
             parent = np.hstack(np.split(column,3,0))
 
@@ -173,6 +247,86 @@ class MetaTile():
         cv2.imshow('Tile', tile)
         cv2.waitKey(0)
 
+class TileMosaic():
+    """ The tiles of a rectangle of the grid decoded once into a single image, metatiles are cropped and rotated from it.
+
+        It gives the images of MetaTile.get_metatile, which reads and concatenates the 3x3 tiles around every location,
+        without decoding any tile twice. A margin of one tile around the rectangle covers the neighbourhood of its
+        border tiles, missing tiles are black. If path is given the mosaic is a memory-mapped .npy file, built the
+        first time and reused afterwards.
+    """
+
+    def __init__(self, limits, zoom, dataroot, domain='aerial', aerial_dir=None, path=None, workers=4):
+        """
+            Parameters:
+                limits  -> [min_x, min_y, max_x, max_y] indexes of the tiles
+                zoom    -> Zoom level of the tiles
+                domain  -> aerial or map
+                path    -> Optional .npy file where the mosaic is stored, None keeps it in memory
+                workers -> Number of threads decoding tiles
+        """
+        self.z = zoom
+        self.dataroot = dataroot
+        self.aerial_dir = aerial_dir
+        self.domain = domain
+        self.x0, self.y0 = limits[0] - 1, limits[1] - 1
+        self.shape = ((limits[3] - limits[1] + 3) * 256, (limits[2] - limits[0] + 3) * 256, 3)
+
+        if path is not None and os.path.isfile(path):
+            self.image = np.load(path, mmap_mode='r')
+            assert self.image.shape == self.shape, "Mosaic {} has shape {} instead of {}".format(path, self.image.shape, self.shape)
+            return
+
+        if path is None:
+            self.image = np.zeros(self.shape, dtype=np.uint8)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.image = np.lib.format.open_memmap(path + '.part', mode='w+', dtype=np.uint8, shape=self.shape)
+
+        tiles = [(x, y) for x in range(self.x0, limits[2] + 2) for y in range(self.y0, limits[3] + 2)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self._decode, tiles))
+
+        if path is not None:
+            self.image.flush()
+            del self.image
+            os.replace(path + '.part', path)                            # Only complete mosaics are reused
+            self.image = np.load(path, mmap_mode='r')
+
+    def _decode(self, xy):
+        x, y = xy
+        tile = Tile((x, y, self.z), self.dataroot, self.aerial_dir).get_tile(self.domain)
+        if tile is not None:
+            row, col = (y - self.y0) * 256, (x - self.x0) * 256
+            self.image[row:row+256, col:col+256] = tile
+
+    def locate(self, lat, lon):
+        """ Returns the (x, y) indexes of the tiles containing locations and the (x, y) pixels of the locations in the mosaic, rounded like MetaTile does.
+
+            lat and lon are scalars or arrays, results are arrays of their shape.
+        """
+        x, y, col, row = pixel_offset(lat, lon, self.z)
+        return (x, y), ((x - self.x0) * 256 + col, (y - self.y0) * 256 + row)
+
+    def get_metatile(self, lat, lon, rotation=0.0, scale=1.0, outSize=256):
+        """ Returns the image of MetaTile((lat, lon, zoom)).get_metatile([domain], rotation, scale, outSize=outSize)[0] """
+        (x, y), point = self.locate(lat, lon)
+
+        # The 3x3 tiles MetaTile concatenates
+        row, col = int(y - 1 - self.y0) * 256, int(x - 1 - self.x0) * 256
+        assert 0 <= row and row + 768 <= self.shape[0] and 0 <= col and col + 768 <= self.shape[1], "Location {}, {} is outside the mosaic".format(lat, lon)
+        parent = self.image[row:row+768, col:col+768]
+        new_centre = (int(point[0]) - col, int(point[1]) - row)
+        x0, y0 = new_centre[0] - outSize//2, new_centre[1] - outSize//2
+
+        if rotation == 0.0:
+            return np.array(parent[y0:y0+outSize, x0:x0+outSize])
+        # Rotate the parent and crop it in one warp, only the crop is computed
+        rot_mat = cv2.getRotationMatrix2D((new_centre[0],new_centre[1]), np.rad2deg(rotation), scale)
+        rot_mat[:,2] -= (x0, y0)
+        return cv2.warpAffine(np.ascontiguousarray(parent), rot_mat, (outSize, outSize), flags=cv2.INTER_LINEAR)
+
+
 if __name__ == "__main__":
     lat, lon, zoom =   51.7852587, -1.27647400, 18
     rotation, scale, flip = 200, 1.0, None
@@ -0,0 +1,120 @@
+""" FLOPs, time and agreement of dense descriptor prediction with the per-crop pipeline of predict_aerial.py, on a block of cells of an area.
+
+    The backbone is built without downloading pretrained weights, so descriptors come from random weights unless
+    --weights loads a saved backbone (e.g. checkpoints/<name>/latest_net_X.pth).
+
+    Usage (from the repository root):
+        python -m benchmarks.dense_benchmark --dataroot <dataroot> --area SP50NW --domain map --splits maxpool layer1 layer2 layer5
+"""
+import time
+import argparse
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from aerial.tile import TileMosaic
+from aerial.slippy import tile_centres
+from aerial.area import get_area_extents
+from benchmarks.mosaic_benchmark import area_samples
+from data.metatilespredict_dataset import get_transforms
+from models.dense_predict import DenseGridPredictor
+from models.nets.resnet_nets import ResNet, BasicBlock, Bottleneck
+from models.nets.street2vec_nets import EmbNetX, EmbNetY
+
+
+class FlopCounter():
+    """ Counts the multiply-adds, as 2 FLOPs, of the convolutions and linear layers of networks """
+
+    def __init__(self, *nets):
+        self.flops = 0
+        for net in nets:
+            for m in net.modules():
+                if isinstance(m, (nn.Conv2d, nn.Linear)):
+                    m.register_forward_hook(self.hook)
+
+    def hook(self, module, inputs, output):
+        if isinstance(module, nn.Conv2d):
+            self.flops += 2 * output.numel() * module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+        else:
+            self.flops += 2 * output.numel() * module.in_features
+
+
+def networks(domain, size, embedding_dim, weights=None):
+    """ The backbone and embedding network street2vec uses for a domain """
+    opt = argparse.Namespace(tile_size=size, pano_size=size, panorama_mode='grid', embedding_dim=embedding_dim, no_l2_norm=False, scale=32)
+    if domain == 'map':
+        backbone, embedding = ResNet(BasicBlock, [2, 2, 2, 2]), EmbNetX(opt)
+    else:
+        backbone, embedding = ResNet(Bottleneck, [3, 4, 6, 3]), EmbNetY(opt)
+    if weights is not None:
+        backbone.load_state_dict({k.replace('module.', ''): v for k, v in torch.load(weights, map_location='cpu').items()})
+    return backbone.eval(), embedding.eval()
+
+
+def predict_crops(backbone, embedding, mosaic, samples, size, batch_size):
+    """ Descriptors of (lat, lon, theta) samples, each crop rendered and embedded on its own as predict_aerial.py does """
+    transforms = get_transforms('normalize')
+    descriptors = []
+    for i in range(0, len(samples), batch_size):
+        images = []
+        for lat, lon, theta in samples[i:i+batch_size]:
+            img = mosaic.get_metatile(lat, lon, rotation=theta)
+            if size != 256:
+                img = cv2.resize(img, (size, size))
+            images.append(transforms(Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))))
+        with torch.no_grad():
+            features = backbone(torch.stack(images))
+            descriptors.append(embedding(features.view(features.size(0), -1)).numpy())
+    return np.concatenate(descriptors)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataroot', type=str, required=True, help='Directory with the aerial_tiles and map_tiles directories')
+    parser.add_argument('--area', type=str, default='SP50NW', help='Area the cells are taken from')
+    parser.add_argument('--domain', type=str, default='map', choices=['aerial', 'map'], help='Domain of the tiles, map uses the resnet18 backbone and aerial the resnet50 one')
+    parser.add_argument('--aerial_dir', type=str, default='aerial_tiles', help='Name of directory with the aerial tiles')
+    parser.add_argument('--zoom', type=int, default=18, help='Zoom level of the tiles')
+    parser.add_argument('--cells', type=int, default=16, help='Side of the block of cells predicted, in the centre of the area')
+    parser.add_argument('--T', type=int, default=8, help='Orientation resolution')
+    parser.add_argument('--size', type=int, default=256, help='Size the crops are resized to, tile_size or pano_size')
+    parser.add_argument('--embedding_dim', type=int, default=16, help='Dimension of the descriptors')
+    parser.add_argument('--splits', type=str, nargs='+', default=['maxpool', 'layer1', 'layer2', 'layer3', 'layer5'], help='Last backbone layers shared by the cells')
+    parser.add_argument('--window', type=int, default=1024, help='Window of the shared layers, in network input pixels')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size of the per-crop pipeline')
+    parser.add_argument('--weights', type=str, default=None, help='Optional saved backbone weights')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    torch.manual_seed(opt.seed)
+    limits, _ = area_samples(get_area_extents()[opt.area], opt.zoom, opt.T)
+    x0, y0 = (limits[0] + limits[2] - opt.cells) // 2, (limits[1] + limits[3] - opt.cells) // 2
+    limits = [x0, y0, x0 + opt.cells - 1, y0 + opt.cells - 1]
+    mosaic = TileMosaic(limits, opt.zoom, opt.dataroot, opt.domain, opt.aerial_dir)
+    image = np.ascontiguousarray(mosaic.image)
+    lat, lon = tile_centres(limits, opt.zoom)
+    locations = list(zip(lat.ravel().tolist(), lon.ravel().tolist()))
+    centres = np.stack(mosaic.locate(lat.ravel(), lon.ravel())[1], axis=1).astype(np.float64)
+    thetas = np.linspace(0, 2*np.pi, opt.T, endpoint=False)
+
+    backbone, embedding = networks(opt.domain, opt.size, opt.embedding_dim, opt.weights)
+    counter = FlopCounter(backbone, embedding)
+
+    samples = [(lat, lon, theta) for lat, lon in locations for theta in thetas]
+    start = time.perf_counter()
+    reference = predict_crops(backbone, embedding, mosaic, samples, opt.size, opt.batch_size).reshape(len(locations), opt.T, -1)
+    t_crops, flops_crops = time.perf_counter() - start, counter.flops
+
+    print('{} cells x {} orientations, {} backbone, crops of {} px'.format(len(locations), opt.T, opt.domain, opt.size))
+    print('{:>10} {:>8} {:>10} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10}'.format('split', 'stride', 'GFLOPs', 'time (s)', 'FLOPs ratio', 'speed-up', 'cos mean', 'cos min', 'max diff'))
+    print('{:>10} {:>8} {:>10.1f} {:>10.2f} {:>12.2f} {:>10.2f} {:>10.4f} {:>10.4f} {:>10.4f}'.format('crops', '-', flops_crops / 1e9, t_crops, 1.0, 1.0, 1.0, 1.0, 0.0))
+    for split in opt.splits:
+        predictor = DenseGridPredictor(backbone, embedding, torch.device('cpu'), split, input_size=opt.size, window=opt.window)
+        counter.flops = 0
+        start = time.perf_counter()
+        dense = np.stack([predictor.predict(image, centres, theta) for theta in thetas], axis=1)
+        t_dense, flops_dense = time.perf_counter() - start, counter.flops
+        cos = (dense * reference).sum(-1) / np.linalg.norm(dense, axis=-1) / np.linalg.norm(reference, axis=-1)
+        print('{:>10} {:>8} {:>10.1f} {:>10.2f} {:>12.2f} {:>10.2f} {:>10.4f} {:>10.4f} {:>10.4f}'.format(split, predictor.stride, flops_dense / 1e9, t_dense, flops_crops / flops_dense, t_crops / t_dense, cos.mean(), cos.min(), np.abs(dense - reference).max()))
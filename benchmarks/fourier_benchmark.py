@@ -0,0 +1,57 @@
+""" Storage, weighting time and localization error of Fourier coefficient grids, compared with the T headings sampled by the raw grid, per area.
+
+    Usage (from the repository root):
+        python -m benchmarks.fourier_benchmark --areas London_test SP50NW ST57SE2017 --harmonics 1 2 3 --np 20000
+"""
+import argparse
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter
+from aerial.fourier import fit_fourier, evaluate_fourier
+
+
+def evaluate(localizer, routes):
+    """ Mean median weighting time in ms and mean error of the last quarter of the routes in meters """
+    times, errors = [], []
+    for r, route in enumerate(routes):
+        _, e, timer = run_filter(localizer, route, trial=r)
+        times.append(timer.median('weights'))
+        errors.append(e[-(route[0].shape[0]//4):].mean())                    # Error once the filter had time to converge
+    return np.mean(times), np.mean(errors)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--areas', type=str, nargs='+', default=['London_test', 'SP50NW', 'ST57SE2017'], help='Areas whose grid size is used')
+    parser.add_argument('--harmonics', type=int, nargs='+', default=[1, 2, 3], help='Number of harmonics of the Fourier series')
+    parser.add_argument('--smooth_yaw', type=int, default=None, help='If set, the synthetic grid is band-limited to this number of harmonics along the orientation axis, as descriptors of neighbouring headings are correlated')
+    parser.add_argument('--np', type=int, default=20000, help='Number of particles')
+    parser.add_argument('--likelihood', type=str, default='fused', help='Likelihood used to weight particles, lut and hierarchical evaluate the series at 2K+1 headings')
+    parser.add_argument('--particles_init', type=str, default='uniform', help='Particle initialization')
+    parser.add_argument('--steps', type=int, default=60, help='Number of filter steps')
+    parser.add_argument('--routes', type=int, default=5, help='Number of simulated routes per area')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    print('{:>12} {:>10} {:>8} {:>10} {:>12} {:>14} {:>9} {:>10} {:>14}'.format('area', 'grid', 'rows', 'grid (MiB)', 'rel. error', 'weights (ms)', 'cost', 'MLE (m)', 'MLE diff (m)'))
+    for area in opt.areas:
+        args = ['--np', str(opt.np), '--likelihood', opt.likelihood, '--particles_init', opt.particles_init]
+        raw = synthetic_localizer(args, area=area, seed=opt.seed)
+        grid = raw.map_features
+        T = grid.shape[2]
+        if opt.smooth_yaw is not None:
+            grid = evaluate_fourier(fit_fourier(grid, opt.smooth_yaw), 2*np.pi*np.arange(T)/T)
+            grid /= np.linalg.norm(grid, axis=-1, keepdims=True)
+            raw.set_map_features(grid)
+        routes = [simulate_route(raw, opt.steps, seed=opt.seed + r) for r in range(opt.routes)]      # Observations of the raw grid
+
+        t_raw, e_raw = evaluate(raw, routes)
+        print('{:>12} {:>10} {:>8} {:>10.1f} {:>12.3f} {:>14.3f} {:>9.2f} {:>10.1f} {:>14.1f}'.format(area, 'T={}'.format(T), T, grid.nbytes / 2**20, 0.0, t_raw, 1.0, e_raw, 0.0))
+
+        fourier = synthetic_localizer(args + ['--fourier_harmonics', str(max(opt.harmonics))], area=area, seed=opt.seed)
+        for K in opt.harmonics:
+            coefficients = fit_fourier(grid, K)
+            error = np.linalg.norm(evaluate_fourier(coefficients, 2*np.pi*np.arange(T)/T) - grid) / np.linalg.norm(grid)
+            fourier.set_map_features(coefficients)
+            t, e = evaluate(fourier, routes)
+            print('{:>12} {:>10} {:>8} {:>10.1f} {:>12.3f} {:>14.3f} {:>9.2f} {:>10.1f} {:>14.1f}'.format(area, 'K={}'.format(K), 2*K+1, coefficients.nbytes / 2**20, error, t, t/t_raw, e, e-e_raw))
@@ -0,0 +1,80 @@
+""" Time to build the (H,W,T,5) coordinate grid of MetaTilesPredictDataset and the mosaic pixels of its cells, with scalar loops and with aerial.slippy.
+
+    Usage (from the repository root):
+        python -m benchmarks.grid_benchmark --areas London_test SP50NW ST57SE2017
+"""
+import time
+import argparse
+import numpy as np
+
+from aerial.tile import Tile, deg2num, num2deg
+from aerial.slippy import extent_to_tiles, tile_centres, pixel_offset
+from aerial.area import get_area_extents
+
+
+def grid_loop(extent, zoom, T):
+    """ The coordinate grid built one cell at a time with the scalar functions """
+    min_x, min_y = deg2num(extent[2], extent[1], zoom)
+    max_x, max_y = deg2num(extent[0], extent[3], zoom)
+    x = np.arange(min_x, max_x+1)
+    y = np.arange(min_y, max_y+1)
+    grid = np.zeros((y.shape[0], x.shape[0], T, 5))
+    c = np.zeros((y.shape[0], x.shape[0], 4))
+    for j in range(y.shape[0]):
+        for i in range(x.shape[0]):
+            lat, lon = num2deg(x[i]+0.5, y[j]+0.5, zoom)
+            c[j,i,:] = np.asarray([lat, lon, y[j], x[i]])
+    grid[:,:,:,:4] = np.expand_dims(c, 2)
+    grid[:,:,:,4] = np.linspace(0, 2*np.pi, T, endpoint=False)
+    return grid
+
+def grid_array(extent, zoom, T):
+    """ The coordinate grid built with the array functions """
+    limits = extent_to_tiles(extent, zoom)
+    lat, lon = tile_centres(limits, zoom)
+    x = np.arange(limits[0], limits[2]+1)
+    y = np.arange(limits[1], limits[3]+1)
+    grid = np.zeros(lat.shape + (T, 5))
+    grid[:,:,:,:4] = np.stack(np.broadcast_arrays(lat, lon, y[:,None], x[None,:]), axis=-1)[:,:,None]
+    grid[:,:,:,4] = np.linspace(0, 2*np.pi, T, endpoint=False)
+    return grid
+
+def pixels_loop(lat, lon, zoom):
+    """ Tile and pixel of each location with a Tile per location, as MetaTile does """
+    pixels = []
+    for a, b in zip(lat, lon):
+        tile = Tile((a, b, zoom), '')
+        delta = (tile.extent[2] - tile.extent[0], tile.extent[3] - tile.extent[1])
+        pixels.append((tile.x, tile.y, int(round((b - tile.vertex[1]) / delta[1] * 256)), int(round(-1 * (a - tile.vertex[0]) / delta[0] * 256))))
+    return np.array(pixels)
+
+def best_of(f, *args, repeat=5):
+    """ Result and shortest time in ms of repeat calls """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args)
+        times.append(time.perf_counter() - start)
+    return result, 1000 * min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--areas', type=str, nargs='+', default=['London_test', 'SP50NW', 'ST57SE2017'], help='Areas whose grid is built')
+    parser.add_argument('--zoom', type=int, default=18, help='Zoom level of the grid')
+    parser.add_argument('--T', type=int, default=8, help='Orientation resolution')
+    opt = parser.parse_args()
+
+    print('{:>12} {:>8} {:>10} {:>11} {:>9} {:>14} {:>12} {:>13} {:>9} {:>12}'.format('area', 'cells', 'grid loop', 'grid array', 'speed-up', 'max diff (deg)', 'pixels loop', 'pixels array', 'speed-up', 'mismatches'))
+    for area in opt.areas:
+        extent = get_area_extents()[area]
+        loop, t_loop = best_of(grid_loop, extent, opt.zoom, opt.T)
+        array, t_array = best_of(grid_array, extent, opt.zoom, opt.T)
+        assert loop.shape == array.shape
+
+        lat, lon = array[:,:,0,0].ravel(), array[:,:,0,1].ravel()
+        reference, p_loop = best_of(pixels_loop, lat, lon, opt.zoom)
+        pixels, p_array = best_of(lambda: np.stack(pixel_offset(lat, lon, opt.zoom), axis=1))
+        mismatches = int((reference != pixels).any(axis=1).sum())
+
+        print('{:>12} {:>8} {:>10.2f} {:>11.2f} {:>9.1f} {:>14.1e} {:>12.2f} {:>13.2f} {:>9.1f} {:>12}'.format(area, lat.shape[0], t_loop, t_array, t_loop/t_array, np.abs(loop - array).max(), p_loop, p_array, p_loop/p_array, mismatches))
@@ -0,0 +1,39 @@
+""" Speed-up and localization error of the hierarchical likelihood with respect to the fused one, per area.
+
+    Usage (from the repository root):
+        python -m benchmarks.hierarchical_benchmark --areas London_test SP50NW ST57SE2017 --np 20000
+"""
+import argparse
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--areas', type=str, nargs='+', default=['London_test', 'SP50NW', 'ST57SE2017'], help='Areas whose grid size is used')
+    parser.add_argument('--np', type=int, default=20000, help='Number of particles')
+    parser.add_argument('--pyramid_factor', type=int, default=2, help='Downsampling factor of the coarse grid')
+    parser.add_argument('--refine_fraction', type=float, default=0.2, help='Fraction of particles rescored on the full grid')
+    parser.add_argument('--steps', type=int, default=60, help='Number of filter steps')
+    parser.add_argument('--routes', type=int, default=20, help='Number of simulated routes per area')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    print('{:>12} {:>14} {:>14} {:>9} {:>16} {:>16} {:>14}'.format('area', 'fused (ms)', 'hier. (ms)', 'speed-up', 'fused MLE (m)', 'hier. MLE (m)', 'MLE diff (m)'))
+    for area in opt.areas:
+        args = ['--np', str(opt.np), '--pyramid_factor', str(opt.pyramid_factor), '--refine_fraction', str(opt.refine_fraction)]
+        fused = synthetic_localizer(args + ['--likelihood', 'fused'], area=area, seed=opt.seed)
+        hierarchical = synthetic_localizer(args + ['--likelihood', 'hierarchical'], area=area, seed=opt.seed)
+
+        times, errors = {'fused': [], 'hierarchical': []}, {'fused': [], 'hierarchical': []}
+        for r in range(opt.routes):
+            route = simulate_route(fused, opt.steps, seed=opt.seed + r)
+            for name, localizer in [('fused', fused), ('hierarchical', hierarchical)]:
+                _, e, timer = run_filter(localizer, route, trial=r)
+                times[name].append(timer.median('weights'))
+                errors[name].append(e[-opt.steps//4:].mean())              # Error once the filter had time to converge
+
+        t_f, t_h = np.mean(times['fused']), np.mean(times['hierarchical'])
+        e_f, e_h = np.mean(errors['fused']), np.mean(errors['hierarchical'])
+        print('{:>12} {:>14.3f} {:>14.3f} {:>9.2f} {:>16.1f} {:>16.1f} {:>14.1f}'.format(area, t_f, t_h, t_f/t_h, e_f, e_h, e_h-e_f))
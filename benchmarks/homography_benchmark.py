@@ -0,0 +1,93 @@
+""" Latency and odometry of the homography estimator, compared with the original implementation, on frames rendered along a testing route.
+
+    Usage (from the repository root):
+        python -m benchmarks.homography_benchmark --dataroot $DATASETS/digimap_data --area SP50NW --trial 0 --steps 200
+"""
+import time
+import math
+import argparse
+import cv2
+import numpy as np
+
+from aerial.motion_estimate import Homography
+from benchmarks.utils import render_route, true_odometry
+
+
+class LegacyHomography():
+    """ The original estimator: a new matcher per call, python sorting and point filling, and a debug image for every frame """
+    def __init__(self, first_frame, verbose=False):
+        self.old_gray = cv2.cvtColor(first_frame, cv2.COLOR_BGR2GRAY)
+        self.orb = cv2.ORB_create()
+        self.old_kp, self.old_des = self.orb.detectAndCompute(self.old_gray, None)
+        self.old_frame = first_frame
+        self.old_yaw = 0.0
+        self.old_t = np.array([0.0,0.0])
+
+    def estimate(self, frame):
+        new_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        new_kp, new_des = self.orb.detectAndCompute(new_gray, None)
+        yaw, t, img = self.old_yaw, self.old_t, frame
+        if new_des is not None and self.old_des is not None:
+            matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
+            matches = matcher.match(self.old_des, new_des)
+            matches = sorted(matches, key= lambda x:x.distance)
+            if len(matches) > 100:
+                points1 = np.zeros((len(matches),2), dtype=np.float32)
+                points2 = np.zeros((len(matches),2), dtype=np.float32)
+                for i,match in enumerate(matches):
+                    points1[i, :] = self.old_kp[match.queryIdx].pt
+                    points2[i, :] = new_kp[match.trainIdx].pt
+                h, mask = cv2.findHomography(points1, points2, cv2.RANSAC)
+                if (mask==1).sum() > 50:
+                    img = cv2.drawMatches(self.old_frame, self.old_kp, frame, new_kp, matches, None, matchesMask=mask.ravel().tolist())
+                    hn = h / h[2,2]
+                    t = hn[:2,2]
+                    yaw = math.atan2(hn[1,0],hn[0,0])
+                    self.old_yaw, self.old_t = yaw, t
+        self.old_frame, self.old_kp, self.old_des = frame, new_kp, new_des
+        return yaw, t, img
+
+def run(estimator_class, frames, **kwargs):
+    """ Returns the time of each estimate in seconds and the (steps-1,3) yaw, tx, ty estimates """
+    estimator = estimator_class(frames[0], **kwargs)
+    times, odometry = [], []
+    for frame in frames[1:]:
+        start = time.perf_counter()
+        yaw, t, _ = estimator.estimate(frame)
+        times.append(time.perf_counter() - start)
+        odometry.append([yaw, t[0], t[1]])
+    return np.array(times), np.array(odometry)
+
+def report(name, times, odometry, reference, distance, turn):
+    """ Print latency, difference with the reference estimator and error with respect to the route """
+    yaw_diff = np.degrees(np.abs(odometry[:,0] - reference[:,0])).mean()
+    t_diff = np.linalg.norm(odometry[:,1:] - reference[:,1:], axis=1).mean()
+    dist_error = np.abs(0.37 * np.linalg.norm(odometry[:,1:], axis=1) - distance).mean()
+    yaw_error = np.degrees(np.abs((odometry[:,0] + turn + np.pi) % (2*np.pi) - np.pi)).mean()     # Image rotation is opposite to the turn
+    print('{:>22} {:>10.2f} {:>10.2f} {:>14.3f} {:>14.2f} {:>14.2f} {:>14.3f}'.format(
+        name, 1000*np.median(times), 1000*np.percentile(times, 95), yaw_diff, t_diff, dist_error, yaw_error))
+    return times
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataroot', type=str, required=True, help='Directory with the aerial tiles')
+    parser.add_argument('--area', type=str, default='SP50NW', help='Testing area')
+    parser.add_argument('--seed', type=int, default=440, help='Seed of the testing routes')
+    parser.add_argument('--trial', type=int, default=0, help='Route index')
+    parser.add_argument('--steps', type=int, default=200, help='Number of frames')
+    parser.add_argument('--orb_features', type=int, nargs='+', default=[250, 1000], help='ORB feature caps to compare with the default 500')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1], help='Pyramid levels to compare with the full resolution')
+    opt = parser.parse_args()
+
+    frames, poses = render_route(opt.dataroot, opt.area, opt.trial, opt.steps, opt.seed)
+    distance, turn = true_odometry(poses)
+
+    print('{:>22} {:>10} {:>10} {:>14} {:>14} {:>14} {:>14}'.format('estimator', 'p50 (ms)', 'p95 (ms)', 'yaw diff (deg)', 't diff (px)', 'dist err (m)', 'yaw err (deg)'))
+    legacy_times, reference = run(LegacyHomography, frames)
+    report('original', legacy_times, reference, reference, distance, turn)
+    configurations = [('optimized', {})]
+    configurations += [('nfeatures={}'.format(n), {'nfeatures': n}) for n in opt.orb_features]
+    configurations += [('level={}'.format(level), {'level': level}) for level in opt.levels]
+    for name, kwargs in configurations:
+        times, odometry = run(Homography, frames, **kwargs)
+        report(name, times, odometry, reference, distance, turn)
@@ -0,0 +1,49 @@
+""" Convergence of uniform and retrieval-seeded particle initialization for several particle budgets.
+
+    A route converges when its localization error stays below --threshold meters until the end.
+
+    Usage (from the repository root):
+        python -m benchmarks.init_benchmark --area SP50NW --np 1000 2000 5000 10000 20000
+"""
+import argparse
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter
+
+
+def convergence_step(errors, threshold):
+    """ First step after which errors stay below threshold, None if the route did not converge """
+    above = np.nonzero(errors >= threshold)[0]
+    if above.shape[0] == 0:
+        return 0
+    return above[-1] + 1 if above[-1] + 1 < errors.shape[0] else None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--area', type=str, default='SP50NW', help='Area whose grid size is used')
+    parser.add_argument('--np', type=int, nargs='+', default=[1000, 2000, 5000, 10000, 20000], help='Particle budgets')
+    parser.add_argument('--retrieval_topk', type=int, default=1000, help='Number of retrieved grid cells')
+    parser.add_argument('--retrieval_uniform', type=float, default=0.1, help='Minimum fraction of uniform particles')
+    parser.add_argument('--retrieval_seeded', type=int, default=5000, help='Maximum number of seeded particles')
+    parser.add_argument('--threshold', type=float, default=50, help='Localization error in meters under which a route is converged')
+    parser.add_argument('--steps', type=int, default=60, help='Number of filter steps')
+    parser.add_argument('--routes', type=int, default=20, help='Number of simulated routes')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    print('{:>8} {:>10} {:>11} {:>16} {:>14}'.format('np', 'init', 'converged', 'mean step', 'MLE (m)'))
+    for nparticles in opt.np:
+        for init in ['uniform', 'retrieval']:
+            args = ['--np', str(nparticles), '--particles_init', init,
+                    '--retrieval_topk', str(opt.retrieval_topk), '--retrieval_uniform', str(opt.retrieval_uniform),
+                    '--retrieval_seeded', str(opt.retrieval_seeded)]
+            localizer = synthetic_localizer(args, area=opt.area, seed=opt.seed)
+            steps, errors = [], []
+            for r in range(opt.routes):
+                route = simulate_route(localizer, opt.steps, seed=opt.seed + r)
+                _, e, _ = run_filter(localizer, route, trial=r)
+                steps.append(convergence_step(e, opt.threshold))
+                errors.append(e[-opt.steps//4:].mean())
+            converged = [s for s in steps if s is not None]
+            mean_step = '{:.1f}'.format(np.mean(converged)) if converged else '-'
+            print('{:>8} {:>10} {:>8}/{:<2} {:>16} {:>14.1f}'.format(nparticles, init, len(converged), opt.routes, mean_step, np.mean(errors)))
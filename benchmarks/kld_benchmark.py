@@ -0,0 +1,52 @@
+""" Number of particles, step time and localization error of KLD-sampling compared with the default pruning.
+
+    Usage (from the repository root):
+        python -m benchmarks.kld_benchmark --area SP50NW --np 20000 --np_min 1000
+"""
+import argparse
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--area', type=str, default='SP50NW', help='Area whose grid size is used')
+    parser.add_argument('--np', type=int, default=20000, help='Initial number of particles')
+    parser.add_argument('--np_min', type=int, default=1000, help='Minimum number of particles with KLD-sampling')
+    parser.add_argument('--np_max', type=int, default=None, help='Maximum number of particles with KLD-sampling')
+    parser.add_argument('--kld_epsilon', type=float, default=0.05, help='KLD-sampling error bound')
+    parser.add_argument('--kld_delta', type=float, default=0.01, help='KLD-sampling probability of exceeding the bound')
+    parser.add_argument('--steps', type=int, default=60, help='Number of filter steps')
+    parser.add_argument('--routes', type=int, default=5, help='Number of simulated routes')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    args = ['--np', str(opt.np)]
+    kld_args = ['--particle_count', 'kld', '--np_min', str(opt.np_min), '--kld_epsilon', str(opt.kld_epsilon), '--kld_delta', str(opt.kld_delta)]
+    if opt.np_max is not None:
+        kld_args += ['--np_max', str(opt.np_max)]
+    localizers = {
+        'prune' : synthetic_localizer(args, area=opt.area, seed=opt.seed),
+        'kld' : synthetic_localizer(args + kld_args, area=opt.area, seed=opt.seed)
+    }
+
+    counts, times, errors = {}, {}, {}
+    for name, localizer in localizers.items():
+        counts[name], times[name], errors[name] = [], [], []
+        for r in range(opt.routes):
+            route = simulate_route(localizer, opt.steps, seed=opt.seed + r)
+            trial_counts = []
+            _, e, timer = run_filter(localizer, route, trial=r, counts=trial_counts)
+            counts[name].append(trial_counts)
+            times[name].append(timer.total() / (opt.steps - 1))
+            errors[name].append(e[-opt.steps//4:].mean())          # Error once the filter had time to converge
+
+    print('Mean number of particles per step')
+    print('{:>6} {:>10} {:>10}'.format('step', 'prune', 'kld'))
+    for step in range(0, opt.steps, max(1, opt.steps // 10)):
+        print('{:>6} {:>10.0f} {:>10.0f}'.format(step, *[np.mean(np.array(counts[name])[:,step]) for name in localizers]))
+
+    print('\n{:>8} {:>16} {:>16} {:>10}'.format('', 'particles/step', 'time/step (ms)', 'MLE (m)'))
+    for name in localizers:
+        print('{:>8} {:>16.0f} {:>16.3f} {:>10.1f}'.format(name, np.mean(counts[name]), np.mean(times[name]), np.mean(errors[name])))
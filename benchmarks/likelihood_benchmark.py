@@ -0,0 +1,45 @@
+""" Time and memory allocated per call of update_weights with the pairwise, fused and lookup table likelihoods.
+
+    Usage (from the repository root):
+        python -m benchmarks.likelihood_benchmark --np 1000 20000 200000
+"""
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, random_pose, observation_at
+
+
+def measure(localizer, particles, observation, repeat):
+    localizer.update_weights(particles.copy(), observation)           # warm up, buffers are allocated here
+    times, peaks = [], []
+    for _ in range(repeat):
+        p = particles.copy()
+        tracemalloc.start()
+        start = time.perf_counter()
+        localizer.update_weights(p, observation)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return 1000 * np.median(times), np.median(peaks) / 2**20
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--np', type=int, nargs='+', default=[1000, 20000, 200000], help='Number of particles')
+    parser.add_argument('--area', type=str, default='SP50NW', help='Area whose grid size is used')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of repetitions per measurement')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    print('{:>10} {:>10} {:>10} {:>16}'.format('particles', 'likelihood', 'time (ms)', 'allocated (MiB)'))
+    for N in opt.np:
+        for likelihood in ['pairwise', 'fused', 'lut']:
+            localizer = synthetic_localizer(['--np', str(N), '--likelihood', likelihood], area=opt.area, seed=opt.seed)
+            rng = np.random.RandomState(opt.seed)
+            particles = localizer.init_particles(rng)
+            observation = observation_at(localizer, random_pose(localizer, rng))
+            t, mem = measure(localizer, particles, observation, opt.repeat)
+            print('{:>10} {:>10} {:>10.3f} {:>16.2f}'.format(N, likelihood, t, mem))
+        auto = synthetic_localizer(['--np', str(N), '--likelihood', 'auto'], area=opt.area, seed=opt.seed)
+        print('{:>10} {:>10} {}'.format(N, 'auto', 'uses ' + auto.get_likelihood_mode(N)))
@@ -0,0 +1,59 @@
+""" Time to render the (cell, orientation) samples of MetaTilesPredictDataset over a whole area with a MetaTile per sample and with a TileMosaic.
+
+    Usage (from the repository root):
+        python -m benchmarks.mosaic_benchmark --dataroot <dataroot> --areas London_test SP50NW
+"""
+import time
+import argparse
+import numpy as np
+
+from aerial.tile import MetaTile, TileMosaic
+from aerial.slippy import extent_to_tiles, tile_centres
+from aerial.area import get_area_extents
+
+
+def area_samples(extent, zoom, T):
+    """ Limits of the tiles of an area and the (lat, lon, theta) of every sample, in the order of MetaTilesPredictDataset """
+    limits = extent_to_tiles(extent, zoom)
+    lat, lon = tile_centres(limits, zoom)
+    t = np.linspace(0, 2*np.pi, T, endpoint=False)
+    samples = [(a, b, theta) for a, b in zip(lat.ravel().tolist(), lon.ravel().tolist()) for theta in t]
+    return limits, samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataroot', type=str, required=True, help='Directory with the aerial_tiles and map_tiles directories')
+    parser.add_argument('--areas', type=str, nargs='+', default=['London_test', 'SP50NW'], help='Areas to render')
+    parser.add_argument('--domain', type=str, default='aerial', choices=['aerial', 'map'], help='Domain of the tiles')
+    parser.add_argument('--aerial_dir', type=str, default='aerial_tiles', help='Name of directory with the aerial tiles')
+    parser.add_argument('--zoom', type=int, default=18, help='Zoom level of the tiles')
+    parser.add_argument('--T', type=int, default=8, help='Orientation resolution')
+    parser.add_argument('--metatile_samples', type=int, default=500, help='Number of random samples rendered with MetaTile, its time for the whole area is extrapolated')
+    parser.add_argument('--mosaic_dir', type=str, default=None, help='If set, the mosaic is memory-mapped from this directory')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    rng = np.random.RandomState(opt.seed)
+    print('{:>12} {:>9} {:>12} {:>16} {:>14} {:>16} {:>16} {:>9} {:>9}'.format('area', 'samples', 'build (s)', 'metatile (ms)', 'mosaic (ms)', 'metatile (s)', 'mosaic (s)', 'speed-up', 'max diff'))
+    for area in opt.areas:
+        limits, samples = area_samples(get_area_extents()[area], opt.zoom, opt.T)
+
+        start = time.perf_counter()
+        path = None if opt.mosaic_dir is None else '{}/{}_{}_z{}.npy'.format(opt.mosaic_dir, area, opt.domain, opt.zoom)
+        mosaic = TileMosaic(limits, opt.zoom, opt.dataroot, opt.domain, opt.aerial_dir, path)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for lat, lon, theta in samples:
+            mosaic.get_metatile(lat, lon, rotation=theta)
+        t_mosaic = (time.perf_counter() - start) / len(samples)
+
+        subset = rng.choice(len(samples), min(opt.metatile_samples, len(samples)), replace=False)
+        start = time.perf_counter()
+        images = [MetaTile((samples[i][0], samples[i][1], opt.zoom), opt.dataroot, opt.aerial_dir).get_metatile(domains=[opt.domain], rotation=samples[i][2])[0] for i in subset]
+        t_metatile = (time.perf_counter() - start) / len(subset)
+        diff = max(np.abs(image.astype(int) - mosaic.get_metatile(*samples[i][:2], rotation=samples[i][2])).max() for image, i in zip(images, subset))
+
+        total_metatile, total_mosaic = t_metatile * len(samples), build + t_mosaic * len(samples)
+        print('{:>12} {:>9} {:>12.2f} {:>16.3f} {:>14.3f} {:>16.1f} {:>16.1f} {:>9.1f} {:>9}'.format(area, len(samples), build, 1000*t_metatile, 1000*t_mosaic, total_metatile, total_mosaic, total_metatile/total_mosaic, diff))
@@ -0,0 +1,122 @@
+""" Step time, peak memory and localization error of the filter with particles in a float32 ParticleSet, compared with the original float64 (N,4) array.
+
+    Usage (from the repository root):
+        python -m benchmarks.particleset_benchmark --area SP50NW --np 20000 100000
+"""
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter, Timer
+from utils.util import haversine
+
+
+class LegacyFilter():
+    """ The original filter math, particles are a (N,4) float64 array and every resampling step copies it """
+    def __init__(self, localizer):
+        self.localizer = localizer
+
+    def init_particles(self, rng, observation=None):
+        area, n = self.localizer.area, self.localizer.np
+        lat = rng.uniform(area.workingbbox[0],area.workingbbox[2],n)
+        lon = rng.uniform(area.workingbbox[1],area.workingbbox[3],n)
+        yaw = rng.uniform(0,2*np.pi,n)
+        return np.stack([lat,lon,yaw,np.full(n, 1/n)],axis=1)
+
+    def motion_update(self, particles, dx, dy, turn, noise):
+        particles[:,2] += turn
+        dlon_m = dx*np.cos(-particles[:,2]) - dy*np.sin(-particles[:,2]) + noise[:,2]
+        dlat_m = dx*np.sin(-particles[:,2]) + dy*np.cos(-particles[:,2]) + noise[:,1]
+        (disp_lat, disp_lon) = self.localizer.area.m2deg((dlat_m, dlon_m))
+        particles[:,0] += disp_lat
+        particles[:,1] += disp_lon
+        particles[:,2] += noise[:,0]
+        particles[:,2] = np.where(particles[:,2] < 0.0, particles[:,2] + 2*np.pi, particles[:,2])
+        particles[:,2] %= 2*np.pi
+        bbox = self.localizer.area.workingbbox
+        a, c = np.greater(particles[:,0], bbox[2]), np.greater(particles[:,1], bbox[3])
+        b, d = np.less(particles[:,0], bbox[0]), np.less(particles[:,1], bbox[1])
+        particles[:,3] *= (1-a) * (1-b) * (1-c) * (1-d)
+
+    def update_weights(self, particles, observation):
+        localizer = self.localizer
+        H, W, T, _ = localizer.map_features.shape
+        x = (particles[:,1] - localizer.wf_min_lon) * (W - 1) / (localizer.wf_max_lon-localizer.wf_min_lon)
+        y = (localizer.wf_max_lat - particles[:,0]) * (H - 1) / (localizer.wf_max_lat-localizer.wf_min_lat)
+        t = particles[:,2] * T / (2*np.pi)
+        particles[:,-1] *= localizer.likelihoods[localizer.get_likelihood_mode(particles.shape[0])](y, x, t, observation)
+        particles[:,-1] /= particles[:,-1].sum()
+
+    def needs_resampling(self, particles):
+        return 1.0 / np.sum(np.power(particles[:,-1], 2)) < self.localizer.opt.resampling_threshold*particles.shape[0]
+
+    def resample(self, particles, rng):
+        sorted_idx = np.argsort(particles[:,-1])[::-1]
+        if particles.shape[0] > 5000:
+            nparticles = max(int(0.90*particles.shape[0]), 5000)
+            particles = particles[sorted_idx[0:nparticles],:]
+            particles[:,-1] /= particles[:,-1].sum()
+        particles = particles[self.localizer.resampler(particles[:,-1], rng),:]
+        particles[:,-1] = 1.0 / particles.shape[0]
+        return particles
+
+    def get_estimate(self, particles):
+        mean_lat = np.average(particles[:,0], weights=particles[:,-1])
+        mean_lon = np.average(particles[:,1], weights=particles[:,-1])
+        mc = np.average(np.cos(particles[:,2]), weights=particles[:,-1])
+        ms = np.average(np.sin(particles[:,2]), weights=particles[:,-1])
+        return np.asarray([mean_lat, mean_lon, np.arctan2(ms,mc)])
+
+def run_legacy(localizer, route, trial=0):
+    """ run_filter with the original filter math """
+    legacy = LegacyFilter(localizer)
+    poses, odometry, observations = route
+    timer = Timer()
+    rng = localizer.get_trial_rng(trial)
+    particles = legacy.init_particles(rng)
+    estimates = [legacy.get_estimate(particles)]
+    for step in range(1, poses.shape[0]):
+        dx, dy, turn = odometry[step]
+        noise = timer('noise', localizer.sample_motion_noise, particles.shape[0], rng)
+        timer('motion', legacy.motion_update, particles, dx, dy, turn, noise)
+        timer('weights', legacy.update_weights, particles, observations[step])
+        if legacy.needs_resampling(particles):
+            particles = timer('resampling', legacy.resample, particles, rng)
+        estimates.append(timer('estimate', legacy.get_estimate, particles))
+    errors = np.array([1000 * haversine(e[0], e[1], p[0], p[1]) for e, p in zip(estimates, poses)])
+    return np.stack(estimates), errors, timer
+
+def measure(run, localizer, route, trial):
+    """ Returns the errors, the Timer and the peak memory in MiB allocated while filtering """
+    tracemalloc.start()
+    _, errors, timer = run(localizer, route, trial)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return errors, timer, peak
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--area', type=str, default='SP50NW', help='Area whose grid size is used')
+    parser.add_argument('--np', type=int, nargs='+', default=[20000, 100000], help='Number of particles')
+    parser.add_argument('--steps', type=int, default=60, help='Number of filter steps')
+    parser.add_argument('--routes', type=int, default=3, help='Number of simulated routes')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    phases = ['noise', 'motion', 'weights', 'resampling', 'estimate']
+    print('{:>10} {:>12} '.format('particles', 'container') + ' '.join('{:>11}'.format(p) for p in phases) + ' {:>15} {:>10} {:>10}'.format('step (ms)', 'peak (MiB)', 'MLE (m)'))
+    for N in opt.np:
+        localizer = synthetic_localizer(['--np', str(N), '--likelihood', 'fused'], area=opt.area, seed=opt.seed)
+        routes = [simulate_route(localizer, opt.steps, seed=opt.seed + r) for r in range(opt.routes)]
+        for name, run in [('(N,4) f64', run_legacy), ('ParticleSet', run_filter)]:
+            run(localizer, routes[0], 0)                                # warm up, likelihood buffers are allocated here
+            timers, peaks, errors = [], [], []
+            for r, route in enumerate(routes):
+                e, timer, peak = measure(run, localizer, route, r)
+                timers.append(timer)
+                peaks.append(peak)
+                errors.append(e[-opt.steps//4:].mean())
+            medians = [np.mean([t.median(p) for t in timers]) for p in phases]
+            step = np.mean([t.total() / (opt.steps - 1) for t in timers])
+            print('{:>10} {:>12} '.format(N, name) + ' '.join('{:>11.3f}'.format(m) for m in medians) + ' {:>15.3f} {:>10.1f} {:>10.1f}'.format(step, max(peaks), np.mean(errors)))
@@ -0,0 +1,40 @@
+""" Per-step latency of the numpy and torch particle filter backends on a synthetic descriptor grid.
+
+    The torch backend runs on the CPU, or on the first GPU of --gpu_ids. Phases of a GPU step are queued
+    asynchronously and waited for by the estimate, so only the step total is comparable across devices.
+
+    Usage (from the repository root):
+        python -m benchmarks.pf_backend_benchmark --np 20000 200000 --area SP50NW --descriptor_dtype float32 --gpu_ids 0
+"""
+import argparse
+import numpy as np
+import torch
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter
+from aerial.quantize import quantize_grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--np', type=int, nargs='+', default=[5000, 20000, 200000], help='Number of particles')
+    parser.add_argument('--area', type=str, default='SP50NW', help='Area whose grid size is used')
+    parser.add_argument('--descriptor_dtype', type=str, default='float64', help='Data type of the descriptor grid of both backends')
+    parser.add_argument('--gpu_ids', type=int, nargs='*', default=[], help='GPU of the torch backend, the CPU if none')
+    parser.add_argument('--steps', type=int, default=30, help='Number of filter steps')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    phases = ['noise', 'motion', 'weights', 'resampling', 'estimate']
+    device = 'cuda:{}'.format(opt.gpu_ids[0]) if opt.gpu_ids else 'cpu'
+    print('torch intra-op threads: {}, torch device: {}, grid: {}'.format(torch.get_num_threads(), device, opt.descriptor_dtype))
+    print('{:>10} {:>8} '.format('particles', 'backend') + ' '.join('{:>11}'.format(p) for p in phases) + ' {:>11} {:>9}'.format('step (ms)', 'MLE (m)'))
+
+    for N in opt.np:
+        for backend in ['numpy', 'torch']:
+            args = ['--np', str(N), '--pf_backend', backend, '--descriptor_dtype', opt.descriptor_dtype]
+            localizer = synthetic_localizer(args, area=opt.area, seed=opt.seed, gpu_ids=opt.gpu_ids if backend == 'torch' else [])
+            route = simulate_route(localizer, opt.steps, seed=opt.seed)                # Observations of the float64 grid
+            localizer.set_map_features(quantize_grid(localizer.map_features, opt.descriptor_dtype)[0])
+            _, errors, timer = run_filter(localizer, route)
+            medians = [timer.median(p) for p in phases]
+            print('{:>10} {:>8} '.format(N, backend) + ' '.join('{:>11.3f}'.format(m) for m in medians) + ' {:>11.3f} {:>9.1f}'.format(timer.total() / (opt.steps-1), errors[-1]))
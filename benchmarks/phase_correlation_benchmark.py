@@ -0,0 +1,43 @@
+""" Latency and odometry error of the phase correlation estimator compared with the ORB homography, on frames rendered along testing routes.
+
+    Usage (from the repository root):
+        python -m benchmarks.phase_correlation_benchmark --dataroot $DATASETS/digimap_data --area SP50NW --trials 0 1 2 --steps 200
+"""
+import argparse
+import numpy as np
+
+from aerial.motion_estimate import Homography, PhaseCorrelation
+from benchmarks.utils import render_route, true_odometry
+from benchmarks.homography_benchmark import run, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataroot', type=str, required=True, help='Directory with the aerial tiles')
+    parser.add_argument('--area', type=str, default='SP50NW', help='Testing area')
+    parser.add_argument('--seed', type=int, default=440, help='Seed of the testing routes')
+    parser.add_argument('--trials', type=int, nargs='+', default=[0, 1, 2], help='Route indexes')
+    parser.add_argument('--steps', type=int, default=200, help='Number of frames per route')
+    parser.add_argument('--responses', type=float, nargs='+', default=[0.05], help='Minimum phase correlation responses to compare')
+    opt = parser.parse_args()
+
+    configurations = [('homography', Homography, {})]
+    configurations += [('phase response={}'.format(r), PhaseCorrelation, {'min_response': r}) for r in opt.responses]
+    times = {name: [] for name, _, _ in configurations}
+    odometry = {name: [] for name, _, _ in configurations}
+    distance, turn = [], []
+    for trial in opt.trials:
+        frames, poses = render_route(opt.dataroot, opt.area, trial, opt.steps, opt.seed)
+        trial_distance, trial_turn = true_odometry(poses)
+        distance.append(trial_distance)
+        turn.append(trial_turn)
+        for name, estimator_class, kwargs in configurations:
+            trial_times, trial_odometry = run(estimator_class, frames, **kwargs)
+            times[name].append(trial_times)
+            odometry[name].append(trial_odometry)
+
+    distance, turn = np.concatenate(distance), np.concatenate(turn)
+    reference = np.concatenate(odometry['homography'])
+    print('{:>22} {:>10} {:>10} {:>14} {:>14} {:>14} {:>14}'.format('estimator', 'p50 (ms)', 'p95 (ms)', 'yaw diff (deg)', 't diff (px)', 'dist err (m)', 'yaw err (deg)'))
+    for name, _, _ in configurations:
+        report(name, np.concatenate(times[name]), np.concatenate(odometry[name]), reference, distance, turn)
@@ -0,0 +1,43 @@
+""" Grid memory, weighting time and localization error of the filter with float32, float16 and int8 descriptor grids, compared with float64, per area.
+
+    Usage (from the repository root):
+        python -m benchmarks.quantization_benchmark --areas London_test SP50NW ST57SE2017 --np 20000
+"""
+import argparse
+import numpy as np
+
+from benchmarks.utils import synthetic_localizer, simulate_route, run_filter
+from aerial.quantize import quantize_grid, dequantize_grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--areas', type=str, nargs='+', default=['London_test', 'SP50NW', 'ST57SE2017'], help='Areas whose grid size is used')
+    parser.add_argument('--dtypes', type=str, nargs='+', default=['float32', 'float16', 'int8'], help='Data types compared with float64')
+    parser.add_argument('--np', type=int, default=20000, help='Number of particles')
+    parser.add_argument('--likelihood', type=str, default='fused', help='Likelihood used to weight particles')
+    parser.add_argument('--steps', type=int, default=60, help='Number of filter steps')
+    parser.add_argument('--routes', type=int, default=5, help='Number of simulated routes per area')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    print('{:>12} {:>8} {:>10} {:>16} {:>14} {:>9} {:>10} {:>14}'.format('area', 'dtype', 'grid (MiB)', 'max abs error', 'weights (ms)', 'speed-up', 'MLE (m)', 'MLE diff (m)'))
+    for area in opt.areas:
+        localizer = synthetic_localizer(['--np', str(opt.np), '--likelihood', opt.likelihood], area=area, seed=opt.seed)
+        grid = localizer.map_features
+        routes = [simulate_route(localizer, opt.steps, seed=opt.seed + r) for r in range(opt.routes)]     # Observations of the float64 grid
+
+        reference = None
+        for dtype in ['float64'] + opt.dtypes:
+            quantized, scale = quantize_grid(grid, dtype)
+            localizer.set_map_features(quantized)
+            times, errors = [], []
+            for r, route in enumerate(routes):
+                _, e, timer = run_filter(localizer, route, trial=r)
+                times.append(timer.median('weights'))
+                errors.append(e[-opt.steps//4:].mean())                  # Error once the filter had time to converge
+            t, e = np.mean(times), np.mean(errors)
+            if reference is None:
+                reference = (t, e)
+            error = np.abs(dequantize_grid(quantized, scale) - grid).max()
+            print('{:>12} {:>8} {:>10.1f} {:>16.2e} {:>14.3f} {:>9.2f} {:>10.1f} {:>14.1f}'.format(area, dtype, quantized.nbytes / 2**20, error, t, reference[0]/t, e, e-reference[1]))
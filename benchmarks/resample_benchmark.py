@@ -0,0 +1,65 @@
+""" Compare the vectorized resamplers in aerial/resample.py against the original python loop.
+
+    Usage (from the repository root):
+        python -m benchmarks.resample_benchmark --np 5000 20000 200000
+"""
+import time
+import argparse
+import numpy as np
+
+from aerial.resample import get_resampler
+
+
+def loop_systematic_resample(weights):
+    """ Original implementation of AerialPFLocalizer.systematic_resample """
+    N = weights.shape[0]
+    sample = np.random.rand(1)
+    positions = (sample + np.arange(0,N)) / N
+
+    indexes = np.zeros((N))
+    cumulative_sum = np.cumsum(weights, axis=0)
+    cumulative_sum[-1] = 1.0
+    i, j = 0, 0
+    while i < N:
+        if positions[i] < cumulative_sum[j]:
+            indexes[i] = j
+            i += 1
+        else:
+            j += 1
+    return indexes.astype(np.int64)
+
+def random_weights(N):
+    weights = np.random.exponential(1.0, N) ** 4                        # Peaked distribution, similar to a converging filter
+    return weights / weights.sum()
+
+def timeit(fn, weights, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(weights)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--np', type=int, nargs='+', default=[5000, 20000, 200000], help='Number of particles')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions per measurement')
+    parser.add_argument('--seed', type=int, default=442, help='Set the seed')
+    opt = parser.parse_args()
+
+    methods = ['systematic', 'stratified', 'residual', 'multinomial']
+    print('{:>10} {:>14} '.format('particles', 'loop (ms)') + ' '.join('{:>14}'.format(m + ' (ms)') for m in methods))
+
+    for N in opt.np:
+        np.random.seed(opt.seed)
+        weights = random_weights(N)
+
+        # The vectorized systematic resampler must reproduce the loop exactly
+        np.random.seed(opt.seed)
+        reference = loop_systematic_resample(weights)
+        np.random.seed(opt.seed)
+        assert np.array_equal(reference, get_resampler('systematic')(weights))
+
+        t_loop = timeit(loop_systematic_resample, weights, opt.repeat)
+        t_methods = [timeit(get_resampler(m), weights, opt.repeat) for m in methods]
+        print('{:>10} {:>14.3f} '.format(N, 1000*t_loop) + ' '.join('{:>14.3f}'.format(1000*t) for t in t_methods))
@@ -0,0 +1,142 @@
+""" Helpers to benchmark the particle filter without tiles, model weights or predicted descriptors """
+import os
+import time
+import math
+import argparse
+import numpy as np
+
+from aerial.area import Area
+from aerial.robot import Robot
+from aerial.tile import num2deg, TileCache
+from localizer import create_localizer
+from localizer.aerialpf_localizer import AerialPFLocalizer
+from aerial.particles import ParticleSet
+from aerial.interpolate import trilinear_interpolation_numpy
+from aerial.fourier import fit_fourier
+from utils.util import haversine
+
+
+def smooth_random_grid(H, W, T, D, smooth=1, rng=np.random):
+    """ Random unit descriptors, box filtered 'smooth' times along y and x so neighbouring cells are correlated like real ones """
+    grid = rng.randn(H, W, T, D)
+    for _ in range(smooth):
+        padded = np.pad(grid, ((1,1),(1,1),(0,0),(0,0)), mode='edge')
+        grid = (padded[:-2] + padded[1:-1] + padded[2:]) / 3
+        grid = (grid[:,:-2] + grid[:,1:-1] + grid[:,2:]) / 3
+    return grid / np.linalg.norm(grid, axis=-1, keepdims=True)
+
+def synthetic_localizer(args=[], area='SP50NW', T=8, embedding_dim=16, smooth=1, seed=442, gpu_ids=[]):
+    """ Create an aerial particle filter over a random descriptor grid with the size of a testing area.
+
+        args is a list of command line options of the aerialpf localizer, e.g. ['--np', '20000']
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--localizer', type=str, default='aerialpf')
+    parser.add_argument('--seed', type=int, default=seed)
+    parser.add_argument('--scale', type=int, default=32)
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--steps', type=int, default=None)
+    parser = AerialPFLocalizer.modify_commandline_options(parser)
+    opt = parser.parse_args(args)
+    opt.gpu_ids = list(gpu_ids)
+
+    localizer = create_localizer(opt)
+    localizer.area = Area(area, None, None)
+    ymin, xmin, ymax, xmax = localizer.area.get_working_bbox_in_tile_coordinates()
+    H, W = localizer.area.get_area_size_in_tiles()
+
+    localizer.wf_max_lat, localizer.wf_min_lon = num2deg(xmin+0.5, ymin+0.5, localizer.area.zoom)
+    localizer.wf_min_lat, localizer.wf_max_lon = num2deg(xmax+0.5, ymax+0.5, localizer.area.zoom)
+    grid = smooth_random_grid(H, W, T, embedding_dim, smooth, np.random.RandomState(seed))
+    localizer.set_map_features(fit_fourier(grid, opt.fourier_harmonics) if opt.fourier_harmonics > 0 else grid)
+    return localizer
+
+def random_pose(localizer, rng=np.random):
+    bbox = localizer.area.innerbbox
+    return np.array([rng.uniform(bbox[0], bbox[2]), rng.uniform(bbox[1], bbox[3]), rng.uniform(0, 2*np.pi), 1.0])
+
+def observation_at(localizer, pose, noise=0.0, rng=np.random):
+    """ The aerial descriptor a network would produce at a pose, with optional gaussian noise on the unit descriptor """
+    y, x, t = AerialPFLocalizer.get_grid_coordinates(localizer, ParticleSet.from_states(np.expand_dims(pose, 0), dtype=np.float64))
+    descriptor = trilinear_interpolation_numpy(localizer.map_features, y, x, t)
+    descriptor = descriptor + noise * rng.randn(*descriptor.shape)
+    descriptor = localizer.opt.scale * descriptor / np.linalg.norm(descriptor)
+    return descriptor.astype(np.float32)
+
+def simulate_route(localizer, steps, noise=0.3, seed=442):
+    """ Returns ground truth poses, odometry (dx, dy, turn) and observations of a random route inside the area """
+    rng = np.random.RandomState(seed)
+    pose = ParticleSet.from_states(np.expand_dims(random_pose(localizer, rng), 0), dtype=np.float64)
+    poses, odometry, observations = [np.array(pose)[0,:3]], [np.zeros(3)], [observation_at(localizer, np.array(pose)[0], noise, rng)]
+    for step in range(1, steps):
+        dx, dy, turn = rng.normal(0, 0.5), rng.normal(5.0, 1.0), rng.normal(0, 0.03)
+        AerialPFLocalizer.motion_update(localizer, pose, dx, dy, turn, np.zeros((1,3)))
+        poses.append(np.array(pose)[0,:3])
+        odometry.append(np.array([dx, dy, turn]))
+        observations.append(observation_at(localizer, np.array(pose)[0], noise, rng))
+    return np.stack(poses), np.stack(odometry), observations
+
+def run_filter(localizer, route, trial=0, counts=None):
+    """ Run the filter math of localize_trial (no rendering, odometry estimation or CNN) over a simulated route.
+
+        Returns the estimates, the localization error in meters at each step and a Timer with the time of each phase.
+        If counts is a list, the number of particles after each step is appended to it.
+    """
+    poses, odometry, observations = route
+    timer = Timer()
+    rng = localizer.get_trial_rng(trial)
+    particles = localizer.init_particles(rng, observations[0])
+    estimates = [localizer.get_estimate(particles)]
+    if counts is not None:
+        counts.append(particles.shape[0])
+
+    for step in range(1, poses.shape[0]):
+        dx, dy, turn = odometry[step]
+        noise = timer('noise', localizer.sample_motion_noise, particles.shape[0], rng)
+        timer('motion', localizer.motion_update, particles, dx, dy, turn, noise)
+        timer('weights', localizer.update_weights, particles, observations[step])
+        if localizer.needs_resampling(particles):
+            particles = timer('resampling', localizer.resample, particles, rng)
+        estimates.append(timer('estimate', localizer.get_estimate, particles))
+        if counts is not None:
+            counts.append(particles.shape[0])
+
+    estimates = np.stack(estimates)
+    errors = np.array([1000 * haversine(e[0], e[1], p[0], p[1]) for e, p in zip(estimates, poses)])
+    return estimates, errors, timer
+
+def render_route(dataroot, area, trial=0, steps=100, seed=440):
+    """ Returns the aerial images sensed along a testing route, with the scale changes of localize, and the (steps,3) route poses """
+    area = Area(area, dataroot, None)
+    routes = np.load(os.path.join('aerial','routes','{}_{}.npz'.format(area.name, seed)))['routes']
+    robot = Robot('myaircraft', area, TileCache())
+    frames = []
+    for step in range(steps):
+        robot.move_to(*routes[trial,step])
+        scale = 2 ** (0.25 * math.sin(2*math.pi*step/50)) if step > 0 else 1.0
+        frames.append(robot.sense(scale=scale, domains=['aerial'])[0])
+    return frames, routes[trial,:steps]
+
+def true_odometry(poses):
+    """ Distance in meters and change of yaw in radians, wrapped to [-pi, pi), between consecutive poses """
+    distance = np.array([1000 * haversine(p[0], p[1], q[0], q[1]) for p, q in zip(poses[:-1], poses[1:])])
+    turn = (np.diff(poses[:,2]) + np.pi) % (2*np.pi) - np.pi
+    return distance, turn
+
+class Timer():
+    """ Accumulates the time spent in named phases """
+    def __init__(self):
+        self.times = {}
+
+    def __call__(self, name, fn, *args):
+        start = time.perf_counter()
+        out = fn(*args)
+        self.times.setdefault(name, []).append(time.perf_counter() - start)
+        return out
+
+    def median(self, name):
+        return 1000 * np.median(self.times[name]) if name in self.times else 0.0
+
+    def total(self, name=None):
+        names = [name] if name is not None else self.times.keys()
+        return 1000 * sum(np.sum(self.times.get(n, [])) for n in names)
@@ -1,3 +1,4 @@
+import os
 import cv2
 import torch
 import random
@@ -7,7 +8,8 @@ import torchvision.transforms as transforms
 
 from PIL import Image
 from utils.util import tensor2im
-from aerial.tile import MetaTile, deg2num, num2deg
+from aerial.tile import MetaTile, TileMosaic
+from aerial.slippy import extent_to_tiles, tile_centres
 from data.base_dataset import BaseDataset
 from data.transforms import AddGaussianNoise, RandomErasing
 from utils.util import modify_parser
@@ -56,7 +58,15 @@ class MetaTilesPredictDataset(BaseDataset):
         parser.add_argument('--pano_size', type=int, default=256, help='The size of the aerial image') 
         parser.add_argument('--extent', type=float, nargs=4, help='Optional working extent [min_lat, min_lon, max_lat, max_lon]') 
         parser.add_argument('--aerial_dir', type=str, default='aerial_tiles', help='Name of directory with the aerial tiles')
-        parser.add_argument('--domain', nargs='+', type=str, default="aerial", choices=["map","aerial"], help='A list of indices to show (based in python indexing 0:4999)')
+        parser.add_argument('--domain', nargs='+', type=str, default=['map', 'aerial'], choices=["map","aerial"], help='A list of indices to show (based in python indexing 0:4999)')
+        parser.add_argument('--mosaic', action='store_true', help='If set, the tiles of the area are decoded once into a mosaic and every sample is cropped and rotated from it')
+        parser.add_argument('--mosaic_dir', type=str, default=None, help='If set, mosaics are memory-mapped .npy files in this directory, built the first time and reused, otherwise they are kept in memory')
+        parser.add_argument('--dense', action='store_true', help='If set, predict_aerial.py rotates the mosaic of the area once per orientation and the first backbone layers run over it, shared by the cells')
+        parser.add_argument('--dense_split', type=str, default='layer1', help='Last backbone layer shared by the cells in dense prediction [conv1 | maxpool | layer1 | layer2 | layer3 | layer4 | layer5]')
+        parser.add_argument('--dense_window', type=int, default=1024, help='Crops starting in the same window of this size, in network input pixels, share a pass of the shared layers')
+        parser.add_argument('--shard_size', type=int, default=0, help='If positive, predict_aerial.py predicts blocks of shard_size x shard_size cells, saves each one as it finishes and skips the saved ones')
+        parser.add_argument('--shard', type=int, default=0, help='Index of the shard of blocks predicted by this process, blocks shard, shard + num_shards, ...')
+        parser.add_argument('--num_shards', type=int, default=1, help='Number of processes sharing the blocks of an area')
         
         modify_parser(parser, 'tile_zoom', 'nargs', '+')
 
@@ -93,12 +103,8 @@ class MetaTilesPredictDataset(BaseDataset):
         x = np.arange(limits[z][0],limits[z][2]+1,1)
         y = np.arange(limits[z][1],limits[z][3]+1,1)
         t = np.linspace(0,2*np.pi,T,endpoint=False)
-        c = np.zeros((y.shape[0],x.shape[0],4))
-
-        for j in range(H):
-            for i in range(W):
-                lat, lon = num2deg(x[i]+0.5,y[j]+0.5,z)
-                c[j,i,:] = np.asarray([lat, lon, y[j], x[i]])
+        lat, lon = tile_centres(limits[z], z)
+        c = np.stack(np.broadcast_arrays(lat, lon, y[:,None], x[None,:]), axis=-1)
         
         grid[:,:,:,:4] = np.expand_dims(c,2)
         grid[:,:,:, 4] = np.tile(t,H*W).reshape(H,W,T)
@@ -107,13 +113,21 @@ class MetaTilesPredictDataset(BaseDataset):
         self.aerial_dir = opt.aerial_dir 
         self.dataroot = opt.dataroot
 
+        # Mosaics are built before the data loader forks its workers, which share them
+        self.mosaics = {}
+        if opt.mosaic:
+            for domain in self.opt.domain:
+                path = None
+                if opt.mosaic_dir is not None:
+                    source = self.aerial_dir if domain == 'aerial' else 'map_tiles'
+                    path = os.path.join(opt.mosaic_dir, '{}_{}_z{}_{}_{}_{}_{}.npy'.format(os.path.basename(os.path.normpath(self.dataroot)), source, z, *limits[z]))
+                self.mosaics[domain] = TileMosaic(limits[z], z, self.dataroot, domain, self.aerial_dir, path)
+
     def set_coords(self, coords):
         self._coords = coords
 
     def get_limits(self,z):
-        min_x, min_y = deg2num(self.extent[2],self.extent[1],z)
-        max_x, max_y = deg2num(self.extent[0],self.extent[3],z)
-        return [min_x,min_y,max_x,max_y]
+        return extent_to_tiles(self.extent, z)
     
     def __getitem__(self, index):
         """
@@ -135,7 +149,10 @@ class MetaTilesPredictDataset(BaseDataset):
         loc = (lat, lon, self.opt.tile_zoom[0])
 
         for domain in self.opt.domain:
-            img = MetaTile(loc, self.dataroot, aerial_dir=self.opt.aerial_dir).get_metatile(domains=[domain],rotation=theta)[0]
+            if domain in self.mosaics:
+                img = self.mosaics[domain].get_metatile(lat, lon, rotation=theta)
+            else:
+                img = MetaTile(loc, self.dataroot, aerial_dir=self.opt.aerial_dir).get_metatile(domains=[domain],rotation=theta)[0]
             
             if self.opt.tile_size != 256 and domain == 'map':
                 img = cv2.resize(img, (self.opt.tile_size, self.opt.tile_size))
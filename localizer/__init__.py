@@ -32,11 +32,16 @@ def get_option_setter(localizer_name):
 
 def create_localizer(opt):
     """Create a localizer given the option.
+    If opt.pf_backend is given and it is not numpy, the class in "localizer/[localizer_name][pf_backend]_localizer.py" is used.
     Example:
         >>> from localizer import create_localizer
         >>> localizer = create_localizer(opt)
     """
-    localizer = find_localizer_using_name(opt.localizer)
+    localizer_name = opt.localizer
+    backend = getattr(opt, 'pf_backend', 'numpy')
+    if backend != 'numpy' and not localizer_name.endswith(backend):
+        localizer_name = localizer_name + backend
+    localizer = find_localizer_using_name(localizer_name)
     instance = localizer(opt)
     print("localizer [%s] was created" % type(instance).__name__)
     return instance
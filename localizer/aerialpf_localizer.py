@@ -1,30 +1,72 @@
 import os
+import copy
 import numpy as np
 
 import math
 import torch
+from statistics import NormalDist
 import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
 
 from localizer import BaseLocalizer
-from aerial.interpolate import trilinear_interpolation_numpy
+from aerial.interpolate import trilinear_interpolation_numpy, fourier_interpolation_numpy
+from aerial.resample import get_resampler
+from aerial.particles import ParticleSet
+from aerial.likelihood import FusedLikelihood, LookupLikelihood, HierarchicalLikelihood, FourierLikelihood
+from aerial.fourier import sample_fourier
+from aerial.quantize import DTYPES
+from aerial.states import StatesWriter
+from aerial.observation_cache import ObservationCache
 from aerial.grid_utils import *
-from aerial.motion_estimate import Homography as Mestimator
+from aerial.motion_estimate import Homography, PhaseCorrelation
 from sklearn.metrics import pairwise_distances
 from utils.util import haversine
+from utils.pipeline import Prefetcher
+from utils.profiler import StepProfiler
 
 from aerial.robot import Robot
 from aerial.area import Area
+from aerial.tile import TileCache
 from aerial.utils import *
 
+_worker_localizer = None
+
+def _init_worker(localizer, threads):
+    """ Pool initializer, the localizer is inherited by the forked worker """
+    global _worker_localizer
+    _worker_localizer = localizer
+    torch.set_num_threads(threads)
+
+def _localize_shard(args):
+    """ Run a subset of trials in a worker process and return their results """
+    trials, steps, writer = args
+    localizer = _worker_localizer
+    ntrials = localizer.routes.shape[0]
+
+    results = localizer.allocate_results(ntrials, steps)
+    if localizer.opt.batched:
+        localizer.localize_batch(trials, steps, results, writer)
+    else:
+        for trial in trials:
+            localizer.localize_trial(trial, steps, results, writer)
+    return trials, {key: value[trials] for key, value in results.items()}
+
 class AerialPFLocalizer(BaseLocalizer):
     def __init__(self, opt):
         BaseLocalizer.__init__(self, opt)
         self.np = opt.np
         self.trials = opt.trials
         self.steps = opt.steps
-        self.particles = np.zeros((opt.np,4))
+        self.resampler = get_resampler(opt.resampling)
         self.opt = opt
 
+        # Size of particle arrays, with KLD-sampling the number of particles can grow up to np_max
+        self.np_max = opt.np_max if opt.np_max is not None else opt.np
+        self.max_particles = max(self.np, self.np_max) if opt.particle_count == 'kld' else self.np
+        self.particles = ParticleSet(self.max_particles, self.np)
+        self.profiler = StepProfiler()                                  # Disabled unless opt.profile is set
+
     @staticmethod
     def modify_commandline_options(parser):
         """Add new dataset-specific options, and rewrite default values for existing options.
@@ -50,9 +92,41 @@ class AerialPFLocalizer(BaseLocalizer):
         parser.add_argument('--np', type=int, default = 20000, help='Number of particles')
         parser.add_argument('--particles_noise', type=float, nargs='+', default = [10,10], help="Particles's noise standard deviation in meters")
         parser.add_argument('--trials', type=int, nargs='+', default=None, help='Trial route indexes, if none will test all')
-        parser.add_argument('--states', action='store_true', help='If set, it will save a numpy array with the particles states at each step')
+        parser.add_argument('--states', action='store_true', help='If set, particles states at each step are streamed to disk as float32 instead of a states array in the results file, see aerial/states.py:load_states')
+        parser.add_argument('--states_mode', type=str, default='all', choices=['all', 'subsample', 'topk'], help='Record all particles, states_size evenly spaced particles or the states_size particles with highest weight')
+        parser.add_argument('--states_size', type=int, default=1000, help='Number of particles recorded per step with states_mode subsample or topk')
+        parser.add_argument('--motion_estimator', type=str, default='homography', choices=['homography', 'phase'], help='Visual odometry between consecutive images, homography of ORB features or Fourier phase correlation')
+        parser.add_argument('--phase_response', type=float, default=0.05, help='Phase correlation estimates with a lower peak response are replaced by the previous one')
+        parser.add_argument('--orb_features', type=int, default=500, help='Maximum number of ORB features used to estimate the homography between consecutive images')
+        parser.add_argument('--homography_level', type=int, default=0, help='Pyramid level where ORB features are detected, images are downsampled by 2**level')
+        parser.add_argument('--tile_cache', type=int, default=256, help='Number of tiles kept in memory to render sensed images, 0 disables the cache')
+        parser.add_argument('--prefetch', type=int, default=4, help='Tiles of the next route positions, up to this number of steps ahead, are loaded in the background')
+        parser.add_argument('--pipeline', action='store_true', help='If set, the next aerial image is rendered, its odometry estimated and embedded in a background thread while the filter updates on the current one')
+        parser.add_argument('--profile', action='store_true', help='If set, the duration of each phase of every step, the number of particles, Neff and MLE are written to results_dir/name/profile-<expname>-<area>-<seed>.jsonl')
+        parser.add_argument('--observation_cache', action='store_true', help='If set, aerial descriptors and odometry of each route are stored in results_dir/name/observations and replayed in later runs')
         parser.add_argument('--no_scale', action='store_true', help='If set, it disables changes in the scale')
         parser.add_argument('--pano_size', type=int, default=128, help='The size of the sensed image by the robot')
+        parser.add_argument('--resampling_threshold', type=float, default=2/3, help='Particles are resampled when the number of effective particles falls below this fraction of the particles')
+        parser.add_argument('--resampling', type=str, default='systematic', choices=['systematic', 'stratified', 'residual', 'multinomial'], help='Resampling method')
+        parser.add_argument('--batched', action='store_true', help='If set, all trials advance in lockstep and their observations are embedded as one batch per step')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes, trials are split across them')
+        parser.add_argument('--likelihood', type=str, default='fused', choices=['fused', 'lut', 'auto', 'hierarchical', 'pairwise'], help='fused interpolates and scores particles in a single pass with reused buffers, lut scores every grid cell and interpolates the likelihoods, auto picks the cheaper of both given the number of particles and grid cells so its scores are approximate when it picks lut, hierarchical (experimental, never picked by auto) scores particles on a downsampled grid and refines the most likely ones, it is about twice as fast as fused but its localization error is up to twice as large (see benchmarks/hierarchical_benchmark.py), pairwise interpolates descriptors and compares them with sklearn')
+        parser.add_argument('--pyramid_factor', type=int, default=2, help='Downsampling factor of the coarse grid used by the hierarchical likelihood')
+        parser.add_argument('--refine_fraction', type=float, default=0.2, help='Fraction of particles rescored on the full grid by the hierarchical likelihood')
+        parser.add_argument('--descriptor_dtype', type=str, default='float64', choices=DTYPES, help='Data type of the descriptor grid, float16 and int8 grids (see aerial/quantize.py) take 4 and 8 times less memory and are dequantized during interpolation')
+        parser.add_argument('--fourier_harmonics', type=int, default=0, help='If not 0, the orientation axis of the descriptor grid is stored as a Fourier series with this number of harmonics (see aerial/fourier.py) and evaluated at the heading of each particle with the fused and pairwise likelihoods, the lut and hierarchical likelihoods and retrieval use the series sampled at 2K+1 headings')
+        parser.add_argument('--pf_backend', type=str, default='numpy', choices=['numpy', 'torch'], help='Array library used by the particle filter')
+        parser.add_argument('--particle_count', type=str, default='prune', choices=['prune', 'kld'], help='prune removes 10%% of the particles at each resampling down to 5000, kld adapts the number of particles to the spread of the posterior (KLD-sampling)')
+        parser.add_argument('--kld_epsilon', type=float, default=0.05, help='KLD-sampling bound on the KL divergence between the particles and the true posterior')
+        parser.add_argument('--kld_delta', type=float, default=0.01, help='KLD-sampling probability of exceeding kld_epsilon')
+        parser.add_argument('--kld_bin_size', type=float, nargs=3, default=[25, 25, np.pi/4], help='Size of the KLD-sampling (lat, lon, yaw) bins in meters, meters and radians')
+        parser.add_argument('--np_min', type=int, default=1000, help='Minimum number of particles with KLD-sampling')
+        parser.add_argument('--np_max', type=int, default=None, help='Maximum number of particles with KLD-sampling, np by default')
+        parser.add_argument('--particles_init', type=str, default='uniform', choices=['uniform', 'retrieval'], help='uniform spreads particles over the working area, retrieval seeds them around the grid cells that best match the first observation')
+        parser.add_argument('--retrieval_topk', type=int, default=1000, help='Number of (y, x, t) grid cells retrieved to seed particles, each is drawn with a probability proportional to the likelihood of the first observation there')
+        parser.add_argument('--retrieval_spread', type=float, nargs=2, default=[50, np.pi/8], help='Standard deviation of seeded particles around the retrieved cells, in meters along both latitude and longitude and in radians along yaw')
+        parser.add_argument('--retrieval_uniform', type=float, default=0.1, help='Minimum fraction of particles spread uniformly when they are seeded by retrieval')
+        parser.add_argument('--retrieval_seeded', type=int, default=5000, help='Maximum number of particles seeded by retrieval, the remaining ones are spread uniformly so the uniform share grows with np')
 
         return parser
 
@@ -76,15 +150,28 @@ class AerialPFLocalizer(BaseLocalizer):
         self.device = torch.device('cuda:{}'.format(self.opt.gpu_ids[0])) if self.opt.gpu_ids else torch.device('cpu')  # get device name: CPU or GPU
 
     def observation_model(self, observation, pano_size=128):
-        aerial = prepare_tile(observation, pano_size, preprocess=self.opt.preprocess).to(self.device)
+        """ Embed an aerial image, or a list of aerial images as a single batch """
+        observations = observation if isinstance(observation, list) else [observation]
+        aerial = torch.cat([prepare_tile(o, pano_size, preprocess=self.opt.preprocess) for o in observations], 0).to(self.device)
         _, aerial_descriptor = self.aerial_net(aerial)
         return aerial_descriptor
 
-    def setup(self): 
-        # Set up test area
-        self.area = Area(self.opt.area, self.opt.dataroot, self.opt.results_dir)                              
-        map_features, working_frame = self.area.get_map_descriptors(self.opt.name, self.opt.epoch)
-        self.map_features = map_features
+    def setup(self, routes=True): 
+        """ Set up the test area, its testing routes are read unless routes is False, e.g. for an online session """
+        area = Area(self.opt.area, self.opt.dataroot, self.opt.results_dir)                              
+        map_features, working_frame = area.get_map_descriptors(self.opt.name, self.opt.epoch, self.opt.descriptor_dtype, self.opt.fourier_harmonics)
+        self.set_area(area, map_features, working_frame)
+        if routes:
+            self.load_routes()
+
+    def set_area(self, area, map_features, working_frame):
+        """ Set the test area with its descriptor grid and working frame.
+
+            It allows several localizers to share an area loaded once.
+        """
+        self.area = area
+        self.working_frame = working_frame
+        self.set_map_features(map_features)
         
         self.wf_min_lon = working_frame[0,:,0,1].min() 
         self.wf_max_lon = working_frame[0,:,0,1].max()
@@ -92,123 +179,277 @@ class AerialPFLocalizer(BaseLocalizer):
         self.wf_max_lat = working_frame[:,0,0,0].max()
 
         # Read testing routes for the selected area
+        self.tile_cache = TileCache(self.opt.tile_cache) if self.opt.tile_cache > 0 else None
+
+        root = os.path.join(self.opt.results_dir, self.opt.name)
+        self.observation_cache = ObservationCache(root, self.opt.epoch, self.area.name, self.opt.seed, self.opt.pano_size, self.odometry_source()) if self.opt.observation_cache else None
+
+    def load_routes(self):
+        """ Read the testing routes of the area, localize runs the particle filter over them """
         path = os.path.join('aerial','routes','{}_{}.npz'.format(self.area.name,self.opt.seed)) 
         self.routes = np.load(path)['routes']
 
-    def init_particles(self):
+    def set_map_features(self, map_features):
+        """ Set the (H,W,T,D) descriptor grid used to weight particles, or its (H,W,2K+1,D) Fourier coefficients.
+
+            map_samples holds the descriptors at the T headings of the grid. Fourier coefficients are sampled at
+            their 2K+1 headings, the ones get_grid_coordinates indexes, only if the lookup table, the hierarchical
+            likelihood or retrieval need them, otherwise map_samples is None.
+        """
+        self.map_features = map_features
+        self.map_samples = map_features
+        if self.opt.fourier_harmonics > 0:
+            needed = self.opt.likelihood in ['lut', 'auto', 'hierarchical'] or self.opt.particles_init == 'retrieval'
+            self.map_samples = sample_fourier(map_features).astype(np.result_type(map_features.dtype, np.float32), copy=False) if needed else None
+
+        self.likelihoods = {}
+        if self.opt.fourier_harmonics > 0:
+            self.likelihoods['fused'] = FourierLikelihood(map_features, self.opt.scale, self.max_particles)
+        elif self.opt.likelihood in ['fused', 'auto']:
+            self.likelihoods['fused'] = FusedLikelihood(map_features, self.opt.scale, self.max_particles)
+        if self.opt.likelihood in ['lut', 'auto']:
+            self.likelihoods['lut'] = LookupLikelihood(self.map_samples, self.opt.scale, self.max_particles)
+        if self.opt.likelihood == 'hierarchical':
+            self.likelihoods['hierarchical'] = HierarchicalLikelihood(self.map_samples, self.opt.scale, self.opt.pyramid_factor, self.opt.refine_fraction, self.max_particles)
+
+    def get_trial_rng(self, trial):
+        """ Each trial draws its random numbers from its own generator, so a trial gives the same result whether it runs alone, after other trials or in a batch """
+        seed = self.opt.seed + trial if self.opt.seed >= 0 else None
+        return np.random.RandomState(seed)
+
+    def init_particles(self, rng=np.random, observation=None):
+        """ Returns the initial np particles as a ParticleSet, the descriptor of the first observation is used when opt.particles_init is retrieval """
+        if self.opt.particles_init == 'retrieval' and observation is not None:
+            return self.init_particles_retrieval(observation, rng)
+
         area = self.area
-        lat = np.random.uniform(area.workingbbox[0],area.workingbbox[2],self.np)
-        lon = np.random.uniform(area.workingbbox[1],area.workingbbox[3],self.np) 
-        yaw = np.random.uniform(0,2*np.pi,self.np)
-        weights = 1 / self.np * np.ones((self.np))
-        states = np.stack([lat,lon,yaw,weights],axis=1)
-        self.particles = states
-
-    def motion_update(self,step, dx, dy, turn):
-        """ This method updates particles states """
-        arcllat, arcllon = self.area.get_arclength()
-        nparticles = self.particles.shape[0]
-        
+        lat = rng.uniform(area.workingbbox[0],area.workingbbox[2],self.np)
+        lon = rng.uniform(area.workingbbox[1],area.workingbbox[3],self.np) 
+        yaw = rng.uniform(0,2*np.pi,self.np)
+        return ParticleSet.from_arrays(lat, lon, yaw, capacity=self.max_particles)
+
+    def retrieve_poses(self, observation, k):
+        """ Returns the (lat, lon, yaw) of the k grid cells whose descriptors are closest to the observation, as a (k,3) array, and the likelihood of the observation at each of them """
+        H, W, T, D = self.map_samples.shape
+        observation = observation.cpu().numpy() if torch.is_tensor(observation) else observation
+        flat = self.map_samples.reshape(-1, D)
+        dtype = np.result_type(flat.dtype, np.float32)
+        observation = np.asarray(observation, dtype=dtype).reshape(-1)
+        similarity = flat @ observation / np.linalg.norm(flat.astype(dtype, copy=False), axis=1)
+        k = min(k, similarity.shape[0])
+        index = np.argpartition(similarity, similarity.shape[0]-k)[-k:]
+
+        # Distance between the scaled unit descriptors of the cells and the observation, scored as in update_weights
+        scale = self.opt.scale
+        distances = np.sqrt(np.maximum(scale**2 + observation @ observation - 2*scale*similarity[index], 0))
+        likelihood = (scale*2 - distances) / (scale*2)
+
+        y, x, t = np.unravel_index(index, (H, W, T))
+        lat = self.wf_max_lat - y * (self.wf_max_lat-self.wf_min_lat) / (H - 1)
+        lon = self.wf_min_lon + x * (self.wf_max_lon-self.wf_min_lon) / (W - 1)
+        yaw = t * 2*np.pi / T
+        return np.stack([lat,lon,yaw], axis=1), likelihood
+
+    def init_particles_retrieval(self, observation, rng=np.random):
+        """ Seed particles with gaussian noise around the poses retrieved for the first observation, drawn in proportion to their likelihood.
+
+            At least a fraction retrieval_uniform of the particles, and all of them beyond retrieval_seeded, are spread uniformly.
+        """
+        area = self.area
+        nseeded = min(self.np - int(round(self.opt.retrieval_uniform * self.np)), self.opt.retrieval_seeded)
+        nuniform = self.np - nseeded
+        poses, likelihood = self.retrieve_poses(observation, self.opt.retrieval_topk)
+
+        probs = np.maximum(likelihood, 0)
+        probs = probs / probs.sum() if probs.sum() > 0 else None
+        seeds = poses[rng.choice(poses.shape[0], nseeded, p=probs)]
+        dlat_m = rng.normal(0.0, self.opt.retrieval_spread[0], nseeded)
+        dlon_m = rng.normal(0.0, self.opt.retrieval_spread[0], nseeded)
+        (disp_lat, disp_lon) = area.m2deg((dlat_m, dlon_m))
+        lat = np.clip(seeds[:,0] + disp_lat, area.workingbbox[0], area.workingbbox[2])
+        lon = np.clip(seeds[:,1] + disp_lon, area.workingbbox[1], area.workingbbox[3])
+        yaw = (seeds[:,2] + rng.normal(0.0, self.opt.retrieval_spread[1], nseeded)) % (2*np.pi)
+
+        lat = np.concatenate([lat, rng.uniform(area.workingbbox[0],area.workingbbox[2],nuniform)])
+        lon = np.concatenate([lon, rng.uniform(area.workingbbox[1],area.workingbbox[3],nuniform)])
+        yaw = np.concatenate([yaw, rng.uniform(0,2*np.pi,nuniform)])
+        return ParticleSet.from_arrays(lat, lon, yaw, capacity=self.max_particles)
+
+    def concatenate_particles(self, particles):
+        """ Returns the particles of a list of sets as a single set """
+        return ParticleSet.concatenate(particles)
+
+    def states_array(self, particles):
+        """ Returns the (N,4) states of a particle set as a numpy array, used to save and draw them """
+        return np.asarray(particles)
+
+    def sample_motion_noise(self, nparticles, rng=np.random):
+        """ Returns a (N,3) array with the yaw, lat and lon (in meters) noise of each particle """
+        yaw_noise = rng.normal(0.0, 0.087, nparticles)                   
+        lat_noise_m = rng.normal(0.0, self.opt.particles_noise[0],nparticles)
+        lon_noise_m = rng.normal(0.0, self.opt.particles_noise[1],nparticles)
+        return np.stack([yaw_noise, lat_noise_m, lon_noise_m], axis=-1)
+
+    def motion_update(self, particles, dx, dy, turn, noise):
+        """ This method updates the states of a ParticleSet in place """
+        lat, lon, yaw = particles.lat, particles.lon, particles.yaw
+
         # Apply rotation
-        self.particles[:,2] += turn
-        
-        # Convert translation to world coordinates (rotate by estimated yaw)
-        dlon_m = dx*np.cos(-self.particles[:,2]) - dy*np.sin(-self.particles[:,2]) 
-        dlat_m = dx*np.sin(-self.particles[:,2]) + dy*np.cos(-self.particles[:,2]) 
+        yaw += turn
         
-        # Apply translation & add some noise
-        yaw_noise = np.random.normal(0.0, 0.087, nparticles)                   
-        lat_noise_m = np.random.normal(0.0, self.opt.particles_noise[0],nparticles)
-        lon_noise_m = np.random.normal(0.0, self.opt.particles_noise[1],nparticles)
-       
-        dlat_m = dlat_m + lat_noise_m
-        dlon_m = dlon_m + lon_noise_m
+        # Convert translation to world coordinates (rotate by estimated yaw) & add some noise
+        c = np.cos(-yaw)
+        s = np.sin(-yaw)
+        dlon_m = dx*c - dy*s + noise[:,2]
+        dlat_m = dx*s + dy*c + noise[:,1]
 
         (disp_lat, disp_lon) = self.area.m2deg((dlat_m, dlon_m))
         
-        self.particles[:,0] += disp_lat
-        self.particles[:,1] += disp_lon
-        self.particles[:,2] += yaw_noise
+        lat += disp_lat
+        lon += disp_lon
+        yaw += noise[:,0]
 
-        # 0 <= yaw <= 2*pi
-        self.particles[:,2] = np.where(self.particles[:,2] < 0.0, 
-                                       self.particles[:,2] + 2*np.pi, 
-                                       self.particles[:,2])
-        self.particles[:,2] %= 2*np.pi
+        # 0 <= yaw < 2*pi
+        np.remainder(yaw, 2*np.pi, out=yaw)
 
         # Kill particles outside bbox 
-        a = np.greater(self.particles[:,0], self.area.workingbbox[2])
-        c = np.greater(self.particles[:,1], self.area.workingbbox[3])
-        b = np.less(self.particles[:,0], self.area.workingbbox[0])
-        d = np.less(self.particles[:,1], self.area.workingbbox[1])
-        mask = (1-a) * (1-b) * (1-c) * (1-d) 
-        self.particles[:,3] *= mask
-
-    def update_weights(self, aerial_features):
-        """ Update particle's weigths"""
+        particles.mask(self.area.workingbbox)
 
-        # Interpolate descriptors
+    def get_grid_coordinates(self, particles):
+        """ Convert particles' (lat, lon, yaw) to continuous (y, x, t) indices of the descriptor grid, t is in units of 2*pi/T where T is the size of its third axis """
         H, W, T, _ = self.map_features.shape
-        x = (self.particles[:,1] - self.wf_min_lon) * (W - 1) / (self.wf_max_lon-self.wf_min_lon) 
-        y = (self.wf_max_lat - self.particles[:,0]) * (H - 1) / (self.wf_max_lat-self.wf_min_lat) 
-        t = self.particles[:,2] * T / (2*np.pi)
-
-        descriptors = trilinear_interpolation_numpy(self.map_features, y, x ,t)                # interpolated descriptors
-        particles_descriptors = self.opt.scale * descriptors
-
-        distances = pairwise_distances(particles_descriptors, aerial_features).squeeze()
-        probs = (self.opt.scale*2 - distances) / (self.opt.scale*2)
-
-        self.particles[:,-1] *= probs
-        sp = self.particles[:,-1].sum()
-        self.particles[:,-1] /= sp
+        x = (particles.lon - self.wf_min_lon) * ((W - 1) / (self.wf_max_lon-self.wf_min_lon))
+        y = (self.wf_max_lat - particles.lat) * ((H - 1) / (self.wf_max_lat-self.wf_min_lat))
+        t = particles.yaw * (T / (2*np.pi))
+        return y, x, t
+
+    def interpolate_descriptors(self, particles):
+        """ Interpolate the map descriptors at the particles' poses, particles is a ParticleSet """
+        y, x, t = self.get_grid_coordinates(particles)
+        if self.opt.fourier_harmonics > 0:
+            descriptors = fourier_interpolation_numpy(self.map_features, y, x, t)
+        else:
+            descriptors = trilinear_interpolation_numpy(self.map_features, y, x ,t)                # interpolated descriptors
+        return self.opt.scale * descriptors
+
+    def get_likelihood_mode(self, nparticles):
+        """ Returns the likelihood used for nparticles, resolving the auto mode by comparing them with the number of grid cells.
+
+            The auto mode trades accuracy for speed: the lookup table interpolates scores instead of descriptors.
+        """
+        if self.opt.likelihood != 'auto':
+            return self.opt.likelihood
+        # Scoring a cell in the lookup volume is a dense matrix-vector product, about 16 times cheaper
+        # than gathering and blending the eight corners of a particle (see benchmarks/likelihood_benchmark.py)
+        H, W, T, _ = self.map_features.shape
+        return 'lut' if 16*nparticles > H*W*T else 'fused'
+
+    def update_weights(self, particles, aerial_features, particles_descriptors=None):
+        """ Update particle's weigths in place """
+        mode = self.get_likelihood_mode(particles.shape[0])
+        profiler = self.profiler
+        if mode != 'pairwise' and particles_descriptors is None:
+            # The likelihoods time the gathering of grid corners as interpolation and the distances as weighting
+            with profiler.phase('interpolate'):
+                y, x, t = self.get_grid_coordinates(particles)
+            aerial_features = aerial_features.cpu().numpy() if torch.is_tensor(aerial_features) else aerial_features
+            if mode == 'hierarchical':
+                probs = self.likelihoods[mode](y, x, t, aerial_features, particles.weight, profiler)
+            else:
+                probs = self.likelihoods[mode](y, x, t, aerial_features, profiler)
+        else:
+            if particles_descriptors is None:
+                with profiler.phase('interpolate'):
+                    particles_descriptors = self.interpolate_descriptors(particles)
+            with profiler.phase('weight'):
+                distances = pairwise_distances(particles_descriptors, aerial_features).squeeze(1)
+                probs = (self.opt.scale*2 - distances) / (self.opt.scale*2)
+
+        weights = particles.weight
+        weights *= probs
+        particles.normalize()
         
-    def systematic_resample(self):
-        """ Get indices of particles to resample using systematic method """
+    def kld_particles(self, particles, indexes=None):
+        """ Number of particles required by KLD-sampling (Fox, 2003).
+
+            With probability 1 - kld_delta, the KL divergence between the particles and the true posterior is below
+            kld_epsilon when there are (k-1)/(2 epsilon) * (1 - 2/(9(k-1)) + sqrt(2/(9(k-1))) z)^3 particles, where k
+            is the number of (lat, lon, yaw) bins the particles, or the particles at indexes, occupy and z the 1 - delta
+            quantile of the normal distribution.
+        """
+        bbox = self.area.workingbbox
+        size_lat, size_lon = self.area.m2deg(self.opt.kld_bin_size[:2])
+        size_yaw = self.opt.kld_bin_size[2]
+        nlon = int((bbox[3] - bbox[1]) / size_lon) + 1
+        nyaw = int(2*np.pi / size_yaw) + 1
+        bin_lat = ((particles.lat - bbox[0]) / size_lat).astype(np.int64)
+        bin_lon = ((particles.lon - bbox[1]) / size_lon).astype(np.int64)
+        bin_yaw = (particles.yaw / size_yaw).astype(np.int64)
+        bins = (bin_lat * nlon + bin_lon) * nyaw + bin_yaw
+        k = np.unique(bins if indexes is None else bins[indexes]).shape[0]
+
+        if k > 1:
+            z = NormalDist().inv_cdf(1 - self.opt.kld_delta)
+            a = 2 / (9 * (k-1))
+            nparticles = int(np.ceil((k-1) / (2*self.opt.kld_epsilon) * (1 - a + np.sqrt(a) * z) ** 3))
+        else:
+            nparticles = self.opt.np_min
+        return min(max(nparticles, self.opt.np_min), self.np_max)
+
+    def resample(self, particles, rng=np.random):
+        """ Resample particles using the method selected in opt.resampling, returns the new particles.
+
+            The indexes of the resampled particles are computed first, then they are gathered once into the back buffer of the ParticleSet.
+        """
+        weights = particles.weight
+
+        if self.opt.particle_count == 'kld':
+            # Bins are counted on a sample of the posterior, which is then redrawn with the required size
+            indexes = self.resampler(weights, rng)
+            nparticles = self.kld_particles(particles, indexes)
+            if nparticles != indexes.shape[0]:
+                indexes = self.resampler(weights, rng, nparticles)
+                if self.opt.verbose:
+                    print("The number of particles is now ", nparticles)
+            particles.resample(indexes)
+            return particles
 
         # Remove 10 % of particles if needed
-        sorted_idx = np.argsort(self.particles[:,-1])[::-1]
-        nparticles = self.particles.shape[0]
+        nparticles = particles.shape[0]
         
         if nparticles > 5000:
-            nparticles = int(0.90*self.particles.shape[0])
+            nparticles = int(0.90*particles.shape[0])
             nparticles = max(nparticles, 5000)
             if self.opt.verbose:
                 print("The number of particles is now ", nparticles)        
         
-            sorted_idx = sorted_idx[0:nparticles] 
-            self.particles = self.particles[sorted_idx,:]
-            sp = self.particles[:,-1].sum()
-            self.particles[:,-1] /= sp
+            sorted_idx = np.argsort(weights)[::-1][0:nparticles]
+            weights = weights[sorted_idx]
+            weights /= weights.sum()
+            indexes = sorted_idx[self.resampler(weights, rng)]
+        else:
+            indexes = self.resampler(weights, rng)
         
         # resample
-        sample = np.random.rand(1)
-        arange = np.arange(0,self.particles.shape[0])
-        positions = (sample + arange) / self.particles.shape[0]
-        
-        indexes = np.zeros((self.particles.shape[0]))
-        cumulative_sum = np.cumsum(self.particles[:, -1], axis=0)
-        cumulative_sum[-1] = 1.0
-        i, j = 0, 0
-        while i < self.particles.shape[0]:
-            if positions[i] < cumulative_sum[j]:
-                indexes[i] = j
-                i += 1
-            else:
-                j += 1
-    
-        self.particles = self.particles[indexes.astype(np.int64),:]
-        self.particles[:, -1] = 1.0 / self.particles.shape[0]        
-
-    def get_estimate(self):
-        mean_lat = np.average(self.particles[:, 0], weights=self.particles[:, -1], axis=0)
-        mean_lon = np.average(self.particles[:, 1], weights=self.particles[:, -1], axis=0)
-        pc = np.cos(self.particles[:,2])
-        ps = np.sin(self.particles[:,2])
-        mc = np.average(pc,weights=self.particles[:,-1])
-        ms = np.average(ps,weights=self.particles[:,-1])
+        particles.resample(indexes)
+        return particles
+
+    def effective_particles(self, particles):
+        """ Number of effective particles, Neff = 1 / sum(w^2) """
+        weights = particles.weight
+        return float(1.0 / np.dot(weights, weights))
+
+    def needs_resampling(self, particles):
+        return self.effective_particles(particles) < self.opt.resampling_threshold*particles.shape[0]
+
+    def get_estimate(self, particles):
+        weights = particles.weight
+        mean_lat = np.average(particles.lat, weights=weights)
+        mean_lon = np.average(particles.lon, weights=weights)
+        mc = np.average(np.cos(particles.yaw), weights=weights)
+        ms = np.average(np.sin(particles.yaw), weights=weights)
         mean_yaw = np.arctan2(ms,mc)
-        weighted_mean = np.asarray([mean_lat,mean_lon, mean_yaw])
+        weighted_mean = np.asarray([mean_lat,mean_lon, mean_yaw], dtype=np.float64)
         return weighted_mean 
 
     def update_vo_estimate(self, vo_estimate, dx, dy, turn):                
@@ -222,10 +463,385 @@ class AerialPFLocalizer(BaseLocalizer):
         vo_estimate[0] += disp_lat  
         vo_estimate[1] += disp_lon
         return vo_estimate
-        
+
+    def get_scale(self, step):
+        if self.opt.no_scale:
+            return 1.0
+        delta_z = 0.25 * math.sin(2*math.pi*step/50)
+        return 2 ** delta_z
+
+    def odometry_source(self):
+        """ Returns a name of the motion estimator and the settings that change its odometry """
+        if self.opt.motion_estimator == 'homography':
+            return 'homography_{}_{}'.format(self.opt.orb_features, self.opt.homography_level)
+        return '{}_{}'.format(self.opt.motion_estimator, self.opt.phase_response)
+
+    def create_motion_estimator(self, first_frame):
+        """ Returns the visual odometry estimator of a sequence of aerial images """
+        if self.opt.motion_estimator == 'homography':
+            return Homography(first_frame, verbose=self.opt.verbose, nfeatures=self.opt.orb_features, level=self.opt.homography_level)
+        elif self.opt.motion_estimator == 'phase':
+            return PhaseCorrelation(first_frame, verbose=self.opt.verbose, min_response=self.opt.phase_response)
+        else:
+            raise NotImplementedError("Motion estimator {} not implemented".format(self.opt.motion_estimator))
+
+    def get_odometry(self, motion_estimator, aerial):
+        delta_yaw, translation, _ = motion_estimator.estimate(aerial)    # Displacement in pixels (x,y) -> (lon, lat)                
+        dx = translation[0] * 0.37
+        dy = translation[1] * 0.37
+        turn = -delta_yaw 
+        return dx, dy, turn
+
+    def allocate_results(self, ntrials, steps):
+        """ Arrays filled by the localization of each trial and saved in the localisation-*.npz file """
+        return {
+            'estimates' : np.zeros((ntrials,steps,3)),              # lat, lon, yaw
+            'vo' : np.zeros((ntrials,steps,6)),                     # lat, lon, yaw, dx, dy, dturn
+            'nparticles' : np.zeros((ntrials,steps), dtype=int),   # Number of particles after each step
+            'times' : np.zeros((ntrials,steps))                     # Duration of each step in seconds
+        }
+
+    def filter_step(self, particles, dx, dy, turn, aerial_features, rng=np.random):
+        """ Move particles with the odometry, weight them with the aerial descriptor and resample them if needed, returns the particles """
+        profiler = self.profiler
+        with profiler.phase('motion'):
+            noise = self.sample_motion_noise(particles.shape[0], rng)
+            self.motion_update(particles, dx, dy, turn, noise)
+        self.update_weights(particles, aerial_features)
+        if profiler.enabled:
+            profiler.note(neff=self.effective_particles(particles))
+        with profiler.phase('resample'):
+            if self.needs_resampling(particles):
+                particles = self.resample(particles, rng)
+        return particles
+
+    def get_scales(self, steps):
+        """ Scale of the sensed image at each step """
+        return np.array([1.0] + [self.get_scale(step) for step in range(1,steps)])
+
+    def route_observations(self, trial, steps):
+        """ Moves a robot along a route and yields the robot, the odometry (dx, dy, turn) and the aerial descriptor at each step.
+
+            The odometry of step 0 is zero and its descriptor is None unless it is needed to initialize particles or
+            to fill the observation cache. With an observation cache, a route observed in a previous run is replayed
+            without rendering tiles or running the network, otherwise its observations are stored at the last step.
+        """
+        routes = self.routes
+        robot = Robot('myaircraft', self.area, self.tile_cache)
+        scales = self.get_scales(steps)
+        cache = self.observation_cache
+        cached = cache.load(trial, scales) if cache is not None else None
+
+        if cached is not None:
+            descriptors, odometry = cached
+            for step in range(steps):
+                robot.move_to(*routes[trial,step])
+                yield copy.copy(robot), odometry[step], descriptors[step:step+1]
+            return
+
+        profiler = self.profiler
+        odometry = np.zeros((steps,3))
+        robot.move_to(*routes[trial,0])
+        robot.prefetch(routes[trial,1:min(steps,1+self.opt.prefetch)])
+        with profiler.phase('sense', trial, 0):
+            aerial = robot.sense(scale=1.0, domains=['aerial'])[0]
+        with profiler.phase('odometry', trial, 0):
+            motion_estimator = self.create_motion_estimator(aerial)
+        descriptor = None
+        if cache is not None or self.opt.particles_init == 'retrieval':
+            with profiler.phase('embed', trial, 0):
+                descriptor = self.observation_model(aerial,self.opt.pano_size)
+
+        for step in range(steps):
+            if step > 0:
+                robot.move_to(*routes[trial,step])
+                robot.prefetch(routes[trial,step+1:min(steps,step+1+self.opt.prefetch)])
+                with profiler.phase('odometry', trial, step):
+                    odometry[step] = self.get_odometry(motion_estimator, aerial)
+                with profiler.phase('sense', trial, step):
+                    aerial = robot.sense(scale=scales[step], domains=['aerial'])[0]
+                with profiler.phase('embed', trial, step):
+                    descriptor = self.observation_model(aerial,self.opt.pano_size)
+
+            if cache is not None:
+                if step == 0:
+                    descriptors = np.zeros((steps,descriptor.shape[1]), dtype=np.float32)
+                descriptors[step] = descriptor.cpu().numpy()[0]
+                if step == steps - 1:
+                    cache.save(trial, scales, descriptors, odometry)
+            yield copy.copy(robot), odometry[step], descriptor
+
+    def batch_observations(self, trials, steps):
+        """ Batched counterpart of route_observations, yields the robots, the (trials,3) odometry and the (trials,D) descriptors at each step.
+
+            Aerial images of all trials are embedded in a single forward pass. Routes are replayed from the observation
+            cache only if every trial is cached, a stale cache file makes its trial be observed again on its own.
+        """
+        routes = self.routes
+        scales = self.get_scales(steps)
+        cache = self.observation_cache
+
+        if cache is not None and all(cache.exists(trial) for trial in trials):
+            sources = [self.route_observations(trial, steps) for trial in trials]
+            for observations in zip(*sources):
+                robots, odometry, descriptors = zip(*observations)
+                yield list(robots), np.stack(odometry), np.concatenate(descriptors)
+            return
+
+        profiler = self.profiler
+        robots, motion_estimators, aerials = [], [], []
+        for trial in trials:
+            robot = Robot('myaircraft', self.area, self.tile_cache)
+            robot.move_to(*routes[trial,0])
+            robot.prefetch(routes[trial,1:min(steps,1+self.opt.prefetch)])
+            with profiler.phase('sense', trial, 0):
+                aerial = robot.sense(scale=1.0, domains=['aerial'])[0]
+            robots.append(robot)
+            aerials.append(aerial)
+            with profiler.phase('odometry', trial, 0):
+                motion_estimators.append(self.create_motion_estimator(aerial))
+
+        odometry = np.zeros((len(trials),steps,3))                     # dx, dy, turn
+        for step in range(steps):
+            if step > 0:
+                for k, trial in enumerate(trials):
+                    robots[k].move_to(*routes[trial,step])
+                    robots[k].prefetch(routes[trial,step+1:min(steps,step+1+self.opt.prefetch)])
+                    with profiler.phase('odometry', trial, step):
+                        odometry[k,step] = self.get_odometry(motion_estimators[k], aerials[k])
+                    with profiler.phase('sense', trial, step):
+                        aerials[k] = robots[k].sense(scale=scales[step], domains=['aerial'])[0]
+
+            descriptors = None
+            if step > 0 or cache is not None or self.opt.particles_init == 'retrieval':
+                start_time = time.perf_counter()
+                descriptors = self.observation_model(aerials,self.opt.pano_size).cpu().numpy()
+                t_embed = (time.perf_counter() - start_time) / len(trials)
+                for trial in trials:                                    # The batch time is shared by the trials
+                    profiler.add('embed', t_embed, trial, step)
+
+            if cache is not None:
+                if step == 0:
+                    cached = np.zeros((len(trials),steps,descriptors.shape[1]), dtype=np.float32)
+                cached[:,step] = descriptors
+                if step == steps - 1:
+                    for k, trial in enumerate(trials):
+                        cache.save(trial, scales, cached[k], odometry[k])
+            yield [copy.copy(robot) for robot in robots], odometry[:,step], descriptors
+
+    def localize_trial(self, trial, steps, results, writer=None, area_map=None):
+        """ Run the particle filter over a single route, particles and results are streamed to writer if given """
+        routes = self.routes
+        estimates, vo = results['estimates'], results['vo']
+        trial_start_time = time.time()
+        rng = self.get_trial_rng(trial)
+        profiler = self.profiler
+        profiler.begin(trial, 0)
+
+        observations = self.route_observations(trial, steps)
+        if self.opt.pipeline:
+            observations = Prefetcher(observations)
+        robot, _, observation = next(observations)
+        vo_estimate = np.array(routes[trial,0])
+        with profiler.phase('init'):
+            self.particles = self.init_particles(rng, observation)
+        with profiler.phase('estimate'):
+            estimate = self.get_estimate(self.particles)
+
+        vo[trial,0,0:3] = vo_estimate            
+        estimates[trial,0,:] = estimate 
+        results['nparticles'][trial,0] = self.particles.shape[0]
+        profiler.end(trial, 0, nparticles=self.particles.shape[0], mle=1000 * haversine(estimate[0], estimate[1], robot.lat, robot.lon))
+
+        if writer is not None:
+            writer.append(trial, self.states_array(self.particles))
+
+        if area_map is not None: 
+            visualize(trial, 0, self.area, area_map, robot, 
+                      self.states_array(self.particles), estimate, vo_estimate, zoom=18)
+
+
+        for step in range(1,steps):                                     # MCL           
+            step_start_time = time.time()
+            profiler.begin(trial, step)
+            
+            # Move the robot, estimate movement and sense
+            robot, (dx, dy, turn), aerial_features = next(observations)
+            
+            self.update_vo_estimate(vo_estimate, dx, dy, turn)
+
+            # Estimate location
+            self.particles = self.filter_step(self.particles, dx, dy, turn, aerial_features, rng)
+            with profiler.phase('estimate'):
+                estimate = self.get_estimate(self.particles)
+            MLE = 1000 * haversine(estimate[0], estimate[1], robot.lat, robot.lon)
+            t_step = time.time() - step_start_time
+            profiler.add('total', t_step)
+            profiler.end(trial, step, nparticles=self.particles.shape[0], mle=MLE)
+            if self.opt.verbose:
+                print('Trial: {} Step: {} MLE {} Particles: {} Time: {} s'.format(trial, step, MLE, self.particles.shape[0], t_step))
+            
+            # Save data
+            estimates[trial,step,:] = estimate
+            results['nparticles'][trial,step] = self.particles.shape[0]
+            results['times'][trial,step] = t_step
+            vo[trial,step,:] = np.concatenate([vo_estimate,np.array([dx,dy,turn])],0)
+            
+            if writer is not None:
+                writer.append(trial, self.states_array(self.particles))
+            
+            if area_map is not None: 
+                states = self.states_array(self.particles)
+                best_particle = states[np.argmax(states[:,-1]),:2]
+                visualize(trial, step, self.area, area_map, robot, 
+                          states, estimate, vo_estimate, best_particle, zoom=18)
+    
+        if writer is not None:
+            writer.finish(trial, results)
+        profiler.flush()
+
+        t_comp = time.time() - trial_start_time
+        print("Trial {} with {} steps finished in {} s".format(trial,steps,t_comp))
+        if self.opt.pipeline:
+            observations.close()
+            print("Pipelining overlapped {} ms per step of sensing with the filter".format(1000 * observations.hidden() / steps))
+
+    def localize_batch(self, trials, steps, results, writer=None):
+        """ Run the particle filter over several routes in lockstep.
+
+            Each trial keeps its own particles. Observations of all trials are embedded in a single forward pass.
+            Each trial uses its own random generator, so the results are the same as running the trials
+            one by one. The time saved for each trial is the duration of the whole lockstep step.
+        """
+        routes = self.routes
+        estimates, vo = results['estimates'], results['vo']
+        batch_start_time = time.time()
+        Nt = len(trials)
+        rngs = [self.get_trial_rng(trial) for trial in trials]
+        profiler = self.profiler
+
+        particles = [None] * Nt
+
+        observations = self.batch_observations(trials, steps)
+        if self.opt.pipeline:
+            observations = Prefetcher(observations)
+        robots, _, descriptors = next(observations)
+        vo_estimates = [np.array(routes[trial,0]) for trial in trials]
+        for k, trial in enumerate(trials):
+            profiler.begin(trial, 0)
+            with profiler.phase('init'):
+                particles[k] = self.init_particles(rngs[k], descriptors[k] if descriptors is not None else None)
+
+            vo[trial,0,0:3] = vo_estimates[k]
+            with profiler.phase('estimate'):
+                estimate = self.get_estimate(particles[k])
+            estimates[trial,0,:] = estimate
+            results['nparticles'][trial,0] = self.np
+            profiler.end(trial, 0, nparticles=self.np, mle=1000 * haversine(estimate[0], estimate[1], robots[k].lat, robots[k].lon))
+
+        if writer is not None:
+            for k, trial in enumerate(trials):
+                writer.append(trial, self.states_array(particles[k]))
+
+        for step in range(1,steps):
+            step_start_time = time.time()
+
+            # Move the robots, estimate movement and sense
+            robots, odometry, aerial_features = next(observations)
+            for k, trial in enumerate(trials):
+                self.update_vo_estimate(vo_estimates[k], *odometry[k])
+                with profiler.phase('motion', trial, step):
+                    noise = self.sample_motion_noise(particles[k].shape[0], rngs[k])
+                    self.motion_update(particles[k], *odometry[k], noise)
+
+            # Estimate location
+
+            # With the pairwise likelihood all particles are interpolated in one call, the fused likelihood works per trial
+            if self.opt.likelihood == 'pairwise':
+                start_time = time.perf_counter()
+                descriptors = self.interpolate_descriptors(self.concatenate_particles(particles))
+                offsets = np.concatenate([[0], np.cumsum([p.shape[0] for p in particles])])
+                t_interpolate = (time.perf_counter() - start_time) / Nt
+
+            # Stages timed without an explicit step from here on, including those of update_weights, use the current one
+            for k, trial in enumerate(trials):
+                profiler.begin(trial, step)
+                if self.opt.likelihood == 'pairwise':
+                    profiler.add('interpolate', t_interpolate)
+                trial_descriptors = descriptors[offsets[k]:offsets[k+1]] if self.opt.likelihood == 'pairwise' else None
+                self.update_weights(particles[k], aerial_features[k:k+1], trial_descriptors)
+                if profiler.enabled:
+                    profiler.note(neff=self.effective_particles(particles[k]))
+                with profiler.phase('resample'):
+                    if self.needs_resampling(particles[k]):
+                        particles[k] = self.resample(particles[k], rngs[k])
+
+                with profiler.phase('estimate'):
+                    estimate = self.get_estimate(particles[k])
+                estimates[trial,step,:] = estimate
+                vo[trial,step,:] = np.concatenate([vo_estimates[k],odometry[k]],0)
+                results['nparticles'][trial,step] = particles[k].shape[0]
+
+                if self.opt.verbose or profiler.enabled:
+                    MLE = 1000 * haversine(estimate[0], estimate[1], robots[k].lat, robots[k].lon)
+                    profiler.note(nparticles=particles[k].shape[0], mle=MLE)
+                if self.opt.verbose:
+                    print('Trial: {} Step: {} MLE {}'.format(trial, step, MLE))
+
+            if writer is not None:
+                for k, trial in enumerate(trials):
+                    writer.append(trial, self.states_array(particles[k]))
+
+            t_step = time.time() - step_start_time
+            results['times'][trials,step] = t_step
+            for trial in trials:
+                profiler.add('total', t_step / Nt, trial, step)
+                profiler.end(trial, step)
+            if self.opt.verbose:
+                print('Step: {} Particles: {} Time: {} s'.format(step, sum(p.shape[0] for p in particles), t_step))
+
+        if writer is not None:
+            for trial in trials:
+                writer.finish(trial, results)
+        profiler.flush()
+
+        t_comp = time.time() - batch_start_time
+        print("{} trials with {} steps finished in {} s".format(Nt,steps,t_comp))
+        if self.opt.pipeline:
+            observations.close()
+            print("Pipelining overlapped {} ms per step of sensing with the filter".format(1000 * observations.hidden() / steps))
+
+    def share_map_features(self):
+        """ Move the descriptor grid to shared memory, so that forked workers do not copy it """
+        shm = shared_memory.SharedMemory(create=True, size=self.map_features.nbytes)
+        map_features = np.ndarray(self.map_features.shape, dtype=self.map_features.dtype, buffer=shm.buf)
+        map_features[...] = self.map_features
+        self.set_map_features(map_features)
+        return shm
+
+    def localize_parallel(self, trials, steps, results, writer=None):
+        """ Split trials in contiguous shards and run them in a pool of worker processes.
+
+            Each trial is seeded with its own index, therefore results are the same as in the sequential run.
+        """
+        workers = min(self.opt.workers, len(trials))
+        shards = [shard.tolist() for shard in np.array_split(trials, workers)]
+        threads = max(1, torch.get_num_threads() // workers)
+        shm = self.share_map_features()
+
+        try:
+            ctx = mp.get_context('fork')
+            with ctx.Pool(workers, initializer=_init_worker, initargs=(self, threads)) as pool:
+                for shard_trials, shard_results in pool.imap(_localize_shard, [(shard, steps, writer) for shard in shards]):
+                    for key, value in shard_results.items():
+                        results[key][shard_trials] = value
+        finally:
+            self.set_map_features(np.array(self.map_features))
+            shm.close()
+            shm.unlink()
 
     def localize(self):   
-        """ Perform PF algorithm """
+        """ Perform PF algorithm, returns the dict of results arrays """
         routes = self.routes
         print("Particle filter experiment in {}".format(self.area.name))
         
@@ -234,99 +850,32 @@ class AerialPFLocalizer(BaseLocalizer):
         trials = self.opt.trials if self.opt.trials is not None else range(0,ntrials)
         steps = self.opt.steps if self.opt.steps is not None else nsteps 
 
-        Nt = len(trials)
-
-        estimates = np.zeros((ntrials,steps,3))       # lat, lon, yaw
-        vo = np.zeros((ntrials,steps,6))              # lat, lon, yaw, dx, dy, dturn
-        
-        if self.opt.states:
-            states = np.zeros((Nt,steps,self.np,4))    # lat, lon, yaw, weight
-
-        if self.opt.visualize:
-            area_map = self.area.get_map(style='OSM')
-
-        for lidx, trial in enumerate(trials):
-            trial_start_time = time.time()
-
-            robot = Robot('myaircraft', self.area)
-            lat, lon, yaw = routes[trial,0]
-            robot.move_to(lat, lon, yaw)
-            vo_estimate = np.array([lat, lon, yaw])
-            aerial, _ = robot.sense(scale=1.0)
-            motion_estimator = Mestimator(aerial,verbose=self.opt.verbose)
-            self.init_particles()
-            estimate = self.get_estimate()
-
-            vo[trial,0,0:3] = vo_estimate            
-            estimates[trial,0,:] = estimate 
-
-            if self.opt.states:
-                states[lidx,0,:,:] = self.particles
-
-            if self.opt.visualize: 
-                visualize(trial, 0, self.area, area_map, robot, 
-                          self.particles, estimate, vo_estimate, zoom=18)
-
-
-            for step in range(1,steps):                                     # MCL           
-                step_start_time = time.time()
-                
-                # Move the robot and estimate movement
-                lat, lon, yaw = routes[trial,step]
-                robot.move_to(lat, lon, yaw)
-                
-                delta_yaw, translation, _ = motion_estimator.estimate(aerial)    # Displacement in pixels (x,y) -> (lon, lat)                
-                dx = translation[0] * 0.37
-                dy = translation[1] * 0.37
-                turn = -delta_yaw 
-                
-                self.update_vo_estimate(vo_estimate, dx, dy, turn)
-                self.motion_update(step,dx,dy,turn)
-
-                # Sense and estimate location
-                
-                if self.opt.no_scale:
-                    scale = 1.0
-                else:
-                    delta_z = 0.25 * math.sin(2*math.pi*step/50)
-                    scale = 2 ** delta_z
-                
-                aerial, _ = robot.sense(scale=scale)
-                aerial_features = self.observation_model(aerial,self.opt.pano_size)
-                self.update_weights(aerial_features)
-                neff = 1.0 / np.sum(np.power(self.particles[:,-1], 2))      # Number of effective particles
-                if  neff < 2*self.particles.shape[0] / 3:                   # resample                          
-                    self.systematic_resample()                              # Get indices of particles to resample
-                estimate = self.get_estimate()
-                MLE = 1000 * haversine(estimate[0], estimate[1], robot.lat, robot.lon)
-                best_particle_index = np.argmax(self.particles[:,-1])
-                best_particle = self.particles[best_particle_index,:2]
-                t_step = time.time() - step_start_time
-                if self.opt.verbose:
-                    print('Trial: {} Step: {} MLE {} Time: {} s'.format(trial, step, MLE, t_step))
-                
-                # Save data
-                estimates[trial,step,:] = estimate
-                vo[trial,step,:] = np.concatenate([vo_estimate,np.array([dx,dy,turn])],0)
-                
-                if self.opt.states:
-                    states[lidx,step,0:self.particles.shape[0],:] = self.particles
-                
-                if self.opt.visualize: 
-                    visualize(trial, step, self.area, area_map, robot, 
-                              self.particles, estimate, vo_estimate, best_particle, zoom=18)
-        
-            t_comp = time.time() - trial_start_time
-            print("Trial {} with {} steps finished in {} s".format(trial,steps,t_comp))
+        results = self.allocate_results(ntrials, steps)
+        area_map = self.area.get_map(style='OSM') if self.opt.visualize else None
+
+        # Results of each trial, and particles if requested, are written to a directory as soon as the trial finishes
+        filename = 'localisation-{}-{}-{}'.format(self.opt.expname, self.area.name, self.opt.seed)
+        path = os.path.join(self.opt.results_dir, self.opt.name, filename)
+        writer = StatesWriter(path, self.opt.states, self.opt.states_mode, self.opt.states_size) if not self.opt.nosave else None
+        if self.opt.profile:
+            filename = 'profile-{}-{}-{}.jsonl'.format(self.opt.expname, self.area.name, self.opt.seed)
+            self.profiler = StepProfiler(os.path.join(self.opt.results_dir, self.opt.name, filename))
+            self.profiler.reset()
+
+        if self.opt.workers > 1:
+            assert area_map is None, "Visualization is not supported with several workers"
+            self.localize_parallel(list(trials), steps, results, writer)
+        elif self.opt.batched:
+            assert area_map is None, "Visualization is not supported in batched mode"
+            self.localize_batch(list(trials), steps, results, writer)
+        else:
+            for trial in trials:
+                self.localize_trial(trial, steps, results, writer, area_map)
 
         #now = datetime.datetime.now()
         #current_time = now.strftime("%H:%M:%S")
         #today = datetime.date.today()
         
         if not self.opt.nosave:
-            filename = 'localisation-{}-{}-{}.npz'.format(self.opt.expname, self.area.name, self.opt.seed)
-            path = os.path.join(self.opt.results_dir, self.opt.name, filename)
-            if self.opt.states:
-                np.savez(path,estimates=estimates, vo=vo, states=states)
-            else:
-                np.savez(path,estimates=estimates,vo=vo)
\ No newline at end of file
+            np.savez(path + '.npz', **results)
+        return results
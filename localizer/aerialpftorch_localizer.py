@@ -0,0 +1,166 @@
+import numpy as np
+import torch
+
+from localizer.aerialpf_localizer import AerialPFLocalizer
+from aerial.interpolate import trilinear_interpolation_torch
+from aerial.resample import get_resampler
+
+
+class AerialPFTorchLocalizer(AerialPFLocalizer):
+    """ Particle filter where particles, descriptors, noise, weights and resampling are torch tensors.
+
+        It is selected with --pf_backend torch. Tensors live on the first GPU of --gpu_ids, or on the CPU without it.
+        Particle states are float64 and the descriptor grid keeps its --descriptor_dtype. On the CPU the numpy backend
+        is faster (see benchmarks/pf_backend_benchmark.py), this backend is meant to keep large particle sets on a GPU.
+    """
+
+    # Options implemented by this backend, other values are rejected when the localizer is created
+    SUPPORTED_OPTIONS = {
+        'likelihood': ['fused', 'pairwise'],
+        'particle_count': ['prune'],
+        'particles_init': ['uniform', 'retrieval'],
+        'fourier_harmonics': [0],
+    }
+
+    def __init__(self, opt):
+        self.check_options(opt)
+        AerialPFLocalizer.__init__(self, opt)
+        self.pf_device = torch.device('cuda:{}'.format(opt.gpu_ids[0])) if opt.gpu_ids else torch.device('cpu')
+        self.particles = torch.zeros((opt.np,4), dtype=torch.float64, device=self.pf_device)
+        self.resampler = get_resampler(opt.resampling, backend='torch')
+        self.noise_std = torch.tensor([0.087, opt.particles_noise[0], opt.particles_noise[1]], dtype=torch.float64, device=self.pf_device)
+
+    @classmethod
+    def check_options(cls, opt):
+        """ Raise NotImplementedError if an option has a value the torch backend does not implement """
+        for name, values in cls.SUPPORTED_OPTIONS.items():
+            if getattr(opt, name) not in values:
+                raise NotImplementedError("--{} {} not implemented in the torch backend, choose one of {}".format(name, getattr(opt, name), values))
+        # Workers are forked processes, CUDA can not be used in a child forked after it was initialised
+        if opt.gpu_ids and opt.workers > 1:
+            raise NotImplementedError("--workers {} not implemented in the torch backend on a GPU, use --workers 1".format(opt.workers))
+
+    def set_map_features(self, map_features):
+        """ The grid keeps its dtype, float16 and int8 corners are promoted to float32 when they are interpolated """
+        self.map_features = map_features
+        self.map_samples = map_features
+        self.map_tensor = torch.from_numpy(np.ascontiguousarray(map_features)).to(self.pf_device)
+        self.dtype = torch.float64 if map_features.dtype == np.float64 else torch.float32
+
+    def get_trial_rng(self, trial):
+        generator = torch.Generator(device=self.pf_device)
+        if self.opt.seed >= 0:
+            generator.manual_seed(self.opt.seed + trial)
+        else:
+            generator.seed()
+        return generator
+
+    def init_particles(self, rng=None, observation=None):
+        if self.opt.particles_init == 'retrieval' and observation is not None:
+            # Particles are seeded by the numpy backend with a generator seeded from the trial generator
+            seed = int(torch.randint(2**31 - 1, (1,), generator=rng, device=self.pf_device))
+            particles = self.init_particles_retrieval(observation, np.random.RandomState(seed))
+            return torch.from_numpy(np.array(particles)).to(self.pf_device)
+
+        bbox = self.area.workingbbox
+        uniform = torch.rand((self.np,3), generator=rng, dtype=torch.float64, device=self.pf_device)
+        lat = bbox[0] + uniform[:,0] * (bbox[2] - bbox[0])
+        lon = bbox[1] + uniform[:,1] * (bbox[3] - bbox[1])
+        yaw = uniform[:,2] * 2*np.pi
+        weights = torch.full((self.np,), 1 / self.np, dtype=torch.float64, device=self.pf_device)
+        return torch.stack([lat,lon,yaw,weights], dim=1)
+
+    def concatenate_particles(self, particles):
+        return torch.cat(particles, 0)
+
+    def sample_motion_noise(self, nparticles, rng=None):
+        return torch.randn((int(nparticles),3), generator=rng, dtype=torch.float64, device=self.pf_device) * self.noise_std
+
+    def motion_update(self, particles, dx, dy, turn, noise):
+        dx = torch.as_tensor(dx, dtype=torch.float64)
+        dy = torch.as_tensor(dy, dtype=torch.float64)
+        turn = torch.as_tensor(turn, dtype=torch.float64)
+
+        # Apply rotation
+        particles[...,2] += turn
+
+        # Convert translation to world coordinates (rotate by estimated yaw)
+        c = torch.cos(-particles[...,2])
+        s = torch.sin(-particles[...,2])
+        dlon_m = dx*c - dy*s + noise[...,2]
+        dlat_m = dx*s + dy*c + noise[...,1]
+        (disp_lat, disp_lon) = self.area.m2deg((dlat_m, dlon_m))
+
+        particles[...,0] += disp_lat
+        particles[...,1] += disp_lon
+        particles[...,2] += noise[...,0]
+
+        # 0 <= yaw <= 2*pi
+        particles[...,2] %= 2*np.pi
+
+        # Kill particles outside bbox
+        bbox = self.area.workingbbox
+        inside = (particles[...,0] >= bbox[0]) & (particles[...,0] <= bbox[2]) & (particles[...,1] >= bbox[1]) & (particles[...,1] <= bbox[3])
+        particles[...,3] *= inside
+
+    def get_grid_coordinates(self, particles):
+        H, W, T, _ = self.map_features.shape
+        x = (particles[:,1] - self.wf_min_lon) * (W - 1) / (self.wf_max_lon-self.wf_min_lon)
+        y = (self.wf_max_lat - particles[:,0]) * (H - 1) / (self.wf_max_lat-self.wf_min_lat)
+        t = particles[:,2] * T / (2*np.pi)
+        return y, x, t
+
+    def interpolate_descriptors(self, particles):
+        y, x, t = self.get_grid_coordinates(particles)
+        descriptors = trilinear_interpolation_torch(self.map_tensor, y.to(self.dtype), x.to(self.dtype), t.to(self.dtype))
+        return self.opt.scale * descriptors
+
+    def update_weights(self, particles, aerial_features, particles_descriptors=None):
+        if particles_descriptors is None:
+            with self.profiler.phase('interpolate'):
+                particles_descriptors = self.interpolate_descriptors(particles)
+
+        with self.profiler.phase('weight'):
+            aerial_features = torch.as_tensor(aerial_features).to(self.pf_device, particles_descriptors.dtype)
+            distances = torch.norm(particles_descriptors - aerial_features, dim=1).double()
+            probs = (self.opt.scale*2 - distances) / (self.opt.scale*2)
+
+        particles[:,-1] *= probs
+        particles[:,-1] /= particles[:,-1].sum()
+
+    def resample(self, particles, rng=None):
+        nparticles = particles.shape[0]
+
+        # Remove 10 % of particles if needed
+        if nparticles > 5000:
+            nparticles = max(int(0.90*nparticles), 5000)
+            if self.opt.verbose:
+                print("The number of particles is now ", nparticles)
+
+            sorted_idx = torch.argsort(particles[:,-1], descending=True)[0:nparticles]
+            particles = particles[sorted_idx,:]
+            particles[:,-1] /= particles[:,-1].sum()
+
+        # resample
+        indexes = self.resampler(particles[:,-1], rng)
+        particles = particles[indexes,:]
+        particles[:,-1] = 1.0 / particles.shape[0]
+        return particles
+
+    def effective_particles(self, particles):
+        return float(1.0 / torch.sum(particles[:,-1] ** 2))
+
+    def needs_resampling(self, particles):
+        return self.effective_particles(particles) < self.opt.resampling_threshold*particles.shape[0]
+
+    def get_estimate(self, particles):
+        weights = particles[:,-1] / particles[:,-1].sum()
+        mean_lat = torch.dot(particles[:,0], weights)
+        mean_lon = torch.dot(particles[:,1], weights)
+        mc = torch.dot(torch.cos(particles[:,2]), weights)
+        ms = torch.dot(torch.sin(particles[:,2]), weights)
+        mean_yaw = torch.atan2(ms,mc)
+        return torch.stack([mean_lat, mean_lon, mean_yaw]).cpu().numpy()
+
+    def states_array(self, particles):
+        return particles.cpu().numpy()
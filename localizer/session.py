@@ -0,0 +1,92 @@
+import time
+import numpy as np
+
+from localizer import create_localizer
+
+
+class LocalizationSession():
+    """ Online localization of a stream of aerial images with the aerial particle filter.
+
+        The localizer, its descriptor grid and the model are set up once when the session is created, then step()
+        is called with every new frame and returns the pose estimate. The latency of each step in seconds is appended
+        to latencies, and last_latency holds the time spent in each phase of the last step. A session does not
+        need the testing routes of the area.
+
+        Example:
+            session = LocalizationSession(opt, model)
+            for image, odometry in frames:
+                lat, lon, yaw = session.step(image, odometry)
+    """
+
+    def __init__(self, opt, model, warmup=True):
+        """
+            Parameters:
+                opt    -> Localizer options, as parsed by LocalizeOptions
+                model  -> A loaded model, see models.create_model
+                warmup -> If True, the network runs once on a blank image so the first step does not pay its initialization
+        """
+        self.localizer = create_localizer(opt)
+        self.localizer.set_model(model)
+        self.localizer.setup(routes=False)
+        self.opt = opt
+        if warmup:
+            self.localizer.observation_model(np.zeros((opt.pano_size,opt.pano_size,3), dtype=np.uint8), opt.pano_size)
+        self.reset()
+
+    def reset(self, trial=0):
+        """ Forget the current particles, the next step initializes them again.
+
+            Random numbers are drawn from the generator of the given trial, so replaying a testing route with its
+            odometry gives the same estimates as localize.
+        """
+        self.rng = self.localizer.get_trial_rng(trial)
+        self.particles = None
+        self.motion_estimator = None
+        self.estimate = None
+        self.latencies = []
+        self.last_latency = {}
+
+    def step(self, image, odometry=None):
+        """ Localize a new aerial image and returns the (lat, lon, yaw) estimate.
+
+            Parameters:
+                image    -> A BGR aerial image, like the ones returned by Robot.sense
+                odometry -> The (dx, dy, turn) displacement since the previous frame in meters and radians. If it is
+                            None it is estimated between the previous and the new image
+
+            Estimated odometry differs from localize, where the motion applied at step k is estimated between the
+            images of steps k-2 and k-1, so it lags one frame behind the route. To replay a testing route with the
+            estimates of localize, pass the odometry it recorded in results['vo'][trial,:,3:].
+        """
+        localizer = self.localizer
+        start_time = time.perf_counter()
+        latency = {}
+
+        if odometry is None:
+            if self.motion_estimator is None:
+                self.motion_estimator = localizer.create_motion_estimator(image)
+                odometry = (0.0, 0.0, 0.0)
+            else:
+                odometry = localizer.get_odometry(self.motion_estimator, image)
+            latency['odometry'] = time.perf_counter() - start_time
+
+        if self.particles is None:
+            phase_time = time.perf_counter()
+            observation = localizer.observation_model(image, self.opt.pano_size) if self.opt.particles_init == 'retrieval' else None
+            self.particles = localizer.init_particles(self.rng, observation)
+            latency['init'] = time.perf_counter() - phase_time
+        else:
+            phase_time = time.perf_counter()
+            aerial_features = localizer.observation_model(image, self.opt.pano_size)
+            latency['observation'] = time.perf_counter() - phase_time
+
+            phase_time = time.perf_counter()
+            dx, dy, turn = odometry
+            self.particles = localizer.filter_step(self.particles, dx, dy, turn, aerial_features, self.rng)
+            latency['filter'] = time.perf_counter() - phase_time
+
+        self.estimate = localizer.get_estimate(self.particles)
+        latency['total'] = time.perf_counter() - start_time
+        self.last_latency = latency
+        self.latencies.append(latency['total'])
+        return self.estimate
@@ -0,0 +1,145 @@
+"""This module predicts the descriptor grid of an area densely.
+
+    For each orientation the mosaic of the area (see aerial.tile.TileMosaic) is rotated once and the first layers of
+    the backbone run fully-convolutionally over it, in windows. The feature block of every cell is sampled from the
+    shared feature map and goes through the remaining layers and the embedding network, instead of running the whole
+    backbone on a rotated crop per cell.
+"""
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from aerial.tile import TileMosaic
+
+
+def split_backbone(net, layer):
+    """ Returns the layers of a ResNet backbone up to layer, included, and the remaining ones as two nn.Sequential """
+    net = net.module if isinstance(net, nn.DataParallel) else net
+    children = list(net.named_children())
+    names = [name for name, _ in children]
+    if layer not in names:
+        raise NotImplementedError("Backbone layer {} not implemented, choose one of {}".format(layer, names))
+    index = names.index(layer) + 1
+    return nn.Sequential(*[m for _, m in children[:index]]), nn.Sequential(*[m for _, m in children[index:]])
+
+
+class DenseGridPredictor():
+    """ Embeds the rotated crops of a mosaic centred at many locations, sharing the first layers of the backbone.
+
+        A crop of crop pixels is resized to input_size pixels. The shared layers, of total stride stride, run over
+        windows of the rotated and resized mosaic. In it a crop starts at a fractional pixel o, so its
+        (input_size/stride)^2 block is sampled bilinearly at o/stride from the shared features. The block then goes
+        through the remaining layers and the embedding network, like the features of a crop.
+
+        Shared features differ from those of isolated crops near the crop borders, where the backbone sees the
+        neighbouring pixels instead of zero padding. The difference grows with the receptive field of the shared
+        layers: split after the whole backbone only when an approximate grid is acceptable.
+    """
+
+    def __init__(self, backbone, embedding, device, split='layer1', crop=256, input_size=128, window=1024, halo=32, normalize=True):
+        """
+            Parameters:
+                backbone   -> ResNet feature extractor, e.g. netX or netY
+                embedding  -> Network mapping flattened features to descriptors, e.g. netEMBX or netEMBY
+                split      -> Last backbone layer computed on the whole mosaic
+                crop       -> Size in mosaic pixels of the crop of a cell
+                input_size -> Size of the crop given to the backbone
+                window     -> Crops starting in the same window of this size, in network input pixels, share a pass of the shared layers
+                halo       -> Context added around the crops of a window, in network input pixels
+                normalize  -> If True, images are normalized to [-1, 1] as the normalize preprocessing does
+        """
+        self.shared, self.head = split_backbone(backbone, split)
+        self.embedding = embedding
+        self.device = device
+        with torch.no_grad():
+            self.stride = input_size // self.shared(torch.zeros((1, 3, input_size, input_size), device=device)).shape[-1]
+        self.crop = crop
+        self.input_size = input_size
+        self.window = window
+        self.halo = halo
+        self.normalize = normalize
+        self.resize = input_size / crop
+        self.block = input_size // self.stride
+
+    def window_image(self, mosaic, matrix, origin, size):
+        """ The (3,height,width) tensor at (x, y) origin of (width, height) size, in network input pixels, of the mosaic transformed by matrix and resized """
+        M = matrix.copy()
+        M[:,2] -= np.asarray(origin) / self.resize                  # Origin in mosaic pixels
+        image = cv2.warpAffine(mosaic, M, tuple(int(round(v / self.resize)) for v in size), flags=cv2.INTER_LINEAR)
+        image = cv2.resize(image, tuple(size))
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = torch.from_numpy(image).permute(2,0,1).float().div(255)
+        if self.normalize:
+            image = (image - 0.5) / 0.5
+        return image.to(self.device)
+
+    def predict(self, mosaic, centres, theta):
+        """ Returns the (N,D) descriptors of the crops of a (H,W,3) mosaic centred at (N,2) (x, y) pixels and rotated by theta radians """
+        s = self.stride
+        matrix = cv2.getRotationMatrix2D((mosaic.shape[1] / 2, mosaic.shape[0] / 2), np.rad2deg(theta), 1.0)
+        rotated = centres @ matrix[:,:2].T + matrix[:,2]
+        origins = rotated * self.resize - self.input_size / 2         # Crop origins in network input pixels
+
+        # Crops are grouped by the window their origin falls in, windows start at the first crop
+        cells = np.floor((origins - origins.min(0)) / self.window).astype(int)
+        groups = {}
+        for i, cell in enumerate(map(tuple, cells)):
+            groups.setdefault(cell, []).append(i)
+
+        descriptors = None
+        j = torch.arange(self.block, device=self.device, dtype=torch.float32)
+        for indexes in groups.values():
+            # The shared layers run on the bounding box of the crops of the window and its halo, aligned to the stride
+            lo = np.floor((origins[indexes].min(0) - self.halo) / s) * s
+            hi = np.ceil((origins[indexes].max(0) + self.input_size + self.halo) / s) * s
+            with torch.no_grad():
+                features = self.shared(self.window_image(mosaic, matrix, lo, (hi - lo).astype(int))[None])
+
+                # Blocks of the crops, sampling positions are (x, y) indexes of the feature map
+                k = torch.from_numpy((origins[indexes] - lo) / s).to(self.device, torch.float32)
+                n = k.shape[0]
+                gx = (k[:,0].view(-1,1,1) + j.view(1,1,-1)).expand(-1, self.block, -1)
+                gy = (k[:,1].view(-1,1,1) + j.view(1,-1,1)).expand(-1, -1, self.block)
+                grid = torch.stack([2 * gx / (features.shape[3] - 1) - 1, 2 * gy / (features.shape[2] - 1) - 1], dim=-1)
+                blocks = F.grid_sample(features, grid.reshape(1, n*self.block, self.block, 2), mode='bilinear', align_corners=True)
+                blocks = blocks.view(features.shape[1], n, self.block, self.block).permute(1,0,2,3)
+
+                out = self.head(blocks.contiguous())
+                out = self.embedding(out.reshape(n, -1)).cpu().numpy()
+            if descriptors is None:
+                descriptors = np.zeros((centres.shape[0], out.shape[1]), dtype=out.dtype)
+            descriptors[indexes] = out
+        return descriptors
+
+
+# Networks of the street2vec model that embed each domain, map descriptors are X and aerial ones Y
+DOMAIN_NETWORKS = {'map': 'X', 'aerial': 'Y'}
+
+def predict_dense(model, dataset, opt):
+    """ Returns the X and Y descriptors of the (H,W,T) samples of a MetaTilesPredictDataset, as (H,W,T,D) arrays """
+    domains = [opt.domain] if isinstance(opt.domain, str) else opt.domain
+    missing = [domain for domain in DOMAIN_NETWORKS if domain not in domains]
+    if missing:
+        raise ValueError("Dense prediction needs the map and aerial domains, add {} to --domain".format(' '.join(missing)))
+    coords = dataset._coords
+    H, W, T, _ = coords.shape
+    z = opt.tile_zoom[0]
+    limits = dataset.get_limits(z)
+    pred = {}
+    for domain, name in DOMAIN_NETWORKS.items():
+        if domain not in dataset.mosaics:                           # Kept for the next blocks of a sharded prediction
+            dataset.mosaics[domain] = TileMosaic(limits, z, opt.dataroot, domain, opt.aerial_dir)
+        mosaic = dataset.mosaics[domain]
+        image = np.ascontiguousarray(mosaic.image)
+        centres = np.stack(mosaic.locate(coords[:,:,0,0].ravel(), coords[:,:,0,1].ravel())[1], axis=1).astype(np.float64)
+        predictor = DenseGridPredictor(getattr(model, 'net' + name), getattr(model, 'netEMB' + name), model.device, opt.dense_split,
+                                       input_size=opt.tile_size if domain == 'map' else opt.pano_size,
+                                       window=opt.dense_window, normalize='normalize' in opt.preprocess)
+        descriptors = np.zeros((H*W, T, opt.embedding_dim))
+        for t in range(T):
+            descriptors[:,t] = predictor.predict(image, centres, coords[0,0,t,4])
+            print('{} orientation {}/{} predicted'.format(domain, t+1, T))
+        pred[name] = descriptors.reshape(H, W, T, -1)
+    return pred
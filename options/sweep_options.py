@@ -0,0 +1,15 @@
+from .localize_options import LocalizeOptions
+
+
+class SweepOptions(LocalizeOptions):
+    """This class includes parameter sweep options.
+
+    It also includes shared options defined in LocalizeOptions.
+    """
+
+    def initialize(self, parser):
+        parser = LocalizeOptions.initialize(self, parser)
+
+        parser.add_argument('--grid', type=str, nargs='+', default=[], help='Localizer options to sweep, e.g. "np=5000,10000" "particles_noise=5 5,10 10". Values are separated by commas, arguments of an option by spaces')
+        parser.add_argument('--sweep_workers', type=int, default=1, help='Number of configurations run in parallel')
+        return parser
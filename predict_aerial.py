@@ -5,8 +5,43 @@ import numpy as np
 
 from data import create_dataset
 from models import create_model
+from models.dense_predict import predict_dense
+from aerial.shards import get_blocks, get_shard, block_filename, save_block, merge_blocks
 from options.predict_options import PredictOptions
 
+def predict(model, dataset, opt):
+    """ Returns the X and Y descriptors of the current coordinates of the dataset, as (H,W,T,D) arrays """
+    H,W,T,_ = dataset.dataset._coords.shape
+    n = len(dataset) * opt.num_augmentations
+    print("Number of samples to predict: ", n)
+
+    if opt.dense:
+        return predict_dense(model, dataset.dataset, opt)
+
+    pred = {
+        'X' : np.zeros((n,opt.embedding_dim), dtype=float),
+        'Y' : np.zeros((n,opt.embedding_dim), dtype=float),
+    }
+    
+    for i, data in enumerate(dataset):
+        
+        model.set_input(data) 
+        k1 = opt.batch_size*opt.num_augmentations
+        with torch.no_grad():
+            model.forward()
+            x = model.X_o.cpu().data.numpy()
+            y = model.Y_o.cpu().data.numpy()
+            k2 = x.shape[0]
+            pred['X'][i*k1:(i*k1+k2),:] = x
+            pred['Y'][i*k1:(i*k1+k2),:] = y
+            
+        if i % 10 == 0:  
+            print('{} images processed'.format(k2*i) )
+
+    pred['X'] = pred['X'].reshape(H,W,T,-1)
+    pred['Y'] = pred['Y'].reshape(H,W,T,-1)
+    return pred
+
 if __name__ == '__main__':
     opt = PredictOptions().parse() 
     areas = opt.area if type(opt.area) == list else [opt.area] 
@@ -32,39 +67,32 @@ if __name__ == '__main__':
 
             coords = dataset.dataset._coords
             H,W,T,_ = coords.shape
-            n = len(dataset) * opt.num_augmentations
-            print("Number of samples to predict: ", n)
-            
-            pred = {
-                'X' : np.zeros((n,opt.embedding_dim), dtype=float),
-                'Y' : np.zeros((n,opt.embedding_dim), dtype=float),
-                'coords': dataset.dataset._coords
-            }
-            
-            for i, data in enumerate(dataset):
-                
-                model.set_input(data) 
-                k1 = opt.batch_size*opt.num_augmentations
-                with torch.no_grad():
-                    model.forward()
-                    x = model.X_o.cpu().data.numpy()
-                    y = model.Y_o.cpu().data.numpy()
-                    k2 = x.shape[0]
-                    pred['X'][i*k1:(i*k1+k2),:] = x
-                    pred['Y'][i*k1:(i*k1+k2),:] = y
-                    
-                if i % 10 == 0:  
-                    print('{} images processed'.format(k2*i) )
-
-            pred['X'] = pred['X'].reshape(H,W,T,-1)
-            pred['Y'] = pred['Y'].reshape(H,W,T,-1)
-
             z = opt.tile_zoom[0] if len(opt.tile_zoom) == 1 else -1 
             
             save_filename = '%s_%s_z_%d' % (opt.epoch, opt.area, z)
             save_dir = os.path.join(opt.results_dir, opt.name)
-            print('Finish, {} images processed, predictions saved in {}'.format(n,save_dir))
             if not os.path.isdir(save_dir):
                 os.makedirs(save_dir)
             save_path = os.path.join( save_dir ,save_filename + '.npz')
-            np.savez(save_path, X=pred['X'], Y=pred['Y'], coords=pred['coords'])
\ No newline at end of file
+
+            if opt.shard_size > 0:
+                # Blocks are saved as they finish, existing ones were predicted by an earlier run or another shard
+                for row, col, y0, y1, x0, x1 in get_shard(get_blocks(H, W, opt.shard_size), opt.shard, opt.num_shards):
+                    if os.path.isfile(block_filename(save_path, row, col)):
+                        print('Block {}_{} already predicted'.format(row, col))
+                        continue
+                    dataset.dataset.set_coords(np.ascontiguousarray(coords[y0:y1,x0:x1]))
+                    pred = predict(model, dataset, opt)
+                    save_block(save_path, row, col, pred['X'], pred['Y'], coords[y0:y1,x0:x1])
+                    print('Block {}_{} saved'.format(row, col))
+                dataset.dataset.set_coords(coords)
+
+                missing = merge_blocks(save_path, coords, opt.shard_size)
+                if missing:
+                    print('{} blocks missing, predictions will be merged once every shard finishes'.format(len(missing)))
+                else:
+                    print('Finish, blocks merged in {}'.format(save_path))
+            else:
+                pred = predict(model, dataset, opt)
+                print('Finish, {} images processed, predictions saved in {}'.format(H*W*T*opt.num_augmentations,save_dir))
+                np.savez(save_path, X=pred['X'], Y=pred['Y'], coords=coords)
@@ -0,0 +1,19 @@
+#!/bin/bash
+set -ex
+
+python ./sweep_localize.py \
+    --localizer 'aerialpf' \
+    --expname 'mysweep' \
+    --name 'aerial_model_pretrained' \
+    --area "SP50NW" \
+    --dataroot $DATASETS'digimap_data' \
+    --results_dir $RESULTS \
+    --checkpoints_dir $CHECKPOINTS \
+    --model street2vec \
+    --epoch 'latest' \
+    --dataset_mode None \
+    --seed 440 \
+    --steps 200 \
+    --observation_cache \
+    --sweep_workers 4 \
+    --grid "np=5000,10000,20000" "particles_noise=5 5,10 10" "resampling_threshold=0.5,0.67"
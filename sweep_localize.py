@@ -0,0 +1,141 @@
+""" Run the aerial particle filter for every combination of a grid of localizer options.
+
+    The model, the descriptor grid and the routes are loaded once and shared by all configurations, which are
+    run in a pool of --sweep_workers processes. Options that change the descriptor grid, --descriptor_dtype and
+    --fourier_harmonics, load it once per value, options that change the model, area or routes can not be swept. Statistics of the localization error at each step and the
+    timings of every configuration are written to a single table, results_dir/name/sweep-<expname>-<area>-<seed>.csv
+
+    Example:
+        python sweep_localize.py --localizer aerialpf --name aerial_model_pretrained --area SP50NW --dataset_mode None \\
+            --seed 440 --steps 200 --observation_cache --sweep_workers 4 \\
+            --grid "np=5000,10000,20000" "particles_noise=5 5,10 10" "resampling_threshold=0.5,0.67"
+"""
+import os
+import sys
+import copy
+import time
+import itertools
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import torch
+
+from localizer import create_localizer
+from models import create_model
+from options.sweep_options import SweepOptions
+from utils.util import haversine
+
+_sweep = None
+
+# Options shared by every configuration, they select the model, the area and the routes loaded once
+SHARED_OPTIONS = ['model', 'name', 'epoch', 'dataroot', 'results_dir', 'area', 'seed']
+
+def parse_grid(opt, parser, argv):
+    """ Returns the swept option names and the list of option namespaces of every combination """
+    names, values = [], []
+    for entry in opt.grid:
+        name, choices = entry.split('=', 1)
+        if name in SHARED_OPTIONS:
+            raise NotImplementedError("--{} can not be swept, it is shared by all configurations".format(name))
+        names.append(name)
+        values.append(choices.split(','))
+
+    configs = []
+    for combination in itertools.product(*values):
+        extra = []
+        for name, value in zip(names, combination):
+            if isinstance(getattr(opt, name), bool):
+                extra += ['--' + name] if value.lower() in ['1', 'true', 'yes'] else []
+            else:
+                extra += ['--' + name] + value.split()
+        parsed = parser.parse_args(argv + extra)
+        config = copy.deepcopy(opt)
+        for name in names:
+            setattr(config, name, getattr(parsed, name))
+        config.nosave = True
+        config.workers = 1                                              # Configurations run in daemonic workers, which can not fork
+        configs.append(config)
+    return names, configs
+
+def grid_key(config):
+    """ Returns the options that select the descriptor grid of a configuration """
+    return config.descriptor_dtype, config.fourier_harmonics
+
+def run_config(index):
+    """ Localize with a configuration and return its error at each step and its timings """
+    model, area, grids, working_frame, configs = _sweep
+    config = configs[index]
+    start_time = time.time()
+    localizer = create_localizer(config)
+    localizer.set_model(model)
+    localizer.set_area(area, grids[grid_key(config)], working_frame)
+    localizer.load_routes()
+    results = localizer.localize()
+    wall_time = time.time() - start_time
+
+    trials = config.trials if config.trials is not None else range(localizer.routes.shape[0])
+    estimates = results['estimates'][trials]
+    truth = localizer.routes[trials,:estimates.shape[1]]
+    errors = np.array([[1000 * haversine(e[0], e[1], t[0], t[1]) for e, t in zip(trial_estimates, trial_truth)]
+                       for trial_estimates, trial_truth in zip(estimates, truth)])
+    return index, errors, results['nparticles'][trials], results['times'][trials], wall_time
+
+def init_worker(sweep, threads):
+    global _sweep
+    _sweep = sweep
+    torch.set_num_threads(threads)
+
+
+if __name__ == '__main__':
+    options = SweepOptions()
+    opt = options.parse()
+    names, configs = parse_grid(opt, options.parser, sys.argv[1:])
+    print('{} configurations to run'.format(len(configs)))
+
+    # Load the model, the descriptor grid and the observations once
+    model = create_model(opt)
+    model.setup(opt)
+    model.eval()
+    localizer = create_localizer(configs[0])
+    localizer.set_model(model)
+    localizer.setup()
+    if localizer.observation_cache is not None:
+        steps = opt.steps if opt.steps is not None else localizer.routes.shape[1]
+        trials = opt.trials if opt.trials is not None else range(localizer.routes.shape[0])
+        for trial in trials:
+            for _ in localizer.route_observations(trial, steps):
+                pass
+    grids = {grid_key(configs[0]): localizer.map_features}
+    for config in configs:
+        if grid_key(config) not in grids:
+            grids[grid_key(config)] = localizer.area.get_map_descriptors(opt.name, opt.epoch, *grid_key(config))[0]
+    sweep = (model, localizer.area, grids, localizer.working_frame, configs)
+
+    workers = min(opt.sweep_workers, len(configs))
+    threads = max(1, torch.get_num_threads() // workers)
+    rows = []
+    start_time = time.time()
+    with mp.get_context('fork').Pool(workers, initializer=init_worker, initargs=(sweep, threads)) as pool:
+        for index, errors, nparticles, times, wall_time in pool.imap_unordered(run_config, range(len(configs))):
+            config = configs[index]
+            print('Configuration {} ({}) finished in {:.1f} s, final MLE {:.1f} m'.format(
+                index, ', '.join('{}={}'.format(n, getattr(config, n)) for n in names), wall_time, np.median(errors[:,-1])))
+            for step in range(errors.shape[1]):
+                row = {'config': index}
+                row.update({name: getattr(config, name) for name in names})
+                row.update({
+                    'step': step,
+                    'mle_mean': errors[:,step].mean(),
+                    'mle_median': np.median(errors[:,step]),
+                    'mle_p90': np.percentile(errors[:,step], 90),
+                    'nparticles': nparticles[:,step].mean(),
+                    'step_time': times[:,step].mean(),
+                    'wall_time': wall_time
+                })
+                rows.append(row)
+
+    table = pd.DataFrame(rows).sort_values(['config', 'step'])
+    filename = 'sweep-{}-{}-{}.csv'.format(opt.expname, opt.area, opt.seed)
+    path = os.path.join(opt.results_dir, opt.name, filename)
+    table.to_csv(path, index=False)
+    print('{} configurations finished in {:.1f} s, results saved in {}'.format(len(configs), time.time() - start_time, path))
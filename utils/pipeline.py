@@ -0,0 +1,52 @@
+"""This module contains a helper to overlap the production of items with their consumption """
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher():
+    """ Iterates over an iterator while its next items are computed in a background thread.
+
+        The iterator is advanced by a single thread, so it can be a generator. busy holds the time spent computing
+        each item and waiting the time the consumer was blocked on it; the difference is the time hidden by the overlap.
+    """
+
+    _end = object()
+
+    def __init__(self, iterator, depth=1):
+        """
+            Parameters:
+                iterator -> Iterator producing the items
+                depth    -> Number of items computed ahead of the consumer
+        """
+        self.iterator = iterator
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.busy = []
+        self.waiting = []
+        self.futures = deque(self.executor.submit(self._produce) for _ in range(depth))
+
+    def _produce(self):
+        start_time = time.perf_counter()
+        item = next(self.iterator, self._end)
+        if item is not self._end:
+            self.busy.append(time.perf_counter() - start_time)
+        return item
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start_time = time.perf_counter()
+        item = self.futures.popleft().result()
+        self.waiting.append(time.perf_counter() - start_time)
+        if item is self._end:
+            raise StopIteration
+        self.futures.append(self.executor.submit(self._produce))
+        return item
+
+    def hidden(self):
+        """ Time in seconds spent computing items while the consumer was doing something else """
+        return max(0.0, sum(self.busy) - sum(self.waiting))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
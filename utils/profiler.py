@@ -0,0 +1,147 @@
+"""This module contains a profiler of the phases of each localization step and a summary of its JSON-lines records
+
+    Usage (from the repository root):
+        python -m utils.profiler <results_dir>/<name>/profile-<expname>-<area>-<seed>.jsonl [more files]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+
+PHASES = ['sense', 'odometry', 'embed', 'init', 'motion', 'interpolate', 'weight', 'resample', 'estimate', 'total']
+
+
+class StepProfiler():
+    """ Records the duration of the phases of every (trial, step) and writes one JSON object per step to a JSON-lines file.
+
+        Durations are stored under the (trial, step) they belong to, so phases can be timed from another thread, e.g.
+        sensing in a Prefetcher. Phases of the main thread use the step given to begin(). When end() is called the
+        phases and metrics of the step become a line {"trial", "step", "phases": {name: seconds}, metrics...}.
+        Lines are buffered and appended to the file every flush_every steps with a single write, so processes
+        forked from the same profiler can share the file. When path is None the profiler does nothing.
+    """
+
+    def __init__(self, path=None, flush_every=1000):
+        """
+            Parameters:
+                path        -> JSON-lines file, None disables the profiler
+                flush_every -> Number of steps buffered before they are written
+        """
+        self.path = path
+        self.enabled = path is not None
+        self.flush_every = flush_every
+        self.current = None
+        self.steps = {}
+        self.lines = []
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """ Truncate the file """
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            open(self.path, 'w').close()
+
+    def begin(self, trial, step):
+        """ Phases timed without an explicit trial and step are added to this one """
+        self.current = (trial, step)
+
+    def _record(self, key):
+        if key not in self.steps:
+            self.steps[key] = {'phases': {}, 'metrics': {}}
+        return self.steps[key]
+
+    def add(self, name, seconds, trial=None, step=None):
+        """ Add a duration in seconds to a phase of a step, the current one by default """
+        if not self.enabled:
+            return
+        key = self.current if trial is None else (trial, step)
+        with self.lock:
+            phases = self._record(key)['phases']
+            phases[name] = phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def _timed(self, name, trial, step):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time, trial, step)
+
+    def phase(self, name, trial=None, step=None):
+        """ Context manager timing a phase of a step, the current one by default """
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(name, trial, step)
+
+    def note(self, **metrics):
+        """ Set metrics of the current step, e.g. the number of effective particles """
+        if not self.enabled:
+            return
+        with self.lock:
+            self._record(self.current)['metrics'].update(metrics)
+
+    def end(self, trial, step, **metrics):
+        """ Finish a step, its record is written with the given metrics """
+        if not self.enabled:
+            return
+        with self.lock:
+            record = self.steps.pop((trial, step), {'phases': {}, 'metrics': {}})
+        line = {'trial': int(trial), 'step': int(step), 'phases': record['phases']}
+        line.update(record['metrics'])
+        line.update(metrics)
+        self.lines.append(json.dumps(line))
+        if len(self.lines) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """ Append the buffered lines to the file """
+        if not self.enabled or not self.lines:
+            return
+        data = ('\n'.join(self.lines) + '\n').encode()
+        self.lines = []
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def load_profile(paths):
+    """ Returns the records of a list of JSON-lines files """
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+def summarize(records, percentiles=(50, 95, 99)):
+    """ Returns a dict with the number of steps and the percentiles in milliseconds of every phase across all records """
+    names = [name for name in PHASES if any(name in r['phases'] for r in records)]
+    names += sorted({name for r in records for name in r['phases']} - set(names))
+    summary = {}
+    for name in names:
+        times = 1000 * np.array([r['phases'][name] for r in records if name in r['phases']])
+        summary[name] = {'steps': times.shape[0], 'mean': times.mean(), **{'p{}'.format(p): np.percentile(times, p) for p in percentiles}}
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', type=str, nargs='+', help='JSON-lines files written with --profile')
+    opt = parser.parse_args()
+
+    records = load_profile(opt.paths)
+    trials = sorted({r['trial'] for r in records})
+    print('{} steps of {} trials'.format(len(records), len(trials)))
+    print('{:>12} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('phase', 'steps', 'mean (ms)', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'))
+    for name, stats in summarize(records).items():
+        print('{:>12} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(name, stats['steps'], stats['mean'], stats['p50'], stats['p95'], stats['p99']))
+
+    for metric in ['nparticles', 'neff', 'mle']:
+        values = np.array([r[metric] for r in records if r.get(metric) is not None])
+        if values.shape[0] > 0:
+            print('{:>12} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(metric, values.shape[0], values.mean(), *np.percentile(values, [50, 95, 99])))